@@ -2,6 +2,9 @@ from typing import List, Dict
 from qwen_agent.agents import Assistant
 from qwen_agent import Agent
 
+from ..prompts.schemas import (LAYER_DESIGN_SCHEMA, LAYER_ROUTING_SCHEMA,
+                               json_mode_enabled, json_mode_config, output_contract)
+
 class TopAgentsFactory:
     """TOP层智能体工厂类"""
     
@@ -9,6 +12,26 @@ class TopAgentsFactory:
         self.llm_config = llm_config
         self.progress_tracker = progress_tracker
         self.file_saver = file_saver
+        self.json_mode = json_mode_enabled(llm_config)
+    
+    def _structured_output_agent(self, schema: Dict) -> Dict:
+        """结构化输出Agent的公共参数
+
+        默认挂载进度和文件保存工具，system_message末尾追加schema约定（放在代码块中）。
+        BANNER_JSON_MODE=on 且模型支持时开启response_format，此时不挂载工具（JSON模式与工具调用
+        不能同时使用），只有输出文件由调用方保存的流程才应开启。
+        """
+        if self.json_mode:
+            return {
+                'contract': output_contract(schema, json_mode=True),
+                'function_list': [],
+                'llm': json_mode_config(self.llm_config)
+            }
+        return {
+            'contract': output_contract(schema, json_mode=False),
+            'function_list': [self.progress_tracker, self.file_saver],
+            'llm': self.llm_config
+        }
     
     def create_event_analysis_agent(self) -> Agent:
         """创建事件分析Agent"""
@@ -106,6 +129,7 @@ class TopAgentsFactory:
     
     def create_layer_routing_agent(self) -> Agent:
         """创建图层路由代理"""
+        structured = self._structured_output_agent(LAYER_ROUTING_SCHEMA)
         return Assistant(
             name="图层路由代理",
             description="专业的路由代理，负责分析Banner设计方案并将每个图层分配给相应的专业代理",
@@ -194,13 +218,14 @@ class TopAgentsFactory:
             3. 参数配置清单：每个图层的详细输入参数
             4. 执行要求规范：每个图层的输出标准和质量要求
             5. JSON格式输出：标准化的路由配置文件（使用UTF-8编码）
-            """,
-            function_list=[self.progress_tracker, self.file_saver],
-            llm=self.llm_config
+            """ + structured['contract'],
+            function_list=structured['function_list'],
+            llm=structured['llm']
         )
     
     def create_layer_design_agent(self) -> Agent:
         """创建图层设计Agent"""
+        structured = self._structured_output_agent(LAYER_DESIGN_SCHEMA)
         return Assistant(
             name="图层设计师",
             description="经验丰富的设计专家，擅长将营销策略转化为具体的图层设计方案",
@@ -315,6 +340,7 @@ class TopAgentsFactory:
       \"agent\": \"背景图层执行师\",
       \"tool\": \"image_gen\",
       \"input\": \"背景描述prompt\",
+      \"display_size\": \"1200x600\",
       \"output\": [\"background.png\"],
       \"specifications\": \"尺寸和风格要求\"
     },
@@ -322,15 +348,16 @@ class TopAgentsFactory:
       \"agent\": \"主要素图层执行师\",
       \"tool\": \"image_gen\",
       \"input\": \"主元素描述prompt\",
+      \"display_size\": \"600x400\",
       \"output\": [\"main_element.png\"],
       \"specifications\": \"透明背景和尺寸要求\"
     },
     \"logo\": {
       \"agent\": \"表意标识图层执行师\",
-      \"tool\": \"code_interpreter或image_gen\",
+      \"tool\": \"code_interpreter\",
       \"input\": \"标识设计要求\",
-      \"output\": [\"logo.svg或logo.png\"],
-      \"specifications\": \"矢量或位图要求\"
+      \"output\": [\"logo.svg\"],
+      \"specifications\": \"矢量图形要求（需要位图Logo时tool改为image_gen，output改为[\\\"logo.png\\\"]）\"
     },
     \"text\": {
       \"agent\": \"文字层执行师\",
@@ -348,9 +375,10 @@ class TopAgentsFactory:
     }
   }
 }
-通过以上专业的图层设计能力，你将为Banner制作提供高质量、一致性强的设计方案。""",
-function_list=[self.progress_tracker, self.file_saver],
-llm=self.llm_config
+```
+通过以上专业的图层设计能力，你将为Banner制作提供高质量、一致性强的设计方案。""" + structured['contract'],
+function_list=structured['function_list'],
+llm=structured['llm']
 )
 
     def create_html_render_agent(self) -> Agent:
@@ -12,6 +12,8 @@ import time
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.service import Service  # 添加这行导入
 
+from ..utils.rate_limiter import governed_chat
+
 class ValidationAgentsFactory:
     """验证和优化Agent工厂类"""
     
@@ -170,7 +172,7 @@ HTML代码：
             }]
             
             # 调用VL模型
-            response = self.vl_model.chat(messages)
+            response = governed_chat(self.vl_model, messages)
             
             # 解析响应
             validation_result = {
@@ -7,6 +7,18 @@ from datetime import datetime
 import re
 from background_layer_filter_agent import BackgroundLayerFilterAgent
 from qwen_agent.agents import Assistant
+try:
+    from .utils.rate_limiter import governed_run
+    from .utils.image_backends import get_image_backend, extract_colors
+    from .utils.tracing import traced
+    from .utils.image_ingest import ingest_image, target_box_from_spec
+    from .utils.json_repair import loads_lenient
+except ImportError:
+    from utils.rate_limiter import governed_run
+    from utils.image_backends import get_image_backend, extract_colors
+    from utils.tracing import traced
+    from utils.image_ingest import ingest_image, target_box_from_spec
+    from utils.json_repair import loads_lenient
 import dashscope
 
 # 设置API密钥
@@ -15,7 +27,8 @@ dashscope.api_key = ""
 class BackgroundImageGenerator:
     """专门用于根据背景层内容生成背景图像的Agent"""
     
-    def __init__(self, layer_type: str = "背景层", output_dir: str = None):
+    def __init__(self, layer_type: str = "背景层", output_dir: str = None, image_backend: str = None,
+                 target_box: Tuple[int, int] = None, originals_dir: str = None):
         # 设置图层类型
         self.layer_type = layer_type
         
@@ -27,6 +40,15 @@ class BackgroundImageGenerator:
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.filter_agent = BackgroundLayerFilterAgent()
         
+        # 图像生成后端（默认Pollinations，可通过参数或环境变量 BANNER_IMAGE_BACKEND 切换）；
+        # 生成时已拿到的图像内容按URL缓存，避免重复下载
+        self.image_backend = get_image_backend(image_backend)
+        self._generated_images: Dict[str, bytes] = {}
+        
+        # 入库时按展示尺寸裁剪缩放；未指定目标框时从图层内容中的尺寸字段读取，原图另存以便重新裁剪
+        self.target_box = target_box
+        self.originals_dir = Path(originals_dir) if originals_dir else self.output_dir / 'originals'
+        
         # 设置过滤器的图层类型
         self.filter_agent.set_layer_type(layer_type)
         
@@ -77,7 +99,7 @@ class BackgroundImageGenerator:
         ]
         
         try:
-            response_generator = self.filename_extractor.run(messages)
+            response_generator = governed_run(self.filename_extractor, messages)
             responses = []
             for response in response_generator:
                 responses.extend(response)
@@ -102,6 +124,7 @@ class BackgroundImageGenerator:
             print(f"文件名提取失败: {e}，使用默认文件名")
             return "background.png"
     
+    @traced('layer.extract', target='filename')
     def extract_filename_from_background_content(self, background_content: str) -> str:
         """从背景层内容中提取文件名（包含Agent方法和备用方法）"""
         try:
@@ -131,6 +154,7 @@ class BackgroundImageGenerator:
                 print(f"传统提取方法也失败: {e}")
                 return "background.png"
     
+    @traced('layer.extract', target='size')
     def extract_image_size_with_agent(self, background_content: str) -> Tuple[int, int]:
         """使用Qwen Agent智能提取图像尺寸"""
         size_prompt = """
@@ -153,7 +177,7 @@ class BackgroundImageGenerator:
         ]
         
         try:
-            response_generator = self.size_extractor.run(messages)
+            response_generator = governed_run(self.size_extractor, messages)
             responses = []
             for response in response_generator:
                 responses.extend(response)
@@ -199,7 +223,7 @@ class BackgroundImageGenerator:
         ]
         
         try:
-            response_generator = self.prompt_extractor.run(messages)
+            response_generator = governed_run(self.prompt_extractor, messages)
             responses = []
             for response in response_generator:
                 responses.extend(response)
@@ -219,6 +243,7 @@ class BackgroundImageGenerator:
             print(f"提示词提取失败: {e}，使用默认提示词")
             return "elegant background design, gradient colors, modern style"
     
+    @traced('layer.prompt')
     def extract_prompt_from_background_content(self, background_content: str) -> str:
         """从背景层内容中提取图像生成提示词（保留原方法作为备用）"""
         try:
@@ -230,14 +255,11 @@ class BackgroundImageGenerator:
             
             # 备用的传统提取方法
             try:
-                # 尝试解析JSON格式的内容
-                if '{' in background_content and '}' in background_content:
-                    # 提取JSON部分
-                    json_match = re.search(r'\{[^}]*"prompt"[^}]*\}', background_content)
-                    if json_match:
-                        json_data = json.loads(json_match.group())
-                        if 'prompt' in json_data:
-                            return json_data['prompt']
+                # 尝试解析JSON格式的内容（本地容错解析，兼容代码块、尾逗号、单引号等）
+                if '{' in background_content:
+                    json_data = loads_lenient(background_content)
+                    if isinstance(json_data, dict) and json_data.get('prompt'):
+                        return json_data['prompt']
                 
                 # 如果没有找到JSON格式，尝试提取描述性文本
                 lines = background_content.split('\n')
@@ -260,41 +282,31 @@ class BackgroundImageGenerator:
                 print(f"传统提取方法也失败: {e}")
                 return "elegant background design, gradient colors, modern style"
     
-    def generate_image_with_pollinations(self, prompt: str, width: int = 1024, height: int = 768) -> Optional[str]:
-        """使用Pollinations.ai API生成图像"""
+    @traced('layer.generate')
+    def generate_image(self, prompt: str, width: int = 1024, height: int = 768, colors: list = None) -> Optional[str]:
+        """使用配置的图像后端生成图像，返回图像URL"""
         try:
-            # Pollinations.ai的图像生成API
-            api_url = f"https://image.pollinations.ai/prompt/{requests.utils.quote(prompt)}"
-            
-            # 添加一些参数来提高图像质量
-            params = {
-                'width': width,
-                'height': height,
-                'seed': -1,  # 随机种子
-                'model': 'flux'  # 使用flux模型
-            }
-            
-            # 构建完整URL
-            param_string = '&'.join([f"{k}={v}" for k, v in params.items()])
-            full_url = f"{api_url}?{param_string}"
-            
             print(f"正在生成图像，提示词: {prompt}")
             print(f"图像尺寸: {width}x{height}")
-            print(f"API URL: {full_url}")
             
-            # 发送请求
-            response = requests.get(full_url, timeout=30)
+            result = self.image_backend.generate(prompt, width, height, colors=colors)
+            full_url = result['url']
+            self._generated_images[full_url] = result['content']
             
-            if response.status_code == 200:
-                return full_url
-            else:
-                print(f"API请求失败，状态码: {response.status_code}")
-                return None
+            print(f"API URL: {full_url}")
+            cached = "（缓存）" if result.get('cached') else ""
+            print(f"图像后端: {result['backend']}{cached}，耗时 {result['latency']:.1f}s")
+            return full_url
                 
         except Exception as e:
             print(f"图像生成失败: {e}")
             return None
     
+    def generate_image_with_pollinations(self, prompt: str, width: int = 1024, height: int = 768) -> Optional[str]:
+        """兼容旧接口，等同于 generate_image"""
+        return self.generate_image(prompt, width, height)
+    
+    @traced('layer.save')
     def download_and_save_image(self, image_url: str, prompt: str, background_content: str = "", use_timestamp: bool = True) -> Optional[str]:
         """下载并保存图像到本地，使用Agent提取的文件名"""
         try:
@@ -315,6 +327,15 @@ class BackgroundImageGenerator:
             print(f"正在下载图像到: {filepath}")
             print(f"基础文件名: {base_filename}")
             
+            # 生成阶段已拿到图像内容时直接写入，避免再次请求得到不同的随机结果
+            content = self._generated_images.pop(image_url, None)
+            if content is not None:
+                with open(filepath, 'wb') as f:
+                    f.write(content)
+                
+                print(f"图像保存成功: {filepath}")
+                return str(filepath)
+            
             # 下载图像
             response = requests.get(image_url, timeout=30)
             
@@ -347,8 +368,8 @@ class BackgroundImageGenerator:
             filename = self.extract_filename_from_background_content(background_content)
             print(f"提取的文件名: {filename}")
             
-            # 生成图像URL
-            image_url = self.generate_image_with_pollinations(prompt, width, height)
+            # 生成图像URL（背景层内容中的颜色值供本地后端取色）
+            image_url = self.generate_image(prompt, width, height, colors=extract_colors(background_content))
             if not image_url:
                 return {
                     'status': 'error',
@@ -370,11 +391,15 @@ class BackgroundImageGenerator:
                     'filename': filename
                 }
             
+            # 按展示尺寸裁剪缩放
+            ingest = self.ingest_image(local_path, background_content)
+            
             return {
                 'status': 'success',
                 'prompt': prompt,
                 'image_url': image_url,
                 'local_path': local_path,
+                'ingest': ingest,
                 'size': f"{width}x{height}",
                 'width': width,
                 'height': height,
@@ -390,6 +415,16 @@ class BackgroundImageGenerator:
                 'filename': filename if 'filename' in locals() else 'background.png'
             }
     
+    @traced('layer.ingest')
+    def ingest_image(self, local_path: str, layer_content: str = "") -> Dict[str, Any]:
+        """把保存的图像裁剪缩放到图层的展示尺寸"""
+        target_box = self.target_box or target_box_from_spec(layer_content)
+        try:
+            return ingest_image(local_path, target_box, str(self.originals_dir))
+        except Exception as e:
+            print(f"⚠️ 图像入库裁剪失败: {e}")
+            return {'status': 'error', 'error': str(e)}
+    
     def set_layer_type(self, layer_type: str):
         """设置图层类型"""
         self.layer_type = layer_type
@@ -425,7 +460,7 @@ class BackgroundImageGenerator:
         ]
         
         try:
-            response_generator = self.filename_extractor.run(messages)
+            response_generator = governed_run(self.filename_extractor, messages)
             responses = []
             for response in response_generator:
                 responses.extend(response)
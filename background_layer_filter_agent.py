@@ -2,6 +2,12 @@ import json
 import os
 from typing import Dict, Any, Optional
 from qwen_agent.agents import Assistant
+try:
+    from .utils.rate_limiter import governed_run
+    from .utils.tracing import traced
+except ImportError:
+    from utils.rate_limiter import governed_run
+    from utils.tracing import traced
 import dashscope
 
 # 设置API密钥
@@ -36,6 +42,7 @@ class BackgroundLayerFilterAgent:
         """设置要过滤的图层类型"""
         self.layer_type = layer_type
     
+    @traced('layer.filter')
     def filter_layer(self, layer_content: str, layer_type: str = None) -> str:
         """从图层内容中过滤出指定图层信息"""
         
@@ -51,7 +58,7 @@ class BackgroundLayerFilterAgent:
         
         try:
             # 使用Assistant的run方法
-            response_generator = self.agent.run(messages)
+            response_generator = governed_run(self.agent, messages)
             
             # 获取响应
             responses = []
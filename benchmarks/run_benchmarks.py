@@ -0,0 +1,188 @@
+"""Banner生成端到端基准测试
+
+在Workflow和传统两种模式下，对事件语料逐个运行 generate_banner，记录各阶段
+（top_agents、layers、render、vl_loop）的耗时、CPU时间、峰值内存增量、模型调用次数
+和写入字节数，结果写入JSON文件；任一阶段超出预算时以非零状态退出。
+
+默认以replay模式运行，需先用record模式录制夹具：
+    python -m banner_system.benchmarks.run_benchmarks --transport record
+    python -m banner_system.benchmarks.run_benchmarks
+
+录制和回放必须使用同一个图像后端（默认local）：渲染提示词中包含图像文件大小等与后端相关的内容，
+换后端后请求指纹不同，回放会找不到夹具。录制时后端名称写入夹具目录的 meta.json，回放时校验。
+持久化的语义缓存和共享资源库在基准测试中关闭，保证每次运行走相同的调用路径。
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from typing import Dict, Any, List
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 支持直接以脚本方式运行
+sys.path.insert(0, os.path.dirname(os.path.dirname(BENCHMARK_DIR)))
+
+from banner_system.core.enhanced_system import WorkflowEnhancedBannerSystem
+from banner_system.utils.llm_transport import set_transport
+from banner_system.utils.profiler import peak_rss_mb, directory_bytes
+
+MODES = ('traditional', 'workflow')
+DEFAULT_IMAGE_BACKEND = 'local'
+FIXTURE_META = 'meta.json'
+PHASES = ('top_agents', 'layers', 'render', 'vl_loop')
+
+
+def load_json(path: str) -> Any:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _wait_for_new_run_dir(last_started: float):
+    """项目目录按秒级时间戳命名，确保相邻两次运行不会落到同一目录"""
+    while int(time.time()) == int(last_started):
+        time.sleep(0.05)
+
+
+def run_case(mode: str, event: Dict[str, str], llm_config: Dict[str, Any]) -> Dict[str, Any]:
+    """运行单个事件，返回各阶段统计"""
+    system = WorkflowEnhancedBannerSystem(llm_config=llm_config, use_workflow=(mode == 'workflow'))
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    result = system.generate_banner(event['event_name'], event.get('additional_requirements', ''))
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+
+    phases = system.profiler.summary()
+    return {
+        'mode': mode,
+        'event_name': event['event_name'],
+        'status': result.get('status'),
+        'error': result.get('error'),
+        'work_dir': system.work_dir,
+        'phases': phases,
+        'total': {
+            'wall_seconds': round(wall, 3),
+            'cpu_seconds': round(cpu, 3),
+            'llm_calls': sum(p.get('llm_calls', 0) for p in phases.values()),
+            'image_calls': sum(p.get('image_calls', 0) for p in phases.values()),
+            'bytes_written': directory_bytes(system.work_dir),
+            # 进程生命周期内的峰值，同一进程中后面的用例会继承前面用例的峰值
+            'process_peak_rss_mb': peak_rss_mb()
+        }
+    }
+
+
+def check_budgets(case: Dict[str, Any], budgets: Dict[str, Any]) -> List[str]:
+    """对比各阶段统计与预算，返回超出预算的描述"""
+    violations = []
+    mode_budgets = budgets.get(case['mode'], {})
+    for phase, limits in mode_budgets.items():
+        stats = case['total'] if phase == 'total' else case['phases'].get(phase)
+        if not stats:
+            continue
+        for metric, limit in limits.items():
+            value = stats.get(metric)
+            if value is not None and value > limit:
+                violations.append(f"{case['mode']}/{case['event_name']}/{phase}: {metric}={value} 超出预算 {limit}")
+    return violations
+
+
+def check_fixture_backend(transport: str, fixture_dir: str, image_backend: str) -> bool:
+    """record时记录图像后端，replay时确认与录制时一致"""
+    meta_path = os.path.join(fixture_dir, FIXTURE_META)
+    if transport == 'record':
+        os.makedirs(fixture_dir, exist_ok=True)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'image_backend': image_backend}, f, ensure_ascii=False, indent=2)
+        return True
+    if transport == 'replay' and os.path.exists(meta_path):
+        recorded = load_json(meta_path).get('image_backend')
+        if recorded != image_backend:
+            print(f"❌ 夹具录制时的图像后端为 {recorded}，当前为 {image_backend}；"
+                  f"请使用 --image-backend {recorded} 回放，或用当前后端重新录制")
+            return False
+    return True
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Banner生成端到端基准测试')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--events', default=os.path.join(BENCHMARK_DIR, 'events.json'))
+    parser.add_argument('--budgets', default=os.path.join(BENCHMARK_DIR, 'budgets.json'))
+    parser.add_argument('--output', default=None, help='结果JSON路径，默认写入 benchmarks/results/')
+    parser.add_argument('--transport', choices=('live', 'record', 'replay'), default='replay')
+    parser.add_argument('--fixture-dir', default=os.path.join(BENCHMARK_DIR, 'fixtures'))
+    parser.add_argument('--replay-latency', default='0', help="回放延迟：0、real或缩放系数")
+    parser.add_argument('--image-backend', default=DEFAULT_IMAGE_BACKEND,
+                        help='图像后端名称，录制和回放需一致（默认local）')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--model', default='qwen-max')
+    args = parser.parse_args(argv)
+
+    os.environ['BANNER_IMAGE_BACKEND'] = args.image_backend
+    # 持久化缓存会让首次和后续运行走不同的调用路径，录制与回放也可能不一致
+    os.environ['BANNER_SEMANTIC_CACHE'] = 'off'
+    os.environ['BANNER_ASSET_STORE'] = 'off'
+    if not check_fixture_backend(args.transport, args.fixture_dir, args.image_backend):
+        return 2
+    set_transport(args.transport, args.fixture_dir, args.replay_latency)
+
+    events = load_json(args.events)
+    budgets = load_json(args.budgets) if os.path.exists(args.budgets) else {}
+
+    cases = []
+    violations = []
+    last_started = 0.0
+    for mode in args.modes:
+        for _ in range(args.repeat):
+            for event in events:
+                _wait_for_new_run_dir(last_started)
+                last_started = time.time()
+                print(f"\n=== 基准测试：{mode} / {event['event_name']} ===")
+                case = run_case(mode, event, {'model': args.model})
+                case_violations = check_budgets(case, budgets)
+                case['budget_violations'] = case_violations
+                violations.extend(case_violations)
+                cases.append(case)
+
+    results = {
+        'created_at': datetime.datetime.now().isoformat(),
+        'transport': args.transport,
+        'replay_latency': args.replay_latency,
+        'image_backend': os.getenv('BANNER_IMAGE_BACKEND'),
+        'cases': cases,
+        'budget_violations': violations
+    }
+
+    output = args.output
+    if output is None:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = os.path.join(BENCHMARK_DIR, 'results', f"benchmark_{timestamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print("\n=== 基准测试完成 ===")
+    print(f"结果文件：{output}")
+    for case in cases:
+        phases = ', '.join(
+            f"{phase} {case['phases'][phase]['wall_seconds']}s"
+            for phase in PHASES if phase in case['phases']
+        )
+        print(f"{case['mode']} / {case['event_name']}: {case['status']}，总耗时 {case['total']['wall_seconds']}s（{phases}）")
+
+    if violations:
+        print("\n❌ 以下阶段超出预算：")
+        for violation in violations:
+            print(f"  - {violation}")
+        return 1
+    print("\n✅ 所有阶段均在预算内")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,6 @@
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Iterator, List, Optional, Union
 from qwen_agent import Agent
 from qwen_agent.agents import Assistant, Router
@@ -7,9 +10,18 @@ from qwen_agent.tools import BaseTool
 
 from ..agents.top_agents import TopAgentsFactory
 from ..agents.validation_agents import ValidationAgentsFactory
+from ..agents.layer_agents import LayerAgentsFactory, LayerGenerationAgent
 from ..tools.file_saver import EnhancedFileSaver
 from ..tools.progress_tracker import ProgressTracker
 from ..utils.helpers import FileHelper
+from ..utils.layer_specs import parse_design_output, parse_routing_output
+from ..utils.layer_router import (route_design, format_routing_result, rule_routing_enabled,
+                                  unknown_layers_design, merge_llm_routes)
+from ..utils.rate_limiter import governed_run
+from ..utils.profiler import PhaseProfiler
+
+# 图层生成的最大并发数（标准图层共6个）
+MAX_LAYER_WORKERS = 6
 
 class BannerWorkflow(Agent):
     """基于Qwen Agent Workflow的Banner生成系统"""
@@ -25,6 +37,7 @@ class BannerWorkflow(Agent):
         self.file_saver = EnhancedFileSaver(self.work_dir)
         self.progress_tracker = ProgressTracker(self.work_dir)
         self.file_helper = FileHelper(self.work_dir)
+        self.profiler = PhaseProfiler(self.work_dir)
         
         # 初始化Agent工厂
         self.top_factory = TopAgentsFactory(llm_config, self.progress_tracker, self.file_saver)
@@ -41,8 +54,11 @@ class BannerWorkflow(Agent):
         self.vl_validation_agent = self.validation_factory.create_vl_validation_agent()
         self.html_optimization_agent = self.validation_factory.create_html_optimization_agent()
         
-        # 创建图层生成Router
-        self.layer_router = self._create_layer_router()
+        # 图层名称 -> 图层生成代理的分派表，图层名称已知，不再经过路由模型选择代理
+        self.layer_agents = self._create_layer_dispatch_table()
+        
+        # (设计方案文本, parse_design_output结果)，图层路由和图层生成共用一次解析
+        self._design_parsed = None
         
         # 创建主路由器
         self.main_router = Router(
@@ -52,7 +68,7 @@ class BannerWorkflow(Agent):
                 self.marketing_agent, 
                 self.design_agent,
                 self.routing_agent,
-                self.layer_router,
+                *self.layer_agents.values(),
                 self.render_agent,
                 self.vl_validation_agent
             ],
@@ -65,26 +81,24 @@ class BannerWorkflow(Agent):
         # 提取事件信息
         event_info = self._extract_event_info(messages)
         
-        # 阶段1：事件分析
-        yield from self._phase_event_analysis(event_info)
-        
-        # 阶段2：营销策划
-        yield from self._phase_marketing_planning(event_info)
-        
-        # 阶段3：设计规划
-        yield from self._phase_design_planning(event_info)
-        
-        # 阶段4：图层路由
-        yield from self._phase_layer_routing(event_info)
+        # 阶段1-4：事件分析、营销策划、设计规划、图层路由（统计为top_agents）
+        with self.profiler.phase('top_agents'):
+            yield from self._phase_event_analysis(event_info)
+            yield from self._phase_marketing_planning(event_info)
+            yield from self._phase_design_planning(event_info)
+            yield from self._phase_layer_routing(event_info)
         
         # 阶段5：图层生成
-        yield from self._phase_layer_generation(event_info)
+        with self.profiler.phase('layers'):
+            yield from self._phase_layer_generation(event_info)
         
         # 阶段6：HTML渲染
-        yield from self._phase_html_rendering(event_info)
+        with self.profiler.phase('render'):
+            yield from self._phase_html_rendering(event_info)
         
         # 阶段7：VL验证优化
-        yield from self._phase_vl_optimization(event_info)
+        with self.profiler.phase('vl_loop'):
+            yield from self._phase_vl_optimization(event_info)
         
         # 阶段8：最终报告
         yield from self._phase_final_report(event_info)
@@ -96,7 +110,7 @@ class BannerWorkflow(Agent):
             f"请对事件'{event_info['event_name']}'进行深度分析。附加要求：{event_info.get('requirements', '')}"
         )
         
-        for response in self.analysis_agent.run([analysis_message]):
+        for response in governed_run(self.analysis_agent, [analysis_message]):
             yield response
             # 保存分析结果
             self._save_phase_result('event_analysis', response)
@@ -111,7 +125,7 @@ class BannerWorkflow(Agent):
             f"基于事件分析结果，制定营销策划方案。\n\n事件分析：{analysis_result}"
         )
         
-        for response in self.marketing_agent.run([marketing_message]):
+        for response in governed_run(self.marketing_agent, [marketing_message]):
             yield response
             self._save_phase_result('marketing_planning', response)
     
@@ -142,7 +156,7 @@ class BannerWorkflow(Agent):
             f"制定6个图层的设计方案。\n\n事件分析要点：{analysis_key}\n\n营销策划要点：{marketing_key}"
         )
         
-        for response in self.design_agent.run([design_message]):
+        for response in governed_run(self.design_agent, [design_message]):
             yield response
             self._save_phase_result('design_planning', response)
     
@@ -156,7 +170,7 @@ class BannerWorkflow(Agent):
             f"生成最终HTML Banner。\n\n项目：{event_info['event_name']}\n\n设计要求：{key_results}"
         )
         
-        for response in self.render_agent.run([render_message]):
+        for response in governed_run(self.render_agent, [render_message]):
             # 只输出简化的进度信息，不输出完整内容
             progress_msg = Message('assistant', "HTML渲染阶段完成")
             yield [progress_msg]
@@ -179,7 +193,7 @@ class BannerWorkflow(Agent):
                 ]
             )
             
-            for response in self.vl_validation_agent.run([vl_message]):
+            for response in governed_run(self.vl_validation_agent, [vl_message]):
                 # 只输出验证结果摘要，不输出完整内容
                 summary_msg = Message('assistant', "VL验证阶段完成")
                 yield [summary_msg]
@@ -192,7 +206,7 @@ class BannerWorkflow(Agent):
                         "根据VL反馈优化HTML Banner"
                     )
                     
-                    for opt_response in self.html_optimization_agent.run([optimization_message]):
+                    for opt_response in governed_run(self.html_optimization_agent, [optimization_message]):
                         opt_summary_msg = Message('assistant', "HTML优化阶段完成")
                         yield [opt_summary_msg]
                         self._save_phase_result('vl_optimization', opt_response)
@@ -222,62 +236,129 @@ class BannerWorkflow(Agent):
         }
     
     def _extract_design_specs(self) -> Dict:
-        """从设计规划中提取结构化设计规格"""
-        design_result = self._get_phase_result('design_planning')
-        # 解析JSON格式的设计规格
-        import json
-        import re
-        
-        # 提取JSON部分
-        json_match = re.search(r'```json\s*({.*?})\s*```', design_result, re.DOTALL)
-        if json_match:
-            try:
-                return json.loads(json_match.group(1))
-            except json.JSONDecodeError:
-                pass
+        """从设计规划中提取结构化设计规格
+
+        设计Agent的输出受LAYER_DESIGN_SCHEMA约束，本地校验通过后layers按标准图层名称给出LayerSpec
+        """
+        parsed = self._parsed_design(self._get_phase_result('design_planning'))
+        if parsed['status'] != 'success':
+            print(f"⚠️ 设计规格未通过schema校验: {'; '.join(parsed['errors'][:3])}")
+            return {}
         
-        return {}
+        return {
+            'project_name': parsed['project_name'],
+            'overall_size': parsed['overall_size'],
+            'layers': parsed['specs']
+        }
+    
+    def _parsed_design(self, design_result: str) -> Dict:
+        """设计方案只解析一次，修复尝试不重复计入统计"""
+        if self._design_parsed is None or self._design_parsed[0] != design_result:
+            self._design_parsed = (design_result, parse_design_output(design_result))
+        return self._design_parsed[1]
     
     def _extract_layer_config(self) -> Dict:
-        """从图层路由中提取配置信息"""
-        routing_result = self._get_phase_result('layer_routing')
-        # 类似地提取结构化配置
-        return {}
+        """从图层路由中提取配置信息，按图层名称给出RoutingEntry"""
+        # 规则路由与路由模型合并后的方案可能包含自定义图层，按图层名称不限的schema解析
+        parsed = parse_routing_output(self._get_phase_result('layer_routing'), custom_layers=True)
+        if parsed['status'] != 'success':
+            print(f"⚠️ 图层路由未通过schema校验: {'; '.join(parsed['errors'][:3])}")
+        return parsed['routes']
     
     def _phase_layer_routing(self, event_info: Dict) -> Iterator[List[Message]]:
-        """图层路由阶段"""
+        """图层路由阶段 - 按规则路由，只有规则无法识别的图层才调用路由模型"""
         design_result = self._get_phase_result('design_planning')
         
+        routing = route_design(design_result, self._parsed_design(design_result)) if rule_routing_enabled() else None
+        if routing and routing['status'] == 'success':
+            print(f"📐 按规则完成{len(routing['routes'])}个图层的路由，跳过路由模型调用")
+            response = [Message('assistant', format_routing_result(routing['routes']))]
+            yield response
+            self._save_phase_result('layer_routing', response)
+            return
+        
+        if routing and routing['unknown_layers']:
+            print(f"🤔 设计方案包含规则无法识别的图层 {routing['unknown_layers']}，只对这些图层使用路由模型")
+            design_result = unknown_layers_design(routing)
+        
         routing_message = Message(
             'user',
             f"基于设计方案，分配图层执行代理。\n\n设计方案：{design_result}"
         )
         
-        for response in self.routing_agent.run([routing_message]):
+        response = []
+        for response in governed_run(self.routing_agent, [routing_message]):
             yield response
             self._save_phase_result('layer_routing', response)
+        
+        if routing and routing['routes']:
+            # 路由模型的结果与规则路由合并
+            merged = merge_llm_routes(routing, self._assistant_text(response))
+            if merged['status'] != 'success':
+                print(f"⚠️ 路由模型结果合并不完整: {'; '.join(merged['errors'][:3])}")
+            merged_response = [Message('assistant', format_routing_result(merged['routes']))]
+            yield merged_response
+            self._save_phase_result('layer_routing', merged_response)
+    
+    @staticmethod
+    def _assistant_text(response: List[Message]) -> str:
+        """最后一条助手消息的文本"""
+        for message in reversed(response or []):
+            role = message.get('role') if isinstance(message, dict) else getattr(message, 'role', None)
+            content = message.get('content') if isinstance(message, dict) else getattr(message, 'content', None)
+            if role == 'assistant' and isinstance(content, str):
+                return content
+        return ''
     
     def _phase_layer_generation(self, event_info: Dict) -> Iterator[List[Message]]:
-        """图层生成阶段 - 改进版"""
+        """图层生成阶段 - 按分派表直接交给对应的图层代理，各图层并发执行"""
         # 直接使用结构化的设计规格
         design_specs = self._extract_design_specs()
         layer_config = self._extract_layer_config()
         
         # 为每个图层生成具体的执行指令
+        tasks = {}
         for layer_name, layer_spec in design_specs.get('layers', {}).items():
-            layer_message = Message(
-                'user',
-                f"生成{layer_name}图层。\n\n规格：{json.dumps(layer_spec, ensure_ascii=False)}"
-            )
-            
-            for response in self.layer_router.run([layer_message]):
-                yield response
-                self._save_layer_result(layer_name, response)
+            agent = self.layer_agents.get(layer_name)
+            if agent is None:
+                print(f"⚠️ 没有处理{layer_name}的图层代理，已跳过")
+                continue
+            route = layer_config.get(layer_name, {})
+            instruction = f"生成{layer_name}图层。\n\n规格：{json.dumps(layer_spec, ensure_ascii=False)}"
+            if route.get('output_requirements'):
+                instruction += f"\n\n输出要求：{route['output_requirements']}"
+            tasks[layer_name] = (agent, Message('user', instruction))
+        
+        if tasks:
+            with ThreadPoolExecutor(max_workers=min(len(tasks), MAX_LAYER_WORKERS),
+                                    thread_name_prefix='layer_generation') as pool:
+                # 每个任务在提交方上下文的副本中执行，追踪和用量统计可以传递到工作线程
+                futures = {
+                    pool.submit(contextvars.copy_context().run, self._generate_layer, agent, message): layer_name
+                    for layer_name, (agent, message) in tasks.items()
+                }
+                for future in as_completed(futures):
+                    layer_name = futures[future]
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        print(f"❌ {layer_name}生成失败: {e}")
+                        response = [Message('assistant', f"{layer_name}生成失败：{e}")]
+                    yield response
+                    self._save_layer_result(layer_name, response)
         
         # 汇总所有图层结果
         all_layers = self._collect_layer_results()
         self._save_phase_result('layer_generation', all_layers)
     
+    @staticmethod
+    def _generate_layer(agent: LayerGenerationAgent, message: Message) -> List[Message]:
+        """运行单个图层代理，返回最终响应；图层代理内部的模型调用各自经过限流"""
+        response = []
+        for response in agent.run([message]):
+            pass
+        return response
+    
     def _save_layer_result(self, layer_name: str, result: List[Message]):
         """保存单个图层的生成结果"""
         # 保存到专门的图层结果目录
@@ -298,7 +379,7 @@ class BannerWorkflow(Agent):
             f"生成最终HTML Banner。\n\n项目信息：{event_info}\n\n生成结果：{all_results}"
         )
         
-        for response in self.render_agent.run([render_message]):
+        for response in governed_run(self.render_agent, [render_message]):
             yield response
             self._save_phase_result('html_rendering', response)
     
@@ -319,7 +400,7 @@ class BannerWorkflow(Agent):
                 ]
             )
             
-            for response in self.vl_validation_agent.run([vl_message]):
+            for response in governed_run(self.vl_validation_agent, [vl_message]):
                 yield response
                 
                 # 如果需要优化，调用优化agent
@@ -329,7 +410,7 @@ class BannerWorkflow(Agent):
                         f"根据VL反馈优化HTML。\n\n当前HTML：{html_result}\n\nVL反馈：{response}"
                     )
                     
-                    for opt_response in self.html_optimization_agent.run([optimization_message]):
+                    for opt_response in governed_run(self.html_optimization_agent, [optimization_message]):
                         yield opt_response
                         self._save_phase_result('vl_optimization', opt_response)
     
@@ -339,37 +420,22 @@ class BannerWorkflow(Agent):
         
         yield [Message('assistant', f"Banner生成完成！\n\n{final_report}")]
     
-    def _create_svg_layer_agents(self) -> List[Agent]:
-        """创建SVG图层生成代理"""
-        from ..agents.layer_agents import LayerAgentsFactory
-        
-        layer_factory = LayerAgentsFactory(
-            llm_config={'model': 'qwen-max'},
-            progress_tracker=self.progress_tracker,
-            file_saver=self.file_saver
-        )
-        
-        return [
-            layer_factory.create_text_layer_agent(),
-            layer_factory.create_logo_layer_agent(), 
-            layer_factory.create_layout_layer_agent(),
-            layer_factory.create_effects_layer_agent()
-        ]
-    
-    def _create_image_layer_agents(self) -> List[Agent]:
-        """创建图像图层生成代理"""
-        from ..agents.layer_agents import LayerAgentsFactory
-        
+    def _create_layer_dispatch_table(self) -> Dict[str, LayerGenerationAgent]:
+        """创建图层分派表：标准图层名称 -> 图层生成代理"""
         layer_factory = LayerAgentsFactory(
             llm_config={'model': 'qwen-max'},
             progress_tracker=self.progress_tracker,
             file_saver=self.file_saver
         )
         
-        return [
-            layer_factory.create_background_layer_agent(),
-            layer_factory.create_main_element_layer_agent()
-        ]
+        return {
+            '布局层': layer_factory.create_layout_layer_agent(),
+            '背景层': layer_factory.create_background_layer_agent(),
+            '主要素层': layer_factory.create_main_element_layer_agent(),
+            '表意标识层': layer_factory.create_logo_layer_agent(),
+            '文字层': layer_factory.create_text_layer_agent(),
+            '效果层': layer_factory.create_effects_layer_agent()
+        }
     
     def _collect_all_phase_results(self) -> Dict:
         """收集所有阶段结果"""
@@ -411,18 +477,6 @@ class BannerWorkflow(Agent):
         os.makedirs(work_dir, exist_ok=True)
         return work_dir
     
-    def _create_layer_router(self) -> Router:
-        """创建图层生成路由器"""
-        # 创建各种图层生成agent
-        svg_agents = self._create_svg_layer_agents()
-        image_agents = self._create_image_layer_agents()
-        
-        return Router(
-            llm=self.llm,
-            agents=svg_agents + image_agents,
-            name="图层生成路由器"
-        )
-    
     def _extract_event_info(self, messages: List[Message]) -> Dict:
         """从消息中提取事件信息"""
         # 实现事件信息提取逻辑
@@ -1,5 +1,8 @@
 from .banner_workflow import BannerWorkflow
 from .system import EnhancedBannerSystem
+from ..utils.tracing import trace_run
+from ..utils.usage import UsageLedger, track_usage, write_usage_summary
+from ..utils.metrics import ensure_metrics_exporter, job_metrics
 from typing import Dict, Any
 
 class WorkflowEnhancedBannerSystem(EnhancedBannerSystem):
@@ -11,6 +14,9 @@ class WorkflowEnhancedBannerSystem(EnhancedBannerSystem):
             self.workflow = BannerWorkflow(llm_config)
             self.llm_config = llm_config or {'model': 'qwen-max'}
             self.work_dir = self.workflow.work_dir
+            self.profiler = self.workflow.profiler
+            self.usage_ledger = UsageLedger()
+            ensure_metrics_exporter()
         else:
             # 使用原有实现
             super().__init__(llm_config)
@@ -18,7 +24,18 @@ class WorkflowEnhancedBannerSystem(EnhancedBannerSystem):
     def generate_banner(self, event_name: str, additional_requirements: str = "") -> Dict[str, Any]:
         """生成Banner的主流程"""
         if hasattr(self, 'workflow'):
-            return self._generate_with_workflow(event_name, additional_requirements)
+            with job_metrics('workflow') as job, \
+                    trace_run(self.work_dir, 'generate_banner', mode='workflow', event_name=event_name), \
+                    track_usage(self.usage_ledger):
+                try:
+                    result = self._generate_with_workflow(event_name, additional_requirements)
+                    job['status'] = result.get('status', 'error')
+                finally:
+                    # Workflow模式不生成final_report.json，用量汇总单独写入项目目录
+                    usage = self.usage_ledger.summary()
+                    write_usage_summary(self.work_dir, usage)
+            result['usage'] = usage
+            return result
         else:
             return super().generate_banner(event_name, additional_requirements)
     
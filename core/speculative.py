@@ -0,0 +1,140 @@
+import contextvars
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Callable, Optional
+
+from ..utils.layer_specs import spec_fingerprint
+from ..utils.metrics import CACHE_REQUESTS
+
+# 汇合推测式结果的最长等待秒数，可通过环境变量 BANNER_SPECULATIVE_TIMEOUT 覆盖；超时后改为直接生成
+DEFAULT_COLLECT_TIMEOUT = 300.0
+
+
+def collect_timeout() -> float:
+    try:
+        return float(os.getenv('BANNER_SPECULATIVE_TIMEOUT', DEFAULT_COLLECT_TIMEOUT))
+    except ValueError:
+        return DEFAULT_COLLECT_TIMEOUT
+
+
+class SpeculativeLayerDispatcher:
+    """图层推测式调度器
+
+    设计方案中一旦出现某个图层的可用规格，就在后台线程中提前开始生成；
+    渲染前按图层名称汇合，只有规格指纹未变化的结果才会被采用。
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'dispatched': 0, 'hits': 0, 'discarded': 0, 'failed': 0, 'timed_out': 0}
+
+    def dispatch(self, layer_name: str, spec: Any, fn: Callable, *args,
+                 staging_dir: str = None, on_submit: Callable[[], Any] = None, **kwargs) -> bool:
+        """提交图层的推测式生成任务，规格未变化的重复提交会被忽略
+
+        on_submit在确实提交新任务前调用（例如写入任务要读取的规格文件），重复提交时不会调用
+        """
+        fingerprint = spec_fingerprint(spec)
+
+        with self._lock:
+            existing = self._jobs.get(layer_name)
+            if existing and existing['fingerprint'] == fingerprint:
+                return False
+            if existing:
+                self._discard(layer_name, existing, "规格已更新")
+
+            if on_submit is not None:
+                on_submit()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='speculative_layer')
+            # 在调度方的上下文中执行，追踪等上下文变量可以传递到工作线程
+            future = self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+            self._jobs[layer_name] = {
+                'fingerprint': fingerprint,
+                'future': future,
+                'staging_dir': staging_dir,
+                'dispatched_at': time.time()
+            }
+            self.stats['dispatched'] += 1
+
+        print(f"🚀 {layer_name} 已提前开始生成（推测式调度）")
+        return True
+
+    def collect(self, layer_name: str, spec: Any, timeout: Optional[float] = None) -> Optional[Any]:
+        """在渲染前汇合推测式结果，规格发生变化、执行失败或等待超时时返回None
+
+        timeout为None时使用 collect_timeout()
+        """
+        with self._lock:
+            job = self._jobs.pop(layer_name, None)
+            if job is None:
+                CACHE_REQUESTS.inc(cache='speculative_layer', result='miss')
+                return None
+            if job['fingerprint'] != spec_fingerprint(spec):
+                self._discard(layer_name, job, "规格已变化")
+                CACHE_REQUESTS.inc(cache='speculative_layer', result='miss')
+                return None
+
+        timeout = collect_timeout() if timeout is None else timeout
+        try:
+            result = job['future'].result(timeout=timeout)
+        except FutureTimeoutError:
+            # 卡住的任务不再等待，结束后清理暂存目录，调用方改为直接生成
+            print(f"⏱️ {layer_name} 推测式生成超过 {timeout:g}s 未完成，改为直接生成")
+            self.stats['timed_out'] += 1
+            with self._lock:
+                self._discard(layer_name, job, "等待超时")
+            CACHE_REQUESTS.inc(cache='speculative_layer', result='miss')
+            return None
+        except Exception as e:
+            print(f"⚠️ {layer_name} 推测式生成失败: {e}")
+            self.stats['failed'] += 1
+            CACHE_REQUESTS.inc(cache='speculative_layer', result='miss')
+            return None
+
+        if isinstance(result, dict) and result.get('status') not in (None, 'success'):
+            print(f"⚠️ {layer_name} 推测式生成未成功: {result.get('error', '未知错误')}")
+            self.stats['failed'] += 1
+            CACHE_REQUESTS.inc(cache='speculative_layer', result='miss')
+            return None
+
+        waited = time.time() - job['dispatched_at']
+        print(f"✅ {layer_name} 采用推测式结果（提前 {waited:.1f}s 开始）")
+        self.stats['hits'] += 1
+        CACHE_REQUESTS.inc(cache='speculative_layer', result='hit')
+        return result
+
+    def pending(self) -> list:
+        """返回尚未汇合的图层名称"""
+        with self._lock:
+            return list(self._jobs.keys())
+
+    def shutdown(self):
+        """丢弃所有未汇合的任务并关闭线程池，之后再次调度会重新创建线程池"""
+        with self._lock:
+            for layer_name, job in list(self._jobs.items()):
+                self._discard(layer_name, job, "未被使用")
+            self._jobs.clear()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _discard(self, layer_name: str, job: Dict[str, Any], reason: str):
+        """丢弃推测式任务，并在任务结束后清理其暂存目录"""
+        self.stats['discarded'] += 1
+        print(f"🗑️ 丢弃 {layer_name} 的推测式结果：{reason}")
+
+        future: Future = job['future']
+        staging_dir = job.get('staging_dir')
+        if future.cancel() or not staging_dir:
+            if staging_dir:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            return
+        future.add_done_callback(lambda _: shutil.rmtree(staging_dir, ignore_errors=True))
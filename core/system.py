@@ -1,6 +1,7 @@
 import os
 import json
 import datetime
+import time
 from typing import List, Dict, Any, Optional
 from qwen_agent.multi_agent_hub import MultiAgentHub
 from qwen_agent import Agent
@@ -10,7 +11,55 @@ from ..tools.progress_tracker import ProgressTracker
 from ..agents.top_agents import TopAgentsFactory
 from ..agents.validation_agents import ValidationAgentsFactory  # 新增导入
 from ..utils.helpers import FileHelper
+from ..utils.layer_specs import extract_layer_specs, spec_fingerprint, parse_design_output, parse_routing_output, IMAGE_LAYER_NAMES
+from ..utils.stream_parser import LayerBlockStreamParser
+from ..utils.rate_limiter import governed_run, get_governor, model_name_of
+from ..utils.image_backends import image_backend_metrics
+from ..utils.llm_transport import get_transport
+from ..utils.profiler import PhaseProfiler
+from ..utils.tracing import trace_run, traced, current_span
+from ..utils.usage import UsageLedger, track_usage, usage_scope, write_usage_summary
+from ..utils.html_bundler import bundle_html
+from ..utils.image_delivery import ImageDelivery, deliver_responsive_images, is_variant_of
+from ..utils.image_quality import compress_images
+from ..utils.image_ingest import resolve_target_box, find_layout_svg, ingest_image, recrop_image
+from ..utils.asset_store import get_asset_store
+from ..utils.asset_sync import sync_tree
+from ..utils.semantic_cache import get_semantic_cache, adapt_results
+from ..utils.prompt_prefix import assemble_prompt, section, PromptPrefixStats
+from ..utils.context_assembler import ContextAssembler, ContextStats
+from ..utils.json_repair import RepairStats, track_repairs
+from ..utils.layer_router import (route_design, format_routing_result, rule_routing_enabled,
+                                  unknown_layers_design, merge_llm_routes)
+from ..utils.metrics import ensure_metrics_exporter, job_metrics, SCREENSHOTS_IN_FLIGHT, SCREENSHOT_DURATION
 from ..prompts import prompt_manager
+from .speculative import SpeculativeLayerDispatcher
+
+# TOP层各步骤的任务说明，不含任何变量，放在指令的静态前缀中
+EVENT_ANALYSIS_TASK = """## 当前任务
+请对下方给出的事件进行深度分析，并参考附加要求（如有）。
+请按照上述角色要求和技能框架，提供完整的事件分析报告。"""
+
+MARKETING_TASK = """## 当前任务
+基于下方的事件分析结果，为该事件制定营销策划方案。
+请提供完整的营销策划方案，包括目标受众、核心策略、视觉规范等。"""
+
+DESIGN_TASK = """## 当前任务
+基于知识库中的事件分析和营销策划方案，制定6个图层的具体设计要求。
+请按照上述角色要求和技能框架，提供详细的图层设计方案，包括每个图层的具体要求。"""
+
+ROUTING_TASK = """## 当前任务
+基于下方的图层设计方案，分析并分配每个图层给相应的执行代理。
+请生成完整的路由分配方案，并以JSON格式输出图层配置信息。"""
+
+# _execute_single_agent 失败时返回的文本前缀
+AGENT_FAILURE_PREFIX = '执行失败: '
+
+
+def is_agent_failure(result: str) -> bool:
+    """判断Agent结果是否为 _execute_single_agent 返回的失败文本"""
+    return not result or result.startswith(AGENT_FAILURE_PREFIX)
+
 
 class EnhancedBannerSystem(MultiAgentHub):
     """增强版Banner多Agent生成系统"""
@@ -49,9 +98,63 @@ class EnhancedBannerSystem(MultiAgentHub):
         
         # 设置设计文件路径
         self.design_file_path = os.path.join(self.work_dir, 'documents', 'layer_routing_plan.json')
+        
+        # 图层推测式调度器：图层规格一出现就提前生成，渲染前汇合
+        self.speculative_dispatcher = SpeculativeLayerDispatcher(max_workers=4)
+        self.streamed_layer_specs = {}
+        self.final_layer_specs = {}
+        
+        # 分阶段性能统计（耗时、CPU、内存、模型调用次数、写入字节数）
+        self.profiler = PhaseProfiler(self.work_dir)
+        
+        # 本任务的模型调用token与费用明细
+        self.usage_ledger = UsageLedger()
+        
+        # 本任务的JSON本地修复统计（进程级统计由多个任务共享）
+        self.repair_stats = RepairStats()
+        
+        # 最近一次生成的单文件HTML打包结果
+        self.bundle_result = None
+        
+        # 位图转码为多宽度WebP/AVIF，渲染和优化后的HTML共用转码结果
+        self.image_delivery = ImageDelivery()
+        self.image_delivery_result = None
+        self.image_compression_result = None
+        
+        # 跨项目共享的内容寻址资源库，web资源通过硬链接指向同一份内容
+        self.asset_store = get_asset_store()
+        self.asset_sync_result = None
+        
+        # 相似事件的事件分析和营销策划复用
+        self.semantic_cache = get_semantic_cache()
+        self.semantic_cache_result = None
+        
+        # 各Agent请求中可被服务端前缀缓存命中的稳定前缀统计
+        self.prompt_prefix_stats = PromptPrefixStats()
+        
+        # 各提示词中重复上下文的去重统计
+        self.context_stats = ContextStats()
+        
+        # 图层设计和图层路由的schema校验结果（JSON模式或代码块来源、错误列表）
+        self.structured_output = {}
+        
+        # 按环境变量启动Prometheus指标端点
+        ensure_metrics_exporter()
     
     def generate_banner(self, event_name: str, additional_requirements: str = "") -> Dict[str, Any]:
         """生成Banner的主流程"""
+        with job_metrics('traditional') as job, \
+                trace_run(self.work_dir, 'generate_banner', mode='traditional', event_name=event_name), \
+                track_usage(self.usage_ledger), track_repairs(self.repair_stats):
+            try:
+                result = self._generate_banner(event_name, additional_requirements)
+                job['status'] = result.get('status', 'error')
+                return result
+            finally:
+                write_usage_summary(self.work_dir, self.usage_ledger.summary())
+    
+    def _generate_banner(self, event_name: str, additional_requirements: str = "") -> Dict[str, Any]:
+        """Banner生成的各阶段执行"""
         
         # 初始化项目信息
         project_info = {
@@ -70,32 +173,39 @@ class EnhancedBannerSystem(MultiAgentHub):
         try:
             # 阶段1：TOP层智能体顺序执行
             print("\n=== 阶段1：TOP层智能体执行 ===")
-            top_results = self._execute_top_agents(event_name, additional_requirements)
+            with self.profiler.phase('top_agents'):
+                top_results = self._execute_top_agents(event_name, additional_requirements)
             
             # 阶段2：简化的图层执行
             print("\n=== 阶段2：图层执行 ===")
-            layer_materials = self._execute_layers_simple(
-                top_results['routing_result'],
-                top_results['marketing_result']
-            )
+            with self.profiler.phase('layers'):
+                layer_materials = self._execute_layers_simple(
+                    top_results['routing_result'],
+                    top_results['marketing_result'],
+                    top_results['design_result']
+                )
+                
+                # 按目标SSIM压缩位图图层
+                self.image_compression_result = compress_images(os.path.join(self.work_dir, 'images'))
             
             # 在阶段3：HTML渲染部分修改
             print("\n=== 阶段3：HTML渲染 ===")
             
-            # 创建web文件夹
-            web_dir = os.path.join(self.work_dir, 'web')
-            os.makedirs(web_dir, exist_ok=True)
-            
-            render_input = {
-                'project_info': {
-                    'event_name': event_name,
-                    'requirements': additional_requirements
-                },
-                'generated_files': self._collect_generated_files_summary(),
-                'layer_summary': self._create_layer_summary(layer_materials)
-            }
+            with self.profiler.phase('render'):
+                # 创建web文件夹
+                web_dir = os.path.join(self.work_dir, 'web')
+                os.makedirs(web_dir, exist_ok=True)
+            
+                render_input = {
+                    'project_info': {
+                        'event_name': event_name,
+                        'requirements': additional_requirements
+                    },
+                    'generated_files': self._collect_generated_files_summary(),
+                    'layer_summary': self._create_layer_summary(layer_materials)
+                }
             
-            html_instruction = f"""你是一个专业的HTML Banner生成专家。请基于以下详细信息生成最终的HTML Banner卡片：
+                html_instruction = f"""你是一个专业的HTML Banner生成专家。请基于以下详细信息生成最终的HTML Banner卡片：
             
             ## 项目信息
             {json.dumps(render_input['project_info'], ensure_ascii=False, indent=2)}
@@ -119,41 +229,49 @@ class EnhancedBannerSystem(MultiAgentHub):
             
             请直接输出HTML代码，确保正确引用所有资源文件。"""
             
-            html_result = self._execute_single_agent(
-                self.top_agents[4],
-                html_instruction
-            )
+                html_result = self._execute_single_agent(
+                    self.top_agents[4],
+                    html_instruction
+                )
             
-            # 保存HTML文件到web文件夹
-            html_file_path = os.path.join(web_dir, 'banner.html')
-            try:
-                with open(html_file_path, 'w', encoding='utf-8') as f:
-                    f.write(html_result)
-                print(f"✅ HTML Banner已保存到: {html_file_path}")
-            except Exception as e:
-                print(f"❌ HTML文件保存失败: {e}")
+                # 保存HTML文件到web文件夹
+                html_file_path = os.path.join(web_dir, 'banner.html')
+                try:
+                    with open(html_file_path, 'w', encoding='utf-8') as f:
+                        f.write(html_result)
+                    print(f"✅ HTML Banner已保存到: {html_file_path}")
+                except Exception as e:
+                    print(f"❌ HTML文件保存失败: {e}")
+            
+                # 复制相关资源文件到web文件夹
+                self._copy_resources_to_web(web_dir)
             
-            # 复制相关资源文件到web文件夹
-            self._copy_resources_to_web(web_dir)
+                # 位图改为响应式<picture>，再打包为内联SVG精灵图和小位图的单文件HTML
+                self.image_delivery_result = deliver_responsive_images([html_file_path], self.image_delivery)
+                self.bundle_result = bundle_html(html_file_path)
             
             # 阶段4：VL验证和优化（替换原有的质量验证）
             print("\n=== 阶段4：VL质量验证和优化 ===")
             
-            # 构建设计要求描述
-            design_requirements = f"""
-            事件名称：{event_name}
-            事件描述：{additional_requirements}
-            营销策略：{top_results.get('marketing_plan', '')}
-            设计规范：{top_results.get('layer_design', '')}
-            图层路由：{top_results.get('layer_routing', '')}
-            """
-            
-            # 执行VL验证和优化
-            vl_optimization_result = self._execute_vl_validation_and_optimization(
-                html_result,
-                design_requirements,  # 添加 design_requirements 参数
-                max_iterations=5
-            )
+            with self.profiler.phase('vl_loop'):
+                # 构建设计要求描述
+                # 每次VL验证和优化都会带上设计要求，营销、设计、路由之间互相转述的段落只保留一次
+                context = ContextAssembler('design_requirements')
+                design_requirements = '\n\n'.join(part for part in (
+                    context.section('事件名称', event_name),
+                    context.section('事件描述', additional_requirements),
+                    context.section('营销策略', top_results.get('marketing_result', '')),
+                    context.section('设计规范', top_results.get('design_result', '')),
+                    context.section('图层路由', top_results.get('routing_result', ''))
+                ) if part)
+                self.context_stats.record(context)
+            
+                # 执行VL验证和优化
+                vl_optimization_result = self._execute_vl_validation_and_optimization(
+                    html_result,
+                    design_requirements,  # 添加 design_requirements 参数
+                    max_iterations=5
+                )
             
             # 生成最终报告
             final_report = self._generate_final_report(
@@ -191,52 +309,37 @@ class EnhancedBannerSystem(MultiAgentHub):
         # 创建中间结果存储
         intermediate_results = {}
         
-        # 1. 事件分析 - 使用配置化的 prompt
-        print("\n🔍 步骤1: 事件分析")
-        print("-" * 40)
-        
-        # 获取事件分析的 prompt
-        event_analysis_prompt = prompt_manager.get_prompt(
-            'event_analysis',
-            {
-                'documents': '',  # 可以从知识库获取
-                'samples': ''     # 可以从样例库获取
+        # 1~2. 事件分析和营销策划，相似事件命中语义缓存时直接复用
+        cached = self.semantic_cache.lookup(event_name, additional_requirements) if self.semantic_cache else None
+        if cached:
+            entry = cached['entry']
+            reused = adapt_results(entry, event_name)
+            event_result, marketing_result = reused['event_analysis'], reused['marketing_plan']
+            self.semantic_cache_result = {
+                'status': 'hit',
+                'similarity': cached['similarity'],
+                'source_event': entry['event_name'],
+                'source_requirements': entry.get('requirements', '')
             }
-        )
-        
-        # 构建完整的事件分析指令
-        event_instruction = f"""{event_analysis_prompt}
-        
-    ## 当前任务
-    请对事件'{event_name}'进行深度分析。
-    
-    **附加要求**: {additional_requirements}
-    
-    请按照上述角色要求和技能框架，提供完整的事件分析报告。
-        """
-        
-        event_result = self._execute_single_agent(
-            self.top_agents[0], 
-            event_instruction
-        )
+            print(f"♻️ 复用相似事件「{entry['event_name']}」的事件分析和营销策划（相似度 {cached['similarity']}）")
+        else:
+            event_result, marketing_result = self._execute_event_and_marketing(event_name, additional_requirements)
+            if self.semantic_cache:
+                # 任一Agent失败时不写入持久缓存，否则之后相似事件会一直复用失败结果
+                if is_agent_failure(event_result) or is_agent_failure(marketing_result):
+                    self.semantic_cache_result = {'status': 'miss', 'stored': False}
+                else:
+                    self.semantic_cache.store(event_name, additional_requirements, {
+                        'event_analysis': event_result,
+                        'marketing_plan': marketing_result
+                    })
+                    self.semantic_cache_result = {'status': 'miss', 'stored': True}
         
         # 保存事件分析中间文件
         intermediate_results['event_analysis'] = event_result
         self._save_intermediate_file('event_analysis.md', event_result)
         print(f"✅ 事件分析完成，已保存到 event_analysis.md")
         
-        # 2. 营销策划
-        print("\n📊 步骤2: 营销策划")
-        print("-" * 40)
-        marketing_input = f"""基于事件分析结果，为'{event_name}'制定营销策划方案。
-        
-    事件分析结果：
-    {event_result}
-    
-    请提供完整的营销策划方案，包括目标受众、核心策略、视觉规范等。"""
-        
-        marketing_result = self._execute_single_agent(self.top_agents[1], marketing_input)
-        
         # 保存营销策划中间文件
         intermediate_results['marketing_plan'] = marketing_result
         self._save_intermediate_file('marketing_plan.md', marketing_result)
@@ -246,58 +349,71 @@ class EnhancedBannerSystem(MultiAgentHub):
         print("\n🎨 步骤3: 图层设计")
         print("-" * 40)
         
-        # 获取图层设计的 prompt
-        layer_design_prompt = prompt_manager.get_prompt(
-            'layer_design',
-            {
-                'documents': f"""## 事件分析结果\n{event_result}\n\n## 营销策划方案\n{marketing_result}"""  # 同时传入事件分析和营销策划结果
-            }
+        # 静态模板和任务说明在前，事件分析和营销策划作为知识库内容放在最后（只出现一次）
+        # 营销策划中转述事件分析的段落只保留一次
+        context = ContextAssembler('layer_design')
+        documents = '\n\n'.join(part for part in (
+            context.section('事件分析结果', event_result),
+            context.section('营销策划方案', marketing_result)
+        ) if part)
+        layer_design_static, layer_design_variable = prompt_manager.split_prompt(
+            'layer_design', {'documents': documents}
+        )
+        design_instruction = self._build_instruction(
+            self.top_agents[2],
+            [layer_design_static, DESIGN_TASK],
+            [layer_design_variable, context.section('事件名称', event_name),
+             context.section('附加要求', additional_requirements)],
+            context
         )
         
-        # 构建完整的图层设计指令
-        design_instruction = f"""{layer_design_prompt}
-        
-    ## 当前任务
-    基于事件分析和营销策划方案，制定6个图层的具体设计要求。
-    
-    **事件分析结果**：
-    {event_result}
-    
-    **营销策划方案**：
-    {marketing_result}
-    
-    **事件名称**: {event_name}
-    **附加要求**: {additional_requirements}
-    
-    请按照上述角色要求和技能框架，提供详细的图层设计方案，包括每个图层的具体要求。
-        """
-        
-        design_result = self._execute_single_agent(self.top_agents[2], design_instruction)
+        # 流式解析设计方案，每个图层块闭合后立即交给对应生成器
+        design_stream = LayerBlockStreamParser(on_block=self._on_streamed_layer_block)
+        design_result = self._execute_single_agent(
+            self.top_agents[2], design_instruction, on_text=design_stream.feed
+        )
         
         # 保存图层设计中间文件
         intermediate_results['layer_design'] = design_result
         self._save_intermediate_file('layer_design.md', design_result)
         print(f"✅ 图层设计完成，已保存到 layer_design.md")
         
-        # 4. 图层路由
-        print("\n🔀 步骤4: 图层路由")
-        print("-" * 40)
-        routing_input = f"""基于图层设计方案，分析并分配每个图层给相应的执行代理。
+        # 本地按schema校验，通过时直接得到各图层规格，无需修复回合
+        design_parsed = parse_design_output(design_result)
+        self.structured_output['layer_design'] = self._structured_output_summary(design_parsed)
         
-    图层设计方案：
-    {design_result}
-    
-    营销策划参考：
-    {marketing_result}
-    
-    请生成完整的路由分配方案，并以JSON格式输出图层配置信息。"""
+        # 补充调度流式阶段未能识别的图层（例如最终文本才完整的块）
+        self._dispatch_speculative_layers(extract_layer_specs(design_result, design_parsed))
         
-        routing_result = self._execute_single_agent(self.top_agents[3], routing_input)
+        # 4. 图层路由：图层到代理的对应关系固定，按规则直接由设计方案生成，只有规则识别不了的图层才调用路由模型
+        print("\n🔀 步骤4: 图层路由")
+        print("-" * 40)
+        routing = route_design(design_result, design_parsed) if rule_routing_enabled() else None
+        if routing and routing['status'] == 'success':
+            routing_result = format_routing_result(routing['routes'])
+            self.structured_output['layer_routing'] = {'status': 'success', 'source': 'rules', 'errors': []}
+            print(f"📐 按规则完成{len(routing['routes'])}个图层的路由，跳过路由模型调用")
+        elif routing and routing['unknown_layers']:
+            # 路由模型只处理规则无法识别的图层，再与规则路由合并
+            print(f"🤔 设计方案包含规则无法识别的图层 {routing['unknown_layers']}，只对这些图层使用路由模型")
+            llm_result = self._execute_llm_routing(unknown_layers_design(routing), marketing_result)
+            merged = merge_llm_routes(routing, llm_result)
+            routing_result = format_routing_result(merged['routes'])
+            self.structured_output['layer_routing'] = self._structured_output_summary(merged)
+        else:
+            routing_result = self._execute_llm_routing(design_result, marketing_result)
         
         # 保存图层路由中间文件
         intermediate_results['layer_routing'] = routing_result
         self._save_intermediate_file('layer_routing.md', routing_result)
-        self._save_intermediate_file('layer_routing_plan.json', routing_result)
+        # 合并后的方案可能包含自定义图层名称
+        routing_parsed = parse_routing_output(routing_result, custom_layers=bool(routing and routing['unknown_layers']))
+        if 'layer_routing' not in self.structured_output:
+            self.structured_output['layer_routing'] = self._structured_output_summary(routing_parsed)
+        # 校验通过时保存规范化的路由JSON，否则保留原文便于排查
+        routing_plan = (json.dumps(list(routing_parsed['routes'].values()), ensure_ascii=False, indent=2)
+                        if routing_parsed['status'] == 'success' else routing_result)
+        self._save_intermediate_file('layer_routing_plan.json', routing_plan)
         print(f"✅ 图层路由完成，已保存到 layer_routing.md 和 layer_routing_plan.json")
         
         # 保存完整的中间结果汇总
@@ -312,6 +428,81 @@ class EnhancedBannerSystem(MultiAgentHub):
             'intermediate_files': intermediate_results
         }
     
+    def _execute_llm_routing(self, design_result: str, marketing_result: str) -> str:
+        """调用路由模型生成图层路由方案"""
+        # 设计方案已转述的营销内容在营销策划参考中改为引用
+        context = ContextAssembler('layer_routing')
+        routing_input = self._build_instruction(
+            self.top_agents[3],
+            [ROUTING_TASK],
+            [context.section('图层设计方案', design_result), context.section('营销策划参考', marketing_result)],
+            context
+        )
+        
+        # 路由阶段同样流式解析，设计方案中缺失的图层由路由块补充调度
+        routing_stream = LayerBlockStreamParser(on_block=self._on_streamed_layer_block)
+        return self._execute_single_agent(
+            self.top_agents[3], routing_input, on_text=routing_stream.feed
+        )
+    
+    @staticmethod
+    def _structured_output_summary(parsed: Dict[str, Any]) -> Dict[str, Any]:
+        """记录schema校验结果，未通过时打印前几条错误"""
+        if parsed['status'] == 'success':
+            print(f"🧾 输出通过schema校验（来源: {parsed['source']}）")
+        else:
+            print(f"⚠️ 输出未通过schema校验: {'; '.join(parsed['errors'][:3])}")
+        return {'status': parsed['status'], 'source': parsed['source'], 'errors': parsed['errors'][:10]}
+    
+    def _execute_event_and_marketing(self, event_name: str, additional_requirements: str = ""):
+        """执行事件分析和营销策划两个Agent，返回 (事件分析结果, 营销策划结果)"""
+        # 1. 事件分析 - 使用配置化的 prompt
+        print("\n🔍 步骤1: 事件分析")
+        print("-" * 40)
+        
+        # 获取事件分析的 prompt，静态模板和任务说明在前，事件名称等变量在后
+        event_analysis_static, event_analysis_variable = prompt_manager.split_prompt(
+            'event_analysis',
+            {
+                'documents': '',  # 可以从知识库获取
+                'samples': ''     # 可以从样例库获取
+            }
+        )
+        event_instruction = self._build_instruction(
+            self.top_agents[0],
+            [event_analysis_static, EVENT_ANALYSIS_TASK],
+            [event_analysis_variable, section('事件名称', event_name), section('附加要求', additional_requirements)]
+        )
+        
+        event_result = self._execute_single_agent(
+            self.top_agents[0], 
+            event_instruction
+        )
+        
+        # 2. 营销策划
+        print("\n📊 步骤2: 营销策划")
+        print("-" * 40)
+        context = ContextAssembler('marketing')
+        marketing_input = self._build_instruction(
+            self.top_agents[1],
+            [MARKETING_TASK],
+            [context.section('事件名称', event_name), context.section('事件分析结果', event_result)],
+            context
+        )
+        
+        marketing_result = self._execute_single_agent(self.top_agents[1], marketing_input)
+        
+        return event_result, marketing_result
+    
+    def _build_instruction(self, agent, static_parts: List[str], variable_parts: List[str],
+                           context: ContextAssembler = None) -> str:
+        """按静态内容在前、变量内容在后拼接指令，记录该Agent请求的稳定前缀和上下文去重情况"""
+        instruction, static_prefix = assemble_prompt(static_parts, variable_parts)
+        self.prompt_prefix_stats.record(agent, instruction, static_prefix)
+        if context is not None:
+            self.context_stats.record(context)
+        return instruction
+    
     def _save_intermediate_file(self, filename: str, content: str):
         """保存中间文件到documents目录"""
         docs_dir = os.path.join(self.work_dir, 'documents')
@@ -323,7 +514,97 @@ class EnhancedBannerSystem(MultiAgentHub):
         
         print(f"   📄 中间文件已保存: {filename}")
     
-    def _execute_layers_simple(self, routing_result: str, marketing_context: str) -> Dict[str, Any]:
+    def _on_streamed_layer_block(self, layer_name: str, layer_spec: Dict[str, Any]):
+        """流式阶段发现完整图层块时的回调"""
+        # 设计方案中的图层规格优先，路由块只用于补充尚未出现的图层
+        existing = self.streamed_layer_specs.get(layer_name)
+        if existing is not None and 'layer_name' in layer_spec and 'layer_name' not in existing:
+            return
+        self.streamed_layer_specs[layer_name] = layer_spec
+        self._dispatch_speculative_layers({layer_name: layer_spec})
+    
+    def _dispatch_speculative_layers(self, layer_specs: Dict[str, Dict[str, Any]]):
+        """提前调度对应生成器，确实提交新任务时才把图层规格写入独立文件"""
+        specs_dir = os.path.join(self.work_dir, 'documents', 'layer_specs')
+        os.makedirs(specs_dir, exist_ok=True)
+        
+        for layer_name, layer_spec in layer_specs.items():
+            spec_file = os.path.join(specs_dir, f"{layer_name}.json")
+            
+            # 推测式结果先写入暂存目录，被采用后再移入svg/images目录；目录按规格指纹区分，
+            # 被丢弃的旧任务结束后清理自己的目录，不会删掉新任务的输出
+            staging_dir = os.path.join(self.work_dir, 'speculative', layer_name, spec_fingerprint(layer_spec)[:12])
+            os.makedirs(staging_dir, exist_ok=True)
+            execute = self._execute_image_layer if layer_name in IMAGE_LAYER_NAMES else self._execute_svg_layer
+            self.speculative_dispatcher.dispatch(
+                layer_name, layer_spec, execute,
+                layer_name, {'routing_file_path': spec_file}, staging_dir,
+                staging_dir=staging_dir,
+                on_submit=lambda path=spec_file, spec=layer_spec: self._write_spec_file(path, spec)
+            )
+    
+    @staticmethod
+    def _write_spec_file(path: str, layer_spec: Dict[str, Any]):
+        """原子写入图层规格文件，正在运行的任务不会读到写了一半的文件"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(layer_spec, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    
+    def _final_layer_specs(self, design_result: str) -> Dict[str, Dict[str, Any]]:
+        """汇总最终的图层规格：以完整设计方案为准，缺失的图层使用流式阶段得到的规格"""
+        final_specs = dict(self.streamed_layer_specs)
+        # 设计方案在步骤3已经解析并计入修复统计
+        final_specs.update(extract_layer_specs(design_result, record_repairs=False))
+        return final_specs
+    
+    def _collect_speculative_layer(self, layer_name: str, layer_spec: Optional[Dict[str, Any]], target_dir: str):
+        """汇合推测式图层结果并移入目标目录，规格变化或失败时返回None"""
+        if layer_spec is None:
+            return None
+        
+        result = self.speculative_dispatcher.collect(layer_name, layer_spec)
+        if not result:
+            return None
+        
+        import shutil
+        local_path = result.get('local_path')
+        if local_path and os.path.exists(local_path):
+            target_path = os.path.join(target_dir, os.path.basename(local_path))
+            shutil.move(local_path, target_path)
+            result['local_path'] = target_path
+            result['output_dir'] = target_dir
+        
+        for file_info in result.get('saved_files', []):
+            file_path = file_info.get('file_path')
+            if file_path and os.path.exists(file_path):
+                target_path = os.path.join(target_dir, os.path.basename(file_path))
+                shutil.move(file_path, target_path)
+                file_info['file_path'] = target_path
+        
+        if layer_name in IMAGE_LAYER_NAMES:
+            self._reingest_collected_image(layer_name, layer_spec, result)
+        return result
+    
+    def _reingest_collected_image(self, layer_name: str, layer_spec: Dict[str, Any], result: Dict[str, Any]):
+        """推测式任务在布局SVG生成前就已入库，汇合时按布局中的展示尺寸重新裁剪"""
+        local_path = result.get('local_path')
+        if not local_path or not os.path.exists(local_path):
+            return
+        target_box = resolve_target_box(
+            layer_name, layer_spec, find_layout_svg(os.path.join(self.work_dir, 'svg'))
+        )
+        previous = result.get('ingest') or {}
+        if not target_box or previous.get('target_box') == list(target_box):
+            return
+        
+        original_path = previous.get('original_path')
+        if original_path and os.path.exists(original_path):
+            result['ingest'] = recrop_image(original_path, local_path, target_box)
+        else:
+            result['ingest'] = ingest_image(local_path, target_box, os.path.join(self.work_dir, 'originals'))
+    
+    def _execute_layers_simple(self, routing_result: str, marketing_context: str, design_result: str = "") -> Dict[str, Any]:
         """简化的图层执行逻辑 - 直接使用生成器"""
         
         # 定义标准图层配置
@@ -374,7 +655,10 @@ class EnhancedBannerSystem(MultiAgentHub):
         os.makedirs(svg_dir, exist_ok=True)
         os.makedirs(images_dir, exist_ok=True)
         
-        # 直接执行每个图层
+        final_specs = self._final_layer_specs(design_result)
+        self.final_layer_specs = final_specs
+        
+        # 直接执行每个图层，已提前调度的图层只需汇合结果
         for layer_config in standard_layers:
             layer_name = layer_config["layer_name"]
             generator_type = layer_config["generator_type"]
@@ -384,16 +668,20 @@ class EnhancedBannerSystem(MultiAgentHub):
             
             try:
                 # 根据生成器类型选择对应的执行器
-                if generator_type == "svg":
-                    result = self._execute_svg_layer(layer_name, marketing_context, svg_dir)
-                else:  # image
-                    result = self._execute_image_layer(layer_name, marketing_context, images_dir)
+                target_dir = svg_dir if generator_type == "svg" else images_dir
+                result = self._collect_speculative_layer(layer_name, final_specs.get(layer_name), target_dir)
+                if result is None:
+                    if generator_type == "svg":
+                        result = self._execute_svg_layer(layer_name, marketing_context, svg_dir)
+                    else:  # image
+                        result = self._execute_image_layer(layer_name, marketing_context, images_dir)
                 
                 layer_materials['layer_outputs'][layer_name] = {
                     'status': 'success',
                     'generator_type': generator_type,
                     'output_file': output_file,
-                    'result': result[:200] + '...' if len(str(result)) > 200 else str(result)
+                    # 推测式汇合和直接执行都返回dict，先转成文本再截断
+                    'result': str(result)[:200] + '...' if len(str(result)) > 200 else str(result)
                 }
                 
                 print(f"✅ {layer_name}执行完成")
@@ -405,10 +693,23 @@ class EnhancedBannerSystem(MultiAgentHub):
                     'error': str(e)
                 }
         
+        # 丢弃未被汇合的推测式任务并清理暂存目录
+        self.speculative_dispatcher.shutdown()
+        layer_materials['speculative_stats'] = dict(self.speculative_dispatcher.stats)
+        import shutil
+        shutil.rmtree(os.path.join(self.work_dir, 'speculative'), ignore_errors=True)
+        
         return layer_materials
     
+    @traced('layer.svg')
     def _execute_svg_layer(self, layer_name, layer_routing_result, output_dir=None):
         """执行SVG图层生成"""
+        current_span().set_attribute('layer', layer_name)
+        with usage_scope(layer=layer_name):
+            return self._generate_svg_layer(layer_name, layer_routing_result, output_dir)
+    
+    def _generate_svg_layer(self, layer_name, layer_routing_result, output_dir=None):
+        """SVG图层生成的具体步骤"""
         try:
             # 导入create_generator函数而不是直接导入类
             from ..svg_code_generator import create_generator
@@ -452,6 +753,10 @@ class EnhancedBannerSystem(MultiAgentHub):
             if result.get('status') == 'success':
                 print(f"✅ {layer_name} SVG生成成功")
                 print(f"   生成文件数量: {result.get('count', 0)}")
+                optimization = result.get('optimization')
+                if optimization and optimization['saved_bytes']:
+                    print(f"   SVG优化节省: {optimization['saved_bytes']} 字节"
+                          f"（{optimization['original_bytes']} → {optimization['optimized_bytes']}）")
                 for file_info in result.get('saved_files', []):
                     print(f"   - {file_info.get('filename', 'unknown')}: {file_info.get('file_path', 'unknown')}")
             else:
@@ -468,8 +773,15 @@ class EnhancedBannerSystem(MultiAgentHub):
             print(f"❌ {error_msg}")
             return {'status': 'error', 'error': error_msg}
     
+    @traced('layer.image')
     def _execute_image_layer(self, layer_name, layer_routing_result, output_dir=None):
         """执行图像图层生成"""
+        current_span().set_attribute('layer', layer_name)
+        with usage_scope(layer=layer_name):
+            return self._generate_image_layer(layer_name, layer_routing_result, output_dir)
+    
+    def _generate_image_layer(self, layer_name, layer_routing_result, output_dir=None):
+        """图像图层生成的具体步骤"""
         try:
             from ..background_image_generator import BackgroundImageGenerator
             
@@ -478,9 +790,17 @@ class EnhancedBannerSystem(MultiAgentHub):
                 output_dir = os.path.join(self.work_dir, 'images')
                 os.makedirs(output_dir, exist_ok=True)
             
+            # 展示尺寸取自图层规格或布局SVG，原图统一保存在工作目录的originals下
+            layer_spec = self.final_layer_specs.get(layer_name) or self.streamed_layer_specs.get(layer_name)
+            target_box = resolve_target_box(
+                layer_name, layer_spec, find_layout_svg(os.path.join(self.work_dir, 'svg'))
+            )
+            
             generator = BackgroundImageGenerator(
                 layer_type=layer_name,
-                output_dir=output_dir
+                output_dir=output_dir,
+                target_box=target_box,
+                originals_dir=os.path.join(self.work_dir, 'originals')
             )
             
             # 使用图层路由结果作为输入，而不是设计文件路径
@@ -500,8 +820,12 @@ class EnhancedBannerSystem(MultiAgentHub):
         except Exception as e:
             return {'status': 'error', 'error': str(e)}
     
-    def _execute_single_agent(self, agent, instruction):
-        """执行单个Agent并处理错误"""
+    @traced('agent.run')
+    def _execute_single_agent(self, agent, instruction, on_text=None):
+        """执行单个Agent并处理错误
+
+        on_text: 可选回调，流式接收当前累计的助手回复文本
+        """
         try:
             # 检查输入长度
             if len(instruction) > 25000:
@@ -510,9 +834,10 @@ class EnhancedBannerSystem(MultiAgentHub):
             
             print(f"=== 执行Agent: {agent.name} ===")
             print(f"输入消息长度: {len(instruction)} 字符")
+            current_span().set_attributes(agent=agent.name, model=model_name_of(agent), prompt_chars=len(instruction))
             
             messages = [{'role': 'user', 'content': instruction}]
-            response_generator = agent.run(messages)
+            response_generator = governed_run(agent, messages)
             
             # 收集所有响应
             all_responses = []
@@ -527,6 +852,15 @@ class EnhancedBannerSystem(MultiAgentHub):
                     all_responses.append(response)
                 elif isinstance(response, str):
                     all_responses.append({'role': 'assistant', 'content': response})
+                
+                # 将当前累计的助手文本交给流式消费者
+                if on_text is not None:
+                    streamed_text = self._latest_assistant_text(response)
+                    if streamed_text:
+                        try:
+                            on_text(streamed_text)
+                        except Exception as e:
+                            print(f"⚠️ 流式处理失败: {e}")
             
             # 从响应中提取最终内容
             result = ""
@@ -537,6 +871,7 @@ class EnhancedBannerSystem(MultiAgentHub):
                         result = content
                         break
             
+            current_span().set_attributes(responses=response_count, response_chars=len(result))
             print(f"  Agent执行完成，收到 {response_count} 个响应，结果长度: {len(result)}")
             print(f"=== {agent.name} 执行完成 ===")
             
@@ -544,38 +879,60 @@ class EnhancedBannerSystem(MultiAgentHub):
             
         except Exception as e:
             error_msg = f"Agent {agent.name} 执行失败: {str(e)}"
+            current_span().record_error(e)
             print(f"❌ {error_msg}")
-            return f"执行失败: {str(e)}"
+            return f"{AGENT_FAILURE_PREFIX}{str(e)}"
+    
+    def _latest_assistant_text(self, response) -> str:
+        """从单次流式响应中取出最后一条助手消息的文本"""
+        if isinstance(response, str):
+            return response
+        messages = response if isinstance(response, list) else [response]
+        for msg in reversed(messages):
+            if isinstance(msg, dict) and msg.get('role') == 'assistant':
+                content = msg.get('content', '')
+                if isinstance(content, str):
+                    return content
+        return ""
     
     def _copy_resources_to_web(self, web_dir: str):
-        """复制SVG和图像资源到web文件夹"""
+        """增量同步SVG和图像资源到web文件夹，只复制变化的文件并删除多余文件"""
         try:
-            import shutil
-            
             # 创建资源子文件夹
             assets_dir = os.path.join(web_dir, 'assets')
             os.makedirs(assets_dir, exist_ok=True)
             
-            # 复制SVG文件
-            svg_dir = os.path.join(self.work_dir, 'svg')
-            if os.path.exists(svg_dir):
-                web_svg_dir = os.path.join(assets_dir, 'svg')
-                if os.path.exists(web_svg_dir):
-                    shutil.rmtree(web_svg_dir)
-                shutil.copytree(svg_dir, web_svg_dir)
-                print(f"✅ SVG文件已复制到: {web_svg_dir}")
-            
-            # 复制图像文件
-            images_dir = os.path.join(self.work_dir, 'images')
-            if os.path.exists(images_dir):
-                web_images_dir = os.path.join(assets_dir, 'images')
-                if os.path.exists(web_images_dir):
-                    shutil.rmtree(web_images_dir)
-                shutil.copytree(images_dir, web_images_dir)
-                print(f"✅ 图像文件已复制到: {web_images_dir}")
+            # 资源库可用时变化的文件入库并硬链接到web/assets，未变化的文件沿用上次记录的摘要
+            previous = self.asset_store.project_files(self.work_dir) if self.asset_store else {}
+            references = {}
+            sync_results = {}
+            for subdir, label in (('svg', 'SVG文件'), ('images', '图像文件')):
+                source_dir = os.path.join(self.work_dir, subdir)
+                if not os.path.exists(source_dir):
+                    continue
+                web_subdir = os.path.join(assets_dir, subdir)
+                # 只有web/assets中的文件链接到资源库，工作目录中的源文件保留私有副本
+                prefix = os.path.join('web', 'assets', subdir) + os.sep
+                sources = [os.path.relpath(os.path.join(root, name), source_dir)
+                           for root, _, names in os.walk(source_dir) for name in names]
+                result = sync_tree(
+                    source_dir, web_subdir, self.asset_store,
+                    known_digests={k[len(prefix):]: v for k, v in previous.items() if k.startswith(prefix)},
+                    # 响应式图像变体由web目录中的位图派生，源图仍在时保留
+                    keep=lambda relative, sources=sources: is_variant_of(relative, sources)
+                )
+                for relative, digest in result.pop('digests').items():
+                    references[prefix + relative] = digest
+                sync_results[subdir] = result
+                print(f"✅ {label}已同步到: {web_subdir}（更新 {len(result['copied'])}，"
+                      f"未变 {result['unchanged']}，删除 {len(result['removed'])}）")
+            
+            self.asset_sync_result = sync_results
+            if self.asset_store:
+                self.asset_store.record_project(self.work_dir, references)
                 
         except Exception as e:
-            print(f"❌ 资源文件复制失败: {e}")
+            print(f"❌ 资源文件同步失败: {e}")
     
     def _collect_generated_files_summary(self):
         """收集生成文件的详细信息，包括文件内容和描述"""
@@ -709,6 +1066,22 @@ class EnhancedBannerSystem(MultiAgentHub):
                 'html_render': html_result,
                 'quality_validation': vl_validation_result
             },
+            'rate_limiter': get_governor().metrics(),
+            'image_backends': image_backend_metrics(),
+            'llm_transport': get_transport().metrics(),
+            'phase_profile': self.profiler.summary(),
+            'usage': self.usage_ledger.summary(),
+            'bundle': self.bundle_result,
+            'image_compression': self.image_compression_result,
+            'image_delivery': self.image_delivery_result,
+            'asset_store': self.asset_store.report() if self.asset_store else None,
+            'asset_sync': self.asset_sync_result,
+            'prompt_prefix': self.prompt_prefix_stats.report(),
+            'context_dedup': self.context_stats.report(),
+            'structured_output': self.structured_output,
+            'json_repair': self.repair_stats.report(),
+            'semantic_cache': {**self.semantic_cache.report(), 'result': self.semantic_cache_result}
+            if self.semantic_cache else None,
             'completed_at': datetime.datetime.now().isoformat()
         }
         
@@ -883,6 +1256,8 @@ class EnhancedBannerSystem(MultiAgentHub):
                 with open(final_html_path, 'w', encoding='utf-8') as f:
                     f.write(current_html)
                 print(f"优化后的 HTML 已保存: {final_html_path}")
+                self.image_delivery_result = deliver_responsive_images([final_html_path], self.image_delivery)
+                self.bundle_result = bundle_html(final_html_path)
             except Exception as e:
                 print(f"保存优化 HTML 失败: {e}")
         
@@ -911,16 +1286,22 @@ class EnhancedBannerSystem(MultiAgentHub):
         screenshot_path = os.path.join(debug_dir, f'banner_screenshot_iter_{iteration}.png')
         
         # 调用截图工具
+        SCREENSHOTS_IN_FLIGHT.inc()
+        start = time.monotonic()
         try:
             screenshot_result = self.screenshot_tool(
                 html_file_path=html_file_path,
                 output_path=screenshot_path
             )
+            SCREENSHOT_DURATION.observe(time.monotonic() - start, status='ok' if screenshot_result else 'error')
             print(f"✅ 截图保存成功: {screenshot_path}")
             print(f"📄 HTML文件保存: {html_file_path}")
         except Exception as e:
+            SCREENSHOT_DURATION.observe(time.monotonic() - start, status='error')
             print(f"❌ 截图失败: {e}")
             return None
+        finally:
+            SCREENSHOTS_IN_FLIGHT.dec()
         
         return screenshot_path
     
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
 
 class PromptManager:
     """Prompt 配置管理器"""
@@ -45,6 +45,30 @@ class PromptManager:
         
         return template
     
+    def split_prompt(self, prompt_type: str, variables: Dict[str, Any] = None) -> Tuple[str, str]:
+        """拆分为 (静态部分, 变量部分)
+
+        静态部分是第一个变量占位符所在段落之前的模板内容，与变量取值无关、逐字节稳定，
+        拼接时放在最前面以便命中服务端前缀缓存；变量部分完成替换后放在后面。
+        """
+        if prompt_type not in self.prompts:
+            raise ValueError(f"未找到 prompt 类型: {prompt_type}")
+        
+        prompt_config = self.prompts[prompt_type]
+        template = prompt_config['template']
+        placeholders = prompt_config['variables']
+        positions = [template.find(p) for p in placeholders.values() if p in template]
+        cut = min(positions) if positions else len(template)
+        # 占位符所在段落（例如"# 知识库"标题和说明）与变量内容放在一起
+        paragraph = template.rfind('\n\n', 0, cut)
+        if paragraph != -1:
+            cut = paragraph + 2
+        
+        variable_part = template[cut:]
+        for key, placeholder in placeholders.items():
+            variable_part = variable_part.replace(placeholder, str((variables or {}).get(key, '')))
+        return template[:cut], variable_part
+    
     def list_available_prompts(self) -> list:
         """列出所有可用的 prompt 类型"""
         return list(self.prompts.keys())
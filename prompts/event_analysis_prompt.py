@@ -39,13 +39,7 @@ EVENT_ANALYSIS_PROMPT = """
 
 通过以上技能和限制，你可以为用户提供高质量、符合需求的Banner设计方案。
 
-# 知识库
-请记住以下材料，他们可能对回答问题有帮助。
-${documents}
-
 # 样例
-${samples}
-
 ### **事件分析：印巴冲突与基金营销Banner设计**
 #### 提取关键信息
 1. **事件名称**：印巴冲突。
@@ -170,9 +164,16 @@ ${samples}
 
 ### **结论**
 通过将印巴冲突事件转化为基金营销的机会点，本次Banner设计聚焦军工板块的投资亮点，融合军事科技美学和高端金融风格，旨在高效吸引目标用户，并引导他们采取进一步的投资行为。
+
+${samples}
+
+# 知识库
+请记住以下材料，他们可能对回答问题有帮助。
+${documents}
 """
 
 # 可以添加其他相关的 prompt 变量
+# 占位符都放在模板末尾，之前的内容逐字节稳定，可被服务端前缀缓存命中
 EVENT_ANALYSIS_VARIABLES = {
     'documents': '${documents}',
     'samples': '${samples}'
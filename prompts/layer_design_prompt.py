@@ -47,7 +47,7 @@ LAYER_DESIGN_PROMPT = """
 ${documents}
 """
 
-# 定义变量占位符
+# 定义变量占位符（放在模板末尾，之前的内容逐字节稳定，可被服务端前缀缓存命中）
 LAYER_DESIGN_VARIABLES = {
     'documents': '${documents}'
 }
\ No newline at end of file
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""图层设计和图层路由阶段的输出JSON Schema
+
+Schema同时用于三处：拼进Agent的system_message作为输出约定、显式开启JSON模式（BANNER_JSON_MODE=on）
+时作为response_format的约定、以及本地校验（utils/schema_validator.py）。
+"""
+import json
+import os
+from typing import Dict, Any
+
+LAYER_KEYS = ('layout', 'background', 'main_element', 'logo', 'text', 'effects')
+LAYER_NAMES = ('布局层', '背景层', '主要素层', '表意标识层', '文字层', '效果层')
+AGENT_TOOLS = ('code_interpreter', 'image_gen')
+
+LAYER_DESIGN_ITEM_SCHEMA = {
+    'type': 'object',
+    'required': ['tool', 'input', 'output'],
+    'properties': {
+        'agent': {'type': 'string'},
+        'tool': {'type': 'string', 'enum': list(AGENT_TOOLS)},
+        'input': {'type': ['string', 'object']},
+        'output': {'type': 'array', 'items': {'type': 'string'}, 'minItems': 1},
+        'size': {'type': 'string'},
+        'display_size': {'type': 'string', 'description': '图层在Banner中的展示尺寸（宽x高，像素），例如 600x400'},
+        'specifications': {'type': ['string', 'object']}
+    }
+}
+
+LAYER_DESIGN_SCHEMA = {
+    'type': 'object',
+    'required': ['layers'],
+    'properties': {
+        'project_name': {'type': 'string'},
+        'overall_size': {'type': 'string'},
+        'layers': {
+            'type': 'object',
+            'required': list(LAYER_KEYS),
+            'properties': {key: LAYER_DESIGN_ITEM_SCHEMA for key in LAYER_KEYS},
+            'additionalProperties': False
+        }
+    }
+}
+
+LAYER_ROUTING_ITEM_SCHEMA = {
+    'type': 'object',
+    'required': ['layer_name', 'agent'],
+    'properties': {
+        'layer_name': {'type': 'string', 'enum': list(LAYER_NAMES)},
+        'agent': {'type': 'string', 'enum': list(AGENT_TOOLS)},
+        'layer_goal': {'type': 'string'},
+        'key_elements': {'type': ['string', 'array']},
+        'input_parameters': {'type': 'object'},
+        'output_requirements': {'type': 'string'}
+    }
+}
+
+LAYER_ROUTING_SCHEMA = {
+    'type': 'object',
+    'required': ['layers'],
+    'properties': {
+        'layers': {'type': 'array', 'minItems': 1, 'items': LAYER_ROUTING_ITEM_SCHEMA}
+    }
+}
+
+# 设计方案中规则无法识别的自定义图层（如 decoration）由路由模型路由，图层名称不限于标准图层
+CUSTOM_LAYER_ROUTING_SCHEMA = {
+    'type': 'object',
+    'required': ['layers'],
+    'properties': {
+        'layers': {
+            'type': 'array',
+            'minItems': 1,
+            'items': {
+                **LAYER_ROUTING_ITEM_SCHEMA,
+                'properties': {**LAYER_ROUTING_ITEM_SCHEMA['properties'], 'layer_name': {'type': 'string'}}
+            }
+        }
+    }
+}
+
+# 支持 response_format={'type': 'json_object'} 的模型（按前缀匹配）
+JSON_MODE_MODELS = ('qwen-max', 'qwen-plus', 'qwen-turbo', 'qwen-long')
+
+
+def json_mode_enabled(llm_config: Dict[str, Any]) -> bool:
+    """通过 BANNER_JSON_MODE=on 显式开启且模型支持时启用JSON模式
+
+    JSON模式下设计和路由Agent不挂载 file_saver/progress_tracker，默认关闭。
+    """
+    if os.getenv('BANNER_JSON_MODE', 'off').strip().lower() not in ('on', '1', 'true', 'yes'):
+        return False
+    model = (llm_config or {}).get('model', '')
+    return any(model.startswith(prefix) for prefix in JSON_MODE_MODELS)
+
+
+def json_mode_config(llm_config: Dict[str, Any]) -> Dict[str, Any]:
+    """在llm配置的generate_cfg中加入JSON模式"""
+    llm_config = dict(llm_config or {})
+    llm_config['generate_cfg'] = {
+        **llm_config.get('generate_cfg', {}),
+        'response_format': {'type': 'json_object'}
+    }
+    return llm_config
+
+
+def output_contract(schema: Dict[str, Any], json_mode: bool) -> str:
+    """追加到system_message末尾的输出约定，内容固定，不影响提示词前缀缓存"""
+    schema_text = json.dumps(schema, ensure_ascii=False, indent=2)
+    if json_mode:
+        return f"""
+
+## 输出格式（必须遵守，优先于上文的输出要求）
+只输出一个符合下面JSON Schema的JSON对象，不要输出Markdown、代码块或任何说明文字，也不要调用工具。
+```json
+{schema_text}
+```"""
+    return f"""
+
+## 输出格式（必须遵守）
+在回复中给出一个符合下面JSON Schema的JSON对象，放在 ```json 代码块中。
+```json
+{schema_text}
+```"""
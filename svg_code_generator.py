@@ -1,10 +1,13 @@
-import json
 import os
-import re
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 from qwen_agent.agents import Assistant
 from .svg_layer_filter_agent import SVGLayerFilterAgent
+from .utils.rate_limiter import governed_run
+from .utils.tracing import traced
+from .utils.svg_optimizer import SVGOptimizer
+from .utils.svg_extractor import extract_svg_fragments
+from .utils.json_repair import loads_lenient, record_repair
 import dashscope
 
 class SVGCodeGeneratorConfig:
@@ -14,24 +17,40 @@ class SVGCodeGeneratorConfig:
                  model: str = 'qwen-max',
                  model_server: str = 'dashscope',
                  max_input_tokens: int = 80000,
-                 output_dir: str = 'generated_svgs'):
+                 output_dir: str = 'generated_svgs',
+                 optimize_svg: bool = True,
+                 svg_precision: int = 2):
         self.api_key = api_key or os.getenv('DASHSCOPE_API_KEY', '')
         self.model = model
         self.model_server = model_server
         self.max_input_tokens = max_input_tokens
         self.output_dir = output_dir
+        # 保存前优化SVG（删除注释、舍入坐标、合并重复定义等），svg_precision为坐标保留的小数位数
+        self.optimize_svg = optimize_svg
+        self.svg_precision = svg_precision
         
         # 设置API密钥
         dashscope.api_key = self.api_key
 
 class RobustJSONExtractor:
-    """鲁棒的JSON提取器"""
+    """鲁棒的JSON提取器
+
+    先用本地容错解析（代码块、注释、尾逗号、引号、截断等），全部失败时才调用模型修复。
+    生成流程本身不调用它（都只用本地解析），供需要模型兜底的调用方使用。
+    """
     def __init__(self, config: SVGCodeGeneratorConfig):
-        self.agent = Assistant(
-            llm={'model': config.model},
-            name='JSON提取器',
-            description='专门用于从混乱文本中提取和修复JSON格式',
-            system_message="""
+        self.config = config
+        self._agent = None
+    
+    @property
+    def agent(self) -> Assistant:
+        """模型修复Agent，只在本地解析失败时创建"""
+        if self._agent is None:
+            self._agent = Assistant(
+                llm={'model': self.config.model},
+                name='JSON提取器',
+                description='专门用于从混乱文本中提取和修复JSON格式',
+                system_message="""
 你是一个专业的JSON提取和修复专家。你的任务是：
 1. 从给定的文本中识别和提取JSON内容
 2. 修复格式错误的JSON
@@ -40,7 +59,19 @@ class RobustJSONExtractor:
 
 请只返回修复后的JSON，不要添加任何解释。
 """
-        )
+            )
+        return self._agent
+    
+    def extract_json(self, text: str) -> Optional[dict]:
+        """提取JSON：本地容错解析优先，模型修复兜底"""
+        data = loads_lenient(text)
+        if data is not None:
+            return data
+        
+        print("本地JSON解析失败，使用Agent修复")
+        data = self.extract_json_with_agent(text)
+        record_repair('agent', data is not None)
+        return data
     
     def extract_json_with_agent(self, text: str) -> Optional[dict]:
         """使用Agent提取和修复JSON"""
@@ -49,7 +80,7 @@ class RobustJSONExtractor:
                 {'role': 'user', 'content': f'请从以下文本中提取并修复JSON格式：\n\n{text}'}
             ]
             
-            response_generator = self.agent.run(messages)
+            response_generator = governed_run(self.agent, messages)
             responses = []
             for response in response_generator:
                 responses.extend(response)
@@ -57,10 +88,10 @@ class RobustJSONExtractor:
             for msg in reversed(responses):
                 if msg.get('role') == 'assistant':
                     json_content = msg.get('content', '').strip()
-                    try:
-                        return json.loads(json_content)
-                    except json.JSONDecodeError:
-                        continue
+                    # 模型回复同样可能带代码块或尾逗号
+                    data = loads_lenient(json_content)
+                    if data is not None:
+                        return data
             
             return None
             
@@ -86,6 +117,9 @@ class SVGCodeGenerator:
         
         # 初始化JSON提取器
         self.json_extractor = RobustJSONExtractor(self.config)
+        
+        # 初始化SVG优化器
+        self.svg_optimizer = SVGOptimizer(self.config.svg_precision) if self.config.optimize_svg else None
     
     def _init_agents(self):
         """初始化各种Agent"""
@@ -156,6 +190,7 @@ class SVGCodeGenerator:
                 'source_file': file_path
             }
     
+    @traced('layer.prompt')
     def generate_svg_prompt(self, layer_content: str) -> str:
         """生成SVG生成提示词"""
         try:
@@ -185,7 +220,7 @@ class SVGCodeGenerator:
             {'role': 'user', 'content': layer_content}
         ]
         
-        response_generator = self.prompt_extractor.run(messages)
+        response_generator = governed_run(self.prompt_extractor, messages)
         responses = []
         for response in response_generator:
             responses.extend(response)
@@ -199,6 +234,7 @@ class SVGCodeGenerator:
         
         raise Exception("Agent提示词提取失败")
     
+    @traced('layer.generate')
     def generate_svg_code(self, layer_content: str) -> Dict[str, Any]:
         """生成SVG代码"""
         try:
@@ -232,7 +268,7 @@ class SVGCodeGenerator:
             ]
             
             # 使用Assistant生成SVG
-            response_generator = self.svg_generator.run(messages)
+            response_generator = governed_run(self.svg_generator, messages)
             responses = []
             for response in response_generator:
                 responses.extend(response)
@@ -259,23 +295,34 @@ class SVGCodeGenerator:
                 'error': f'SVG生成失败: {str(e)}'
             }
     
+    @traced('layer.extract', target='svg')
     def extract_svg_from_response(self, response_content: str) -> List[str]:
         """从生成结果中提取SVG代码"""
         try:
             print("正在提取SVG代码...")
             
-            # 优先使用Agent提取
+            # 优先本地解析，修复缺少xmlns、未闭合标签等常见问题
+            result = extract_svg_fragments(response_content)
+            if result['svg_codes']:
+                print(f"本地解析成功提取{len(result['svg_codes'])}个SVG代码")
+                if result['repairs']:
+                    print(f"   已修复: {', '.join(result['repairs'])}")
+                if result['duplicates']:
+                    print(f"   跳过重复的SVG: {result['duplicates']}个")
+                return result['svg_codes']
+            
+            print(f"本地解析失败，使用Agent提取: {'; '.join(result['errors']) or '未找到<svg>标签'}")
+            
+            # 备用的Agent提取方法，结果同样经过本地校验
             svg_code = self._extract_svg_with_agent(response_content)
             if svg_code:
-                svg_codes = self._split_multiple_svgs(svg_code)
+                svg_codes = extract_svg_fragments(svg_code)['svg_codes']
                 if svg_codes:
                     print(f"Agent成功提取{len(svg_codes)}个SVG代码")
                     return svg_codes
             
-            print("Agent提取失败，使用传统正则表达式方法")
-            
-            # 备用的传统提取方法
-            return self._extract_svg_with_regex(response_content)
+            print("Agent也未能提取到有效的SVG代码")
+            return []
             
         except Exception as e:
             print(f"SVG提取失败: {e}")
@@ -310,7 +357,7 @@ class SVGCodeGenerator:
             {'role': 'user', 'content': response_content}
         ]
         
-        response_generator = self.svg_extractor.run(messages)
+        response_generator = governed_run(self.svg_extractor, messages)
         responses = []
         for response in response_generator:
             responses.extend(response)
@@ -323,47 +370,7 @@ class SVGCodeGenerator:
         
         return None
     
-    def _extract_svg_with_regex(self, response_content: str) -> List[str]:
-        """使用正则表达式提取SVG代码"""
-        svg_codes = []
-        
-        # 定义多种SVG提取模式
-        svg_patterns = [
-            r'```svg\s*\n([\s\S]*?)\n```',  # ```svg 代码块
-            r'```xml\s*\n([\s\S]*?)\n```',  # ```xml 代码块
-            r'```\s*\n(<svg[\s\S]*?</svg>)\s*\n```',  # 通用代码块中的SVG
-            r'(<svg[^>]*>[\s\S]*?</svg>)',  # 直接的SVG标签
-        ]
-        
-        for pattern in svg_patterns:
-            matches = re.findall(pattern, response_content, re.IGNORECASE | re.MULTILINE)
-            for match in matches:
-                svg_code = match if isinstance(match, str) else match[0]
-                
-                # 验证SVG代码的完整性
-                if '<svg' in svg_code and '</svg>' in svg_code:
-                    svg_codes.append(svg_code.strip())
-        
-        if svg_codes:
-            print(f"传统方法成功提取{len(svg_codes)}个SVG代码")
-        else:
-            print("传统方法也未能提取到有效的SVG代码")
-        
-        return svg_codes
-    
-    def _split_multiple_svgs(self, svg_content: str) -> List[str]:
-        """分割包含多个SVG的内容"""
-        svg_pattern = r'(<svg[^>]*>[\s\S]*?</svg>)'
-        matches = re.findall(svg_pattern, svg_content, re.IGNORECASE)
-        
-        if len(matches) > 1:
-            print(f"发现{len(matches)}个SVG代码")
-            return [match.strip() for match in matches]
-        elif matches:
-            return [matches[0].strip()]
-        else:
-            return [svg_content.strip()] if svg_content.strip() else []
-    
+    @traced('layer.extract', target='filename')
     def generate_filename(self, layer_content: str) -> str:
         """生成文件名"""
         try:
@@ -393,7 +400,7 @@ class SVGCodeGenerator:
             {'role': 'user', 'content': content}
         ]
         
-        response_generator = self.filename_extractor.run(messages)
+        response_generator = governed_run(self.filename_extractor, messages)
         responses = []
         for response in response_generator:
             responses.extend(response)
@@ -415,6 +422,7 @@ class SVGCodeGenerator:
         layer_name = self.layer_type.replace('图层', '')
         return f"{layer_name}_{timestamp}.svg"
     
+    @traced('layer.save')
     def save_svg_files(self, svg_codes: List[str], base_filename: str) -> Dict[str, Any]:
         """保存SVG文件"""
         try:
@@ -424,30 +432,27 @@ class SVGCodeGenerator:
             
             if len(svg_codes) == 1:
                 # 只有一个SVG，使用原文件名
-                file_path = self._save_single_svg_file(svg_codes[0], base_filename)
-                saved_files.append({
-                    'file_path': file_path,
-                    'filename': base_filename,
-                    'svg_code': svg_codes[0]
-                })
+                saved_files.append(self._save_single_svg_file(svg_codes[0], base_filename))
             else:
                 # 多个SVG，添加序号
                 base_name = base_filename.replace('.svg', '')
                 for i, svg_code in enumerate(svg_codes, 1):
                     filename = f"{base_name}_{i}.svg"
-                    file_path = self._save_single_svg_file(svg_code, filename)
-                    saved_files.append({
-                        'file_path': file_path,
-                        'filename': filename,
-                        'svg_code': svg_code
-                    })
+                    saved_files.append(self._save_single_svg_file(svg_code, filename))
             
             print(f"成功保存{len(saved_files)}个SVG文件")
             
+            original_bytes = sum(f['optimization']['original_bytes'] for f in saved_files)
+            optimized_bytes = sum(f['optimization']['optimized_bytes'] for f in saved_files)
             return {
                 'status': 'success',
                 'saved_files': saved_files,
-                'count': len(saved_files)
+                'count': len(saved_files),
+                'optimization': {
+                    'original_bytes': original_bytes,
+                    'optimized_bytes': optimized_bytes,
+                    'saved_bytes': original_bytes - optimized_bytes
+                }
             }
             
         except Exception as e:
@@ -456,14 +461,31 @@ class SVGCodeGenerator:
                 'error': f'文件保存失败: {str(e)}'
             }
     
-    def _save_single_svg_file(self, svg_code: str, filename: str) -> str:
-        """保存单个SVG文件"""
+    def _save_single_svg_file(self, svg_code: str, filename: str) -> Dict[str, Any]:
+        """优化并保存单个SVG文件，返回文件信息和优化统计"""
         file_path = os.path.join(self.config.output_dir, filename)
         
+        original_bytes = len(svg_code.encode('utf-8'))
+        optimization = {'status': 'disabled', 'original_bytes': original_bytes, 'optimized_bytes': original_bytes}
+        if self.svg_optimizer:
+            result = self.svg_optimizer.optimize(svg_code)
+            svg_code = result.pop('svg_code')
+            optimization = result
+            if result['status'] == 'success':
+                print(f"🗜️ {filename} 优化: {result['original_bytes']} → {result['optimized_bytes']} 字节"
+                      f"（-{result['saved_ratio']:.1%}）")
+            else:
+                print(f"⚠️ {filename} 未优化: {result.get('error', '')}")
+        
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(svg_code)
         
-        return file_path
+        return {
+            'file_path': file_path,
+            'filename': filename,
+            'svg_code': svg_code,
+            'optimization': optimization
+        }
     
     def process_file(self, file_path: str, layer_type: str = None) -> Dict[str, Any]:
         """完整的处理流程：输入文件 -> 抽取图层要求 -> 生成SVG -> 提取SVG代码 -> 保存"""
@@ -515,9 +537,10 @@ class SVGCodeGenerator:
                 'source_file': file_path,
                 'layer_type': target_layer,
                 'layer_content': layer_content,
-                'svg_codes': svg_codes,
+                'svg_codes': [f['svg_code'] for f in save_result['saved_files']],
                 'saved_files': save_result['saved_files'],
                 'count': save_result['count'],
+                'optimization': save_result['optimization'],
                 'prompt': generate_result['prompt'],
                 'full_response': generate_result['full_response']
             }
@@ -2,6 +2,12 @@ import json
 import os
 from typing import Dict, Any, Optional
 from qwen_agent.agents import Assistant
+try:
+    from .utils.rate_limiter import governed_run
+    from .utils.tracing import traced
+except ImportError:
+    from utils.rate_limiter import governed_run
+    from utils.tracing import traced
 import dashscope
 
 # 设置API密钥
@@ -38,6 +44,7 @@ class SVGLayerFilterAgent:
 4. 如果找不到对应层，返回"未找到对应图层"
         """.strip()
     
+    @traced('layer.filter')
     def filter_layer(self, layer_content: str, target_layer: str = None) -> str:
         """从图层内容中过滤出指定图层信息
         
@@ -56,7 +63,7 @@ class SVGLayerFilterAgent:
         
         try:
             # 使用Assistant的run方法
-            response_generator = self.agent.run(messages)
+            response_generator = governed_run(self.agent, messages)
             
             # 获取响应
             responses = []
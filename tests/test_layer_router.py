@@ -0,0 +1,46 @@
+"""规则路由与路由模型结果合并的回归测试"""
+import json
+
+from banner_system.utils.layer_router import route_design, merge_llm_routes, unknown_layers_design, format_routing_result
+from banner_system.utils.layer_specs import parse_routing_output
+
+
+def _fenced(data):
+    return f"```json\n{json.dumps(data, ensure_ascii=False)}\n```"
+
+
+def _design_with_decoration():
+    spec = {'tool': 'code_interpreter', 'input': '要求', 'output': ['layer.svg']}
+    layers = {key: dict(spec) for key in ('layout', 'logo', 'text', 'effects')}
+    layers['background'] = {'tool': 'image_gen', 'input': '背景', 'output': ['background.png']}
+    layers['main_element'] = {'tool': 'image_gen', 'input': '主元素', 'output': ['main.png']}
+    layers['decoration'] = {'tool': 'code_interpreter', 'input': '角落装饰花纹', 'output': ['decoration.svg']}
+    return _fenced({'project_name': '春节', 'overall_size': '1200x600', 'layers': layers})
+
+
+def test_custom_layer_routed_by_llm_is_merged():
+    routing = route_design(_design_with_decoration())
+    assert routing['status'] == 'needs_llm'
+    assert routing['unknown_layers'] == ['decoration']
+    assert len(routing['routes']) == 6
+    assert 'decoration' in unknown_layers_design(routing)
+
+    llm_result = _fenced({'layers': [{'layer_name': 'decoration', 'agent': 'code_interpreter',
+                                      'layer_goal': '角落装饰花纹'}]})
+    merged = merge_llm_routes(routing, llm_result)
+    assert merged['status'] == 'success'
+    assert merged['missing'] == []
+    assert [route['layer_name'] for route in merged['routes']][-1] == 'decoration'
+
+    parsed = parse_routing_output(format_routing_result(merged['routes']), custom_layers=True)
+    assert parsed['status'] == 'success'
+    assert parsed['routes']['decoration']['agent'] == 'code_interpreter'
+
+
+def test_missing_custom_layer_is_reported():
+    routing = route_design(_design_with_decoration())
+    merged = merge_llm_routes(routing, '路由模型没有输出JSON')
+    assert merged['status'] == 'error'
+    assert merged['missing'] == ['decoration']
+    assert len(merged['routes']) == 6
+    assert any('decoration' in error for error in merged['errors'])
@@ -1,10 +1,11 @@
 from qwen_agent.tools.base import BaseTool
-from qwen_agent.tools import ImageGen, CodeInterpreter
+from qwen_agent.tools import CodeInterpreter
 import os
-import requests
 import re
 import json
 from typing import Dict, Any, Union
+from ..utils.image_backends import get_image_backend, extract_colors
+from ..utils.tracing import traced
 
 class EnhancedImageGen(BaseTool):
     name = 'enhanced_image_gen'
@@ -30,11 +31,13 @@ class EnhancedImageGen(BaseTool):
         }
     ]
     
-    def __init__(self, work_dir='./work'):
+    def __init__(self, work_dir='./work', image_backend: str = None):
         super().__init__()
         self.work_dir = work_dir
-        self.image_gen = ImageGen()
+        # 默认沿用qwen ImageGen，可通过参数或环境变量 BANNER_IMAGE_BACKEND 切换
+        self.image_backend = get_image_backend(image_backend, default='qwen_image_gen')
     
+    @traced('tool.enhanced_image_gen')
     def call(self, params: Union[str, Dict[str, Any]], **kwargs) -> str:
         # 确保params是字典格式
         if isinstance(params, str):
@@ -65,46 +68,32 @@ class EnhancedImageGen(BaseTool):
         os.makedirs(save_dir, exist_ok=True)
         
         try:
-            # 调用原始ImageGen工具
-            result = self.image_gen.call({'prompt': prompt, 'size': size})
-            
-            # 提取图片URL并下载保存
-            image_url = self._extract_image_url(result)
-            if image_url:
-                saved_path = self._download_and_save_image(image_url, filename)
-                return f"图片已生成并保存到: {saved_path}"
-            else:
-                return f"图片生成结果: {result}"
+            width, height = self._parse_size(size)
+            result = self.image_backend.generate(prompt, width, height, colors=extract_colors(prompt))
+            saved_path = self._save_image(result['content'], filename)
+            return f"图片已生成并保存到: {saved_path}"
                 
         except Exception as e:
             return f"图片生成过程中出现错误: {str(e)}"
     
-    def _extract_image_url(self, result):
-        """从结果中提取图片URL"""
-        if isinstance(result, str):
-            # 使用正则表达式提取URL
-            url_pattern = r'https?://[^\s<>"]+(?:\.png|\.jpg|\.jpeg|\.gif|\.webp)'
-            urls = re.findall(url_pattern, result)
-            return urls[0] if urls else None
-        return None
+    def _parse_size(self, size: str):
+        """解析1024x1024格式的尺寸"""
+        match = re.match(r'\s*(\d+)\s*[x×*]\s*(\d+)', str(size or ''))
+        if not match:
+            return 1024, 1024
+        return int(match.group(1)), int(match.group(2))
     
-    def _download_and_save_image(self, url: str, filename: str):
-        """下载并保存图片"""
-        try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            # 确保工作目录存在
-            os.makedirs(self.work_dir, exist_ok=True)
-            
-            # 保存文件
-            file_path = os.path.join(self.work_dir, filename)
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-            
-            return file_path
-        except Exception as e:
-            raise Exception(f"下载图片失败: {str(e)}")
+    def _save_image(self, content: bytes, filename: str):
+        """保存图片"""
+        # 确保工作目录存在
+        os.makedirs(self.work_dir, exist_ok=True)
+        
+        # 保存文件
+        file_path = os.path.join(self.work_dir, filename)
+        with open(file_path, 'wb') as f:
+            f.write(content)
+        
+        return file_path
 
 class EnhancedCodeExtractor(BaseTool):
     name = 'enhanced_code_extractor'
@@ -135,6 +124,7 @@ class EnhancedCodeExtractor(BaseTool):
         self.work_dir = work_dir
         self.code_interpreter = CodeInterpreter()
     
+    @traced('tool.enhanced_code_extractor')
     def call(self, params: Union[str, Dict[str, Any]], **kwargs) -> str:
         # 确保params是字典格式
         if isinstance(params, str):
@@ -201,6 +191,7 @@ class LayerImageGenerator(BaseTool):
         self.generator = None
         self.filter_agent = BackgroundLayerFilterAgent()
     
+    @traced('tool.layer_image_generator')
     def call(self, params: Dict[str, Any], **kwargs) -> Dict[str, Any]:
         """执行图层图像生成"""
         try:
@@ -286,6 +277,7 @@ class LayerContentFilter(BaseTool):
         """设置工作目录"""
         self.work_dir = work_dir
     
+    @traced('tool.layer_content_filter')
     def call(self, params: Dict[str, Any], **kwargs) -> Dict[str, Any]:
         """执行图层内容过滤"""
         try:
@@ -351,6 +343,7 @@ class SVGCodeGenerator(BaseTool):
         
         self.generator = None
     
+    @traced('tool.svg_code_generator')
     def call(self, params: Dict[str, Any], **kwargs) -> Dict[str, Any]:
         """执行SVG代码生成"""
         try:
@@ -3,6 +3,7 @@ import json
 import datetime
 from typing import Dict
 from qwen_agent.tools.base import BaseTool, register_tool
+from ..utils.tracing import traced
 
 @register_tool('enhanced_file_saver')
 class EnhancedFileSaver(BaseTool):
@@ -33,6 +34,7 @@ class EnhancedFileSaver(BaseTool):
         super().__init__()
         self.work_dir = work_dir
         
+    @traced('tool.enhanced_file_saver')
     def call(self, params: str, **kwargs) -> str:
         import json5
         params = json5.loads(params)
@@ -2,6 +2,7 @@ import os
 import json
 import datetime
 from qwen_agent.tools.base import BaseTool, register_tool
+from ..utils.tracing import traced
 
 @register_tool('progress_tracker')
 class ProgressTracker(BaseTool):
@@ -27,6 +28,7 @@ class ProgressTracker(BaseTool):
         super().__init__()
         self.work_dir = work_dir
         
+    @traced('tool.progress_tracker')
     def call(self, params: str, **kwargs) -> str:
         import json5
         params = json5.loads(params)
@@ -0,0 +1,306 @@
+"""跨项目共享的内容寻址资源库
+
+生成的资源按SHA-256存入共享blob目录，交付目录（web/assets）中的文件通过硬链接（跨文件系统时用reflink，
+都不支持时复制）指向blob，同样的内容在磁盘上只保存一份。项目的工作目录（svg/、images/）会被重新裁剪、
+重新生成等步骤改写，始终保留私有副本，不链接到blob。blob设为只读，链接和回收时都重新校验摘要，
+内容与摘要不符的blob视为损坏并删除。每个项目写一份引用清单，垃圾回收只删除没有任何清单引用、
+且没有其他硬链接的blob。
+"""
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows上不做跨进程加锁
+    fcntl = None
+
+# 共享库位置，可通过环境变量 BANNER_ASSET_STORE 覆盖，设为 off 关闭
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'banner_system', 'assets')
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 新写入的blob在该时间内不参与回收，避免与尚未写出清单的任务竞争
+GC_GRACE_SECONDS = 3600
+
+# Linux FICLONE ioctl，btrfs/xfs 上的写时复制克隆
+FICLONE = 0x40049409
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(src: str, dst: str) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+class AssetStore:
+    """SHA-256寻址的blob库，负责入库、链接到项目目录、引用计数和垃圾回收"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.blobs_dir = os.path.join(self.root, 'blobs')
+        self.refs_dir = os.path.join(self.root, 'refs')
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.refs_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.stats = {'stored': 0, 'deduplicated': 0, 'hardlink': 0, 'reflink': 0, 'copy': 0,
+                      'deduplicated_bytes': 0, 'corrupted': 0}
+
+    @contextmanager
+    def _store_lock(self, exclusive: bool = False) -> Iterator[None]:
+        """跨进程锁：入库和写清单持共享锁，垃圾回收持排他锁"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_dir, digest[:2], digest[2:])
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _remove_blob(self, blob: str):
+        # Windows上只读文件不能删除
+        os.chmod(blob, stat.S_IWUSR | READ_ONLY)
+        os.remove(blob)
+
+    def _verify_blob(self, digest: str) -> bool:
+        """blob存在且内容与摘要一致时返回True；内容不符时删除该blob"""
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            return False
+        if file_sha256(blob) == digest:
+            return True
+        print(f"⚠️ 资源库blob内容与摘要不符，已删除: {digest[:12]}")
+        self._remove_blob(blob)
+        self._count('corrupted')
+        return False
+
+    def _store_blob(self, path: str) -> str:
+        """把文件内容存为blob（已存在且校验通过则复用），返回摘要"""
+        digest = file_sha256(path)
+        blob = self.blob_path(digest)
+        if self._verify_blob(digest):
+            self._count('deduplicated')
+            self._count('deduplicated_bytes', os.path.getsize(path))
+            return digest
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp_path = f'{blob}.{os.getpid()}.{threading.get_ident()}.tmp'
+        shutil.copyfile(path, tmp_path)
+        os.chmod(tmp_path, READ_ONLY)
+        os.replace(tmp_path, blob)
+        self._count('stored')
+        return digest
+
+    def materialize(self, digest: str, dest: str) -> str:
+        """把blob原子地放到dest：优先硬链接，其次reflink，最后复制；返回使用的方式
+
+        dest之后不能被原地修改（硬链接时会改坏blob），只放到交付目录中。blob缺失或损坏时抛出ValueError。
+        """
+        blob = self.blob_path(digest)
+        if not self._verify_blob(digest):
+            raise ValueError(f"资源库中没有可用的blob: {digest}")
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        if os.path.exists(dest) and os.path.samefile(blob, dest):
+            return 'hardlink'
+        tmp_path = f'{dest}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.link(blob, tmp_path)
+            method = 'hardlink'
+        except OSError:
+            if _reflink(blob, tmp_path):
+                method = 'reflink'
+            else:
+                shutil.copyfile(blob, tmp_path)
+                method = 'copy'
+        os.replace(tmp_path, dest)
+        self._count(method)
+        return method
+
+    def link_file(self, src: str, dst: str) -> str:
+        """入库src，并把dst链接到该blob，返回摘要；src保持为独立文件"""
+        with self._store_lock():
+            digest = self._store_blob(src)
+            self.materialize(digest, dst)
+        return digest
+
+    def link_tree(self, src_dir: str, dst_dir: str) -> Dict[str, str]:
+        """把src_dir下的文件入库，并在dst_dir中按相同相对路径链接，返回 {相对路径: 摘要}"""
+        files = {}
+        for root, _, names in os.walk(src_dir):
+            for name in names:
+                src = os.path.join(root, name)
+                relative = os.path.relpath(src, src_dir)
+                files[relative] = self.link_file(src, os.path.join(dst_dir, relative))
+        return files
+
+    def _manifest_path(self, project_dir: str) -> str:
+        key = hashlib.sha256(os.path.abspath(project_dir).encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.refs_dir, f'{key}.json')
+
+    def record_project(self, project_dir: str, files: Dict[str, str]):
+        """写入项目的引用清单（项目内相对路径 -> 摘要），覆盖旧清单"""
+        project_dir = os.path.abspath(project_dir)
+        manifest = {'project': project_dir, 'updated_at': time.time(), 'files': files}
+        path = self._manifest_path(project_dir)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with self._store_lock():
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+
+    def project_files(self, project_dir: str) -> Dict[str, str]:
+        """读取项目已记录的引用清单，没有时返回空字典"""
+        try:
+            with open(self._manifest_path(project_dir), 'r', encoding='utf-8') as f:
+                return json.load(f).get('files', {})
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _manifests(self) -> List[Dict[str, Any]]:
+        manifests = []
+        for name in os.listdir(self.refs_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.refs_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    manifests.append({**json.load(f), 'manifest_path': path})
+            except (OSError, json.JSONDecodeError):
+                continue
+        return manifests
+
+    def refcounts(self) -> Dict[str, int]:
+        """各blob被现存项目引用的次数"""
+        counts: Dict[str, int] = {}
+        for manifest in self._manifests():
+            if not os.path.isdir(manifest.get('project', '')):
+                continue
+            for digest in manifest.get('files', {}).values():
+                counts[digest] = counts.get(digest, 0) + 1
+        return counts
+
+    def gc(self, grace_seconds: float = GC_GRACE_SECONDS, dry_run: bool = False) -> Dict[str, Any]:
+        """删除项目目录已不存在的清单、不再被引用的blob，以及内容与摘要不符的blob
+
+        仍有其他硬链接（链接数大于1）的blob即使不在任何清单中也保留，清单丢失时不会误删。
+        """
+        removed_manifests = 0
+        removed = []
+        corrupted = []
+        freed = 0
+        now = time.time()
+        with self._store_lock(exclusive=True):
+            for manifest in self._manifests():
+                if not os.path.isdir(manifest.get('project', '')):
+                    removed_manifests += 1
+                    if not dry_run:
+                        os.remove(manifest['manifest_path'])
+
+            counts = self.refcounts()
+            for prefix in os.listdir(self.blobs_dir):
+                prefix_dir = os.path.join(self.blobs_dir, prefix)
+                if not os.path.isdir(prefix_dir):
+                    continue
+                for name in os.listdir(prefix_dir):
+                    blob = os.path.join(prefix_dir, name)
+                    if name.endswith('.tmp'):
+                        continue
+                    digest = prefix + name
+                    info = os.stat(blob)
+                    if file_sha256(blob) != digest:
+                        # 损坏的blob不能再链接到新项目，已链接的项目文件不受删除影响
+                        corrupted.append(digest)
+                        freed += info.st_size
+                        if not dry_run:
+                            self._remove_blob(blob)
+                        continue
+                    if counts.get(digest):
+                        continue
+                    if info.st_nlink > 1 or now - info.st_mtime < grace_seconds:
+                        continue
+                    removed.append(digest)
+                    freed += info.st_size
+                    if not dry_run:
+                        self._remove_blob(blob)
+
+        if corrupted:
+            print(f"⚠️ 资源库中 {len(corrupted)} 个blob内容与摘要不符，已删除")
+        if removed or corrupted:
+            print(f"🧹 资源库回收 {len(removed) + len(corrupted)} 个blob，释放 {freed} 字节")
+        return {
+            'status': 'success',
+            'dry_run': dry_run,
+            'removed_manifests': removed_manifests,
+            'removed_blobs': len(removed),
+            'corrupted_blobs': len(corrupted),
+            'freed_bytes': freed
+        }
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        return {'root': self.root, **stats}
+
+
+_store: Optional[AssetStore] = None
+_store_lock = threading.Lock()
+
+
+def get_asset_store() -> Optional[AssetStore]:
+    """获取进程级的共享资源库，BANNER_ASSET_STORE=off 或目录不可用时返回None"""
+    global _store
+    root = os.getenv('BANNER_ASSET_STORE', DEFAULT_STORE_DIR)
+    if root.strip().lower() in ('', 'off', 'none', '0', 'false'):
+        return None
+    with _store_lock:
+        if _store is None or _store.root != os.path.abspath(root):
+            try:
+                _store = AssetStore(root)
+            except OSError as e:
+                print(f"⚠️ 资源库不可用，改为直接复制: {e}")
+                return None
+        return _store
+
+
+if __name__ == '__main__':
+    import sys
+    store = get_asset_store()
+    if store is None:
+        print("资源库已关闭")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'gc':
+        print(json.dumps(store.gc(dry_run='--dry-run' in sys.argv), ensure_ascii=False, indent=2))
+    else:
+        counts = store.refcounts()
+        print(json.dumps({'root': store.root, 'referenced_blobs': len(counts),
+                          'references': sum(counts.values())}, ensure_ascii=False, indent=2))
@@ -0,0 +1,93 @@
+"""目录增量同步
+
+按大小、修改时间、内容哈希判断文件是否变化，只复制变化的文件并删除目标中多余的文件，
+每个文件写入临时文件后原子替换。配合资源库时变化的文件改为入库，只有目标文件硬链接到blob，
+源文件保持独立（源目录会被原地改写）。
+"""
+import os
+import shutil
+import threading
+from typing import Dict, Any, Callable, Optional
+
+from .asset_store import AssetStore, file_sha256
+
+
+def _unchanged(src: str, dst: str) -> bool:
+    """先比较是否同一文件和大小，修改时间相同视为未变，否则比较内容哈希"""
+    if os.path.samefile(src, dst):
+        return True
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    if file_sha256(src) != file_sha256(dst):
+        return False
+    # 内容相同只是时间不同，对齐时间后下次可走快速路径
+    os.utime(dst, ns=(dst_stat.st_atime_ns, src_stat.st_mtime_ns))
+    return True
+
+
+def _atomic_copy(src: str, dst: str):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp_path = f'{dst}.{os.getpid()}.{threading.get_ident()}.tmp'
+    shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def sync_tree(src_dir: str, dst_dir: str, store: Optional[AssetStore] = None,
+              known_digests: Dict[str, str] = None,
+              keep: Callable[[str], bool] = None) -> Dict[str, Any]:
+    """把src_dir增量同步到dst_dir
+
+    store: 可选资源库，变化的文件入库并以硬链接放到目标（目标目录中的文件不能被原地修改）
+    known_digests: 上次记录的 {相对路径: 摘要}，未变化的文件直接沿用，不再计算哈希
+    keep: 判断目标中多余文件是否保留（例如由目标文件派生出的转码结果）
+    """
+    known_digests = known_digests or {}
+    copied, unchanged, removed = [], [], []
+    digests: Dict[str, str] = {}
+    copied_bytes = 0
+
+    sources = set()
+    for root, _, names in os.walk(src_dir):
+        for name in names:
+            src = os.path.join(root, name)
+            relative = os.path.relpath(src, src_dir)
+            sources.add(relative)
+            dst = os.path.join(dst_dir, relative)
+
+            if os.path.exists(dst) and _unchanged(src, dst):
+                unchanged.append(relative)
+                if store:
+                    digests[relative] = known_digests.get(relative) or file_sha256(src)
+                continue
+
+            if store:
+                digests[relative] = store.link_file(src, dst)
+            else:
+                _atomic_copy(src, dst)
+            copied.append(relative)
+            copied_bytes += os.path.getsize(dst)
+
+    if os.path.isdir(dst_dir):
+        for root, dirs, names in os.walk(dst_dir, topdown=False):
+            for name in names:
+                relative = os.path.relpath(os.path.join(root, name), dst_dir)
+                if relative in sources or (keep and keep(relative)):
+                    continue
+                os.remove(os.path.join(root, name))
+                removed.append(relative)
+            for name in dirs:
+                path = os.path.join(root, name)
+                if not os.listdir(path):
+                    os.rmdir(path)
+
+    return {
+        'status': 'success',
+        'copied': copied,
+        'unchanged': len(unchanged),
+        'removed': removed,
+        'copied_bytes': copied_bytes,
+        'digests': digests
+    }
@@ -0,0 +1,124 @@
+"""提示词上下文去重
+
+上游结果经常互相转述：营销方案引用事件分析，图层设计和路由又引用营销方案。ContextAssembler
+按文档和段落记录已经放进当前提示词的内容，重复的整篇文档或段落只保留一次，后续出现处改为
+指向首次出现位置的引用，并统计每个提示词的重复率。
+"""
+import hashlib
+import re
+import threading
+from typing import Dict, Any, List, Optional
+
+# 短于该长度的段落（标题、分隔线等）不参与去重
+MIN_PARAGRAPH_CHARS = 20
+
+
+def _fingerprint(text: str) -> str:
+    return hashlib.sha1(re.sub(r'\s+', ' ', text).strip().encode('utf-8')).hexdigest()
+
+
+def split_paragraphs(text: str) -> List[str]:
+    """按空行切分段落，代码块（```围起的部分）整体作为一个段落"""
+    paragraphs, current = [], []
+    in_fence = False
+    for line in text.splitlines():
+        if line.strip().startswith('```'):
+            in_fence = not in_fence
+        if not in_fence and not line.strip():
+            if current:
+                paragraphs.append('\n'.join(current))
+                current = []
+            continue
+        current.append(line)
+    if current:
+        paragraphs.append('\n'.join(current))
+    return paragraphs
+
+
+class ContextAssembler:
+    """为单个提示词组装上下文文档，整篇或段落重复时改为引用"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._documents: Dict[str, str] = {}
+        self._paragraphs: Dict[str, str] = {}
+        self.input_chars = 0
+        self.output_chars = 0
+        self.duplicate_documents = 0
+        self.duplicate_paragraphs = 0
+
+    def section(self, title: str, content: Any) -> str:
+        """返回 "## 标题\\n内容" 格式的段，内容已出现过的部分替换为引用；空内容返回空字符串"""
+        if not content:
+            return ''
+        content = str(content).strip()
+        self.input_chars += len(content)
+
+        document_key = _fingerprint(content)
+        if document_key in self._documents:
+            self.duplicate_documents += 1
+            body = f"（内容与上文「{self._documents[document_key]}」相同）"
+        else:
+            self._documents[document_key] = title
+            body = self._dedupe_paragraphs(title, content)
+
+        self.output_chars += len(body)
+        return f"## {title}\n{body}"
+
+    def _dedupe_paragraphs(self, title: str, content: str) -> str:
+        kept: List[str] = []
+        omitted_from: Optional[str] = None
+        for paragraph in split_paragraphs(content):
+            key = _fingerprint(paragraph) if len(paragraph.strip()) >= MIN_PARAGRAPH_CHARS else None
+            source = self._paragraphs.get(key) if key else None
+            if source and source != title:
+                self.duplicate_paragraphs += 1
+                # 连续省略的段落合并为一条引用
+                if omitted_from != source:
+                    kept.append(f"（此处与上文「{source}」中的段落相同，已省略）")
+                    omitted_from = source
+                continue
+            omitted_from = None
+            if key:
+                self._paragraphs.setdefault(key, title)
+            kept.append(paragraph)
+        return '\n\n'.join(kept)
+
+    def report(self) -> Dict[str, Any]:
+        saved = self.input_chars - self.output_chars
+        return {
+            'prompt': self.name,
+            'input_chars': self.input_chars,
+            'output_chars': self.output_chars,
+            'duplicate_documents': self.duplicate_documents,
+            'duplicate_paragraphs': self.duplicate_paragraphs,
+            'duplication_ratio': round(saved / self.input_chars, 4) if self.input_chars else 0.0
+        }
+
+
+class ContextStats:
+    """汇总一个任务中各提示词的去重情况"""
+
+    def __init__(self):
+        self.prompts: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record(self, assembler: ContextAssembler):
+        report = assembler.report()
+        with self._lock:
+            self.prompts.append(report)
+        if report['duplication_ratio'] > 0:
+            print(f"🧩 {assembler.name} 上下文去重 {report['duplication_ratio']:.0%}"
+                  f"（{report['input_chars']} → {report['output_chars']} 字符）")
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            prompts = list(self.prompts)
+        input_chars = sum(p['input_chars'] for p in prompts)
+        output_chars = sum(p['output_chars'] for p in prompts)
+        return {
+            'prompts': prompts,
+            'input_chars': input_chars,
+            'output_chars': output_chars,
+            'duplication_ratio': round((input_chars - output_chars) / input_chars, 4) if input_chars else 0.0
+        }
@@ -0,0 +1,356 @@
+"""把渲染出的banner.html打包为单文件交付物
+
+- <img> 引用的本地SVG内联为去重的 <symbol> 精灵图，通过 <use> 引用；页面的样式或脚本
+  针对 img 元素（img选择器、object-fit/object-position）时，改为内联成 <img> 的data URI，保持渲染不变
+- 小于阈值的位图（<img> 和 CSS url()）转为data URI
+- 本地样式表和脚本内联
+- <picture> 中的响应式变体由浏览器选择，保持外部引用
+- 未能内联的资源（远程地址、超出阈值、文件缺失等）记录在清单中
+"""
+import base64
+import hashlib
+import html
+import json
+import mimetypes
+import os
+import re
+import urllib.parse
+import xml.etree.ElementTree as ET
+from typing import Dict, Any, List, Optional
+
+from .svg_extractor import validate_svg
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+
+# 小于该字节数的位图内联为data URI，可通过环境变量 BANNER_BUNDLE_INLINE_LIMIT 覆盖
+DEFAULT_INLINE_LIMIT = 48 * 1024
+
+RASTER_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif')
+
+# 精灵图不能用display:none，否则其中的渐变、滤镜在部分浏览器中失效
+SPRITE_STYLE = 'position:absolute;width:0;height:0;overflow:hidden'
+
+# SVG根元素上描述尺寸和坐标系的属性，由<symbol>和外层<svg>处理，不复制到内部的<g>
+ROOT_LAYOUT_ATTRS = ('width', 'height', 'viewBox', 'preserveAspectRatio', 'x', 'y', 'id', 'version',
+                     'baseProfile', 'xmlns', 'zoomAndPan', 'contentScriptType', 'contentStyleType')
+
+# 从<img>复制到内联<svg>的属性
+CARRIED_ATTRS = ('id', 'class', 'style', 'width', 'height', 'title')
+
+TAG_BODY = r'(?:[^>"\']|"[^"]*"|\'[^\']*\')*'
+IMG_RE = re.compile(r'<img\b' + TAG_BODY + r'>', re.I)
+LINK_RE = re.compile(r'<link\b' + TAG_BODY + r'>', re.I)
+SCRIPT_RE = re.compile(r'<script\b(' + TAG_BODY + r')>\s*</script>', re.I)
+ATTR_RE = re.compile(r'([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)', re.I)
+PICTURE_RE = re.compile(r'<picture\b' + TAG_BODY + r'>.*?</picture>', re.I | re.S)
+SOURCE_RE = re.compile(r'<source\b' + TAG_BODY + r'>', re.I)
+BODY_OPEN_RE = re.compile(r'<body\b' + TAG_BODY + r'>', re.I)
+URL_REF_RE = re.compile(r"url\((['\"]?)#([^)'\"]+)\1\)")
+STYLE_BLOCK_RE = re.compile(r'<style\b' + TAG_BODY + r'>(.*?)</style>', re.I | re.S)
+SCRIPT_BLOCK_RE = re.compile(r'<script\b' + TAG_BODY + r'>(.*?)</script>', re.I | re.S)
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+CSS_SELECTOR_RE = re.compile(r'([^{}]+)\{')
+IMG_SELECTOR_RE = re.compile(r'(?:^|[\s>+~,(])img(?![\w-])', re.I)
+OBJECT_FIT_RE = re.compile(r'object-(?:fit|position)\s*:', re.I)
+SCRIPT_IMG_RE = re.compile(
+    r'(?:querySelector(?:All)?|getElementsByTagName|closest|matches)\(\s*[\'"`][^\'"`]*\bimg\b', re.I)
+
+
+def inline_limit() -> int:
+    try:
+        return int(os.getenv('BANNER_BUNDLE_INLINE_LIMIT', DEFAULT_INLINE_LIMIT))
+    except ValueError:
+        return DEFAULT_INLINE_LIMIT
+
+
+def parse_attributes(tag: str) -> Dict[str, str]:
+    """解析起始标签的属性，属性名转为小写"""
+    body = re.sub(r'^<\w+|/?>$', '', tag)
+    attrs = {}
+    for match in ATTR_RE.finditer(body):
+        value = next((v for v in match.groups()[1:] if v is not None), '')
+        attrs[match.group(1).lower()] = html.unescape(value)
+    return attrs
+
+
+def data_uri(path: str, content: bytes) -> str:
+    mime = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if mime == 'image/svg+xml':
+        return 'data:image/svg+xml;charset=utf-8,' + urllib.parse.quote(content.decode('utf-8'), safe=' =:/;,')
+    return f'data:{mime};base64,' + base64.b64encode(content).decode('ascii')
+
+
+class HTMLBundler:
+    """单个HTML文件的打包过程"""
+
+    def __init__(self, html_path: str, limit: int = None):
+        self.html_path = html_path
+        self.base_dir = os.path.dirname(os.path.abspath(html_path))
+        self.limit = inline_limit() if limit is None else limit
+        self.symbols: Dict[str, Dict[str, Any]] = {}
+        self.inlined: List[Dict[str, Any]] = []
+        self.external: List[Dict[str, Any]] = []
+        # 页面中有作用于img元素的样式或脚本时，SVG保持为<img>
+        self.img_rules: List[str] = []
+
+    def resolve(self, reference: str) -> Optional[str]:
+        """把相对引用解析为base_dir内的本地文件；远程、data URI、越界或缺失时记入清单并返回None"""
+        reference = reference.strip()
+        if not reference or reference.startswith('#'):
+            return None
+        if reference.startswith('data:'):
+            return None
+        if re.match(r'^[a-z][a-z0-9+.-]*:|^//', reference, re.I):
+            self.external.append({'reference': reference, 'reason': 'remote'})
+            return None
+        relative = urllib.parse.unquote(reference.split('#', 1)[0].split('?', 1)[0])
+        path = os.path.normpath(os.path.join(self.base_dir, relative))
+        if os.path.commonpath([path, self.base_dir]) != self.base_dir:
+            self.external.append({'reference': reference, 'reason': 'outside_bundle_dir'})
+            return None
+        if not os.path.isfile(path):
+            self.external.append({'reference': reference, 'reason': 'missing'})
+            return None
+        return path
+
+    # ------------------------------------------------------------ SVG精灵图
+
+    def _symbol_for(self, path: str) -> Optional[Dict[str, Any]]:
+        """把SVG文件转为<symbol>，相同内容只生成一次；含<style>/<script>或无法解析时返回None"""
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()[:10]
+        symbol_id = f'sym-{digest}'
+        source = os.path.relpath(path, self.base_dir)
+        if symbol_id in self.symbols:
+            symbol = self.symbols[symbol_id]
+            symbol['references'] += 1
+            if source not in symbol['sources']:
+                symbol['sources'].append(source)
+            return symbol
+
+        try:
+            root = validate_svg(content.decode('utf-8'))
+        except (ET.ParseError, UnicodeDecodeError):
+            return None
+        # 内联后<style>会作用于整个页面，这类SVG保持独立文档（data URI）
+        if any(element.tag.rsplit('}', 1)[-1] in ('style', 'script') for element in root.iter()):
+            return None
+
+        view_box = root.get('viewBox')
+        width, height = root.get('width'), root.get('height')
+        if not view_box and width and height:
+            w, h = width.strip().rstrip('px'), height.strip().rstrip('px')
+            view_box = f'0 0 {w} {h}' if re.fullmatch(r'[\d.]+', w) and re.fullmatch(r'[\d.]+', h) else None
+
+        self._prefix_ids(root, symbol_id)
+        for element in root.iter():
+            element.tag = element.tag.rsplit('}', 1)[-1]
+            href = element.attrib.pop(f'{{{XLINK_NS}}}href', None)
+            if href is not None:
+                element.set('href', href)
+
+        inner = ''.join(ET.tostring(child, encoding='unicode') for child in root)
+        # 根元素上的表现属性（fill、stroke、opacity、style等）由子元素继承，<symbol>不带这些属性，
+        # 用一个<g>承载，保持继承关系
+        presentation = ''.join(
+            f' {name}="{html.escape(value)}"' for name, value in root.attrib.items()
+            if '}' not in name and name not in ROOT_LAYOUT_ATTRS
+        )
+        if presentation:
+            inner = f'<g{presentation}>{(root.text or "").strip()}{inner}</g>'
+            root.text = None
+        attrs = f' id="{symbol_id}"'
+        if view_box:
+            attrs += f' viewBox="{html.escape(view_box)}"'
+        if root.get('preserveAspectRatio'):
+            attrs += f' preserveAspectRatio="{html.escape(root.get("preserveAspectRatio"))}"'
+
+        symbol = {
+            'id': symbol_id,
+            'sources': [source],
+            'markup': f'<symbol{attrs}>{(root.text or "").strip()}{inner}</symbol>',
+            'width': width,
+            'height': height,
+            'bytes': len(content),
+            'references': 1
+        }
+        self.symbols[symbol_id] = symbol
+        return symbol
+
+    @staticmethod
+    def _prefix_ids(root: ET.Element, prefix: str):
+        """SVG内部id加前缀，避免多个SVG内联到同一文档后冲突"""
+        ids = {element.get('id') for element in root.iter() if element.get('id')}
+        if not ids:
+            return
+        for element in root.iter():
+            if element.get('id'):
+                element.set('id', f"{prefix}-{element.get('id')}")
+            for name, value in list(element.attrib.items()):
+                if name.rsplit('}', 1)[-1] == 'href' and value.startswith('#') and value[1:] in ids:
+                    element.set(name, f'#{prefix}-{value[1:]}')
+                elif 'url(' in value:
+                    element.set(name, URL_REF_RE.sub(
+                        lambda m: f"url(#{prefix}-{m.group(2)})" if m.group(2) in ids else m.group(0), value))
+
+    @staticmethod
+    def _find_img_rules(document: str) -> List[str]:
+        """找出依赖元素仍是<img>的样式和脚本：img类型选择器、object-fit/object-position、按img查询元素"""
+        rules = []
+        for css in STYLE_BLOCK_RE.findall(document):
+            css = CSS_COMMENT_RE.sub('', css)
+            for selector in CSS_SELECTOR_RE.findall(css):
+                selector = selector.rsplit(';', 1)[-1].strip()
+                if not selector.startswith('@') and IMG_SELECTOR_RE.search(selector):
+                    rules.append(f'selector: {selector}')
+            if OBJECT_FIT_RE.search(css):
+                rules.append('style: object-fit/object-position')
+        for script in SCRIPT_BLOCK_RE.findall(document):
+            if SCRIPT_IMG_RE.search(script):
+                rules.append('script: img query')
+        return list(dict.fromkeys(rules))
+
+    def _replace_img(self, match) -> str:
+        tag = match.group(0)
+        attrs = parse_attributes(tag)
+        src = attrs.get('src', '')
+        path = self.resolve(src)
+        if not path:
+            return tag
+
+        if path.lower().endswith('.svg'):
+            if self.img_rules or OBJECT_FIT_RE.search(attrs.get('style', '')):
+                # 换成<svg>后img选择器和object-fit不再生效，内联为data URI保持<img>
+                return self._inline_data_uri(tag, src, path, force=True)
+            symbol = self._symbol_for(path)
+            if symbol:
+                carried = {k: attrs[k] for k in CARRIED_ATTRS if k in attrs}
+                # <img>的固有尺寸来自SVG的width/height，内联后需要显式给出
+                for key in ('width', 'height'):
+                    if key not in carried and symbol[key]:
+                        carried[key] = symbol[key]
+                attr_text = ''.join(f' {k}="{html.escape(v)}"' for k, v in carried.items())
+                label = attrs.get('alt')
+                aria = f' role="img" aria-label="{html.escape(label)}"' if label else ' aria-hidden="true"'
+                return f'<svg{attr_text}{aria}><use href="#{symbol["id"]}"/></svg>'
+            return self._inline_data_uri(tag, src, path, force=True)
+
+        return self._inline_data_uri(tag, src, path)
+
+    # ------------------------------------------------------------ data URI
+
+    def _inline_data_uri(self, text: str, reference: str, path: str, force: bool = False) -> str:
+        size = os.path.getsize(path)
+        if not force and size > self.limit:
+            self.external.append({'reference': reference, 'reason': 'over_inline_limit', 'bytes': size})
+            return text
+        with open(path, 'rb') as f:
+            uri = data_uri(path, f.read())
+        self.inlined.append({'source': os.path.relpath(path, self.base_dir), 'as': 'data_uri', 'bytes': size})
+        return text.replace(reference, uri)
+
+    def _replace_css_url(self, match) -> str:
+        reference = match.group(2)
+        path = self.resolve(reference)
+        if not path or not (path.lower().endswith(RASTER_EXTENSIONS) or path.lower().endswith('.svg')):
+            return match.group(0)
+        return self._inline_data_uri(match.group(0), reference, path)
+
+    # ------------------------------------------------------------ 样式表和脚本
+
+    def _replace_link(self, match) -> str:
+        attrs = parse_attributes(match.group(0))
+        if 'stylesheet' not in attrs.get('rel', '').lower():
+            return match.group(0)
+        path = self.resolve(attrs.get('href', ''))
+        if not path:
+            return match.group(0)
+        with open(path, 'r', encoding='utf-8') as f:
+            css = f.read()
+        self.inlined.append({'source': os.path.relpath(path, self.base_dir), 'as': 'style', 'bytes': len(css)})
+        media = f' media="{html.escape(attrs["media"])}"' if attrs.get('media') else ''
+        return f'<style{media}>{css}</style>'
+
+    def _replace_script(self, match) -> str:
+        attrs = parse_attributes(match.group(0).split('>', 1)[0] + '>')
+        if 'src' not in attrs:
+            return match.group(0)
+        path = self.resolve(attrs['src'])
+        if not path:
+            return match.group(0)
+        with open(path, 'r', encoding='utf-8') as f:
+            script = f.read().replace('</script', '<\\/script')
+        self.inlined.append({'source': os.path.relpath(path, self.base_dir), 'as': 'script', 'bytes': len(script)})
+        kept = ''.join(f' {k}="{html.escape(v)}"' for k, v in attrs.items() if k not in ('src', 'defer', 'async'))
+        return f'<script{kept}>{script}</script>'
+
+    # ------------------------------------------------------------ 入口
+
+    def bundle(self, output_path: str = None) -> Dict[str, Any]:
+        with open(self.html_path, 'r', encoding='utf-8') as f:
+            source = f.read()
+
+        document = LINK_RE.sub(self._replace_link, source)
+        document = SCRIPT_RE.sub(self._replace_script, document)
+        self.img_rules = self._find_img_rules(document)
+        # <picture>由浏览器按格式和宽度选择变体，保持外部引用
+        pictures = [m.span() for m in PICTURE_RE.finditer(document)]
+        document = IMG_RE.sub(
+            lambda m: m.group(0) if any(s <= m.start() < e for s, e in pictures) else self._replace_img(m),
+            document
+        )
+        for match in SOURCE_RE.finditer(document):
+            for candidate in parse_attributes(match.group(0)).get('srcset', '').split(','):
+                if candidate.strip():
+                    self.external.append({'reference': candidate.split()[0], 'reason': 'responsive_variant'})
+        document = CSS_URL_RE.sub(self._replace_css_url, document)
+
+        if self.symbols:
+            sprite = (f'<svg xmlns="{SVG_NS}" style="{SPRITE_STYLE}" aria-hidden="true" focusable="false">'
+                      + ''.join(s['markup'] for s in self.symbols.values()) + '</svg>')
+            body = BODY_OPEN_RE.search(document)
+            if body:
+                document = document[:body.end()] + sprite + document[body.end():]
+            else:
+                document = sprite + document
+            for symbol in self.symbols.values():
+                for source in symbol['sources']:
+                    self.inlined.append({'source': source, 'as': 'symbol', 'id': symbol['id'],
+                                         'bytes': symbol['bytes'], 'references': symbol['references']})
+
+        stem, _ = os.path.splitext(self.html_path)
+        output_path = output_path or f'{stem}.bundle.html'
+        manifest_path = f'{os.path.splitext(output_path)[0]}.manifest.json'
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(document)
+
+        manifest = {
+            'source': os.path.basename(self.html_path),
+            'bundle': os.path.basename(output_path),
+            'inline_limit': self.limit,
+            'source_bytes': len(source.encode('utf-8')),
+            'bundle_bytes': len(document.encode('utf-8')),
+            'inlined': self.inlined,
+            'external': self.external,
+            'svg_kept_as_img': self.img_rules,
+            'requests_saved': len({item['source'] for item in self.inlined})
+        }
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        return {'status': 'success', 'bundle_path': output_path, 'manifest_path': manifest_path, **manifest}
+
+
+def bundle_html(html_path: str, output_path: str = None, limit: int = None) -> Dict[str, Any]:
+    """打包HTML为单文件，输出 <name>.bundle.html 和 <name>.bundle.manifest.json"""
+    try:
+        result = HTMLBundler(html_path, limit).bundle(output_path)
+    except Exception as e:
+        print(f"❌ HTML打包失败: {e}")
+        return {'status': 'error', 'error': str(e)}
+    print(f"📦 单文件Banner已生成: {result['bundle_path']}"
+          f"（内联 {result['requests_saved']} 个资源，{len(result['external'])} 个保留外部引用）")
+    return result
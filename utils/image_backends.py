@@ -0,0 +1,310 @@
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Type
+
+import requests
+
+from .image_client import get_pollinations_client
+from .llm_transport import get_transport
+from .tracing import span
+from .metrics import IMAGE_LATENCY, CACHE_REQUESTS
+
+# 默认使用的图像后端，可通过环境变量 BANNER_IMAGE_BACKEND 切换（pollinations / qwen_image_gen / local）
+DEFAULT_IMAGE_BACKEND = 'pollinations'
+
+# Pollinations熔断或失败时使用的降级后端，可通过环境变量 BANNER_IMAGE_FALLBACK_BACKEND 配置
+# （local / qwen_image_gen，设为off不降级）；必须是不同的服务，同一主机的其他模型与主后端同属一个故障域
+DEFAULT_FALLBACK_BACKEND = 'local'
+
+# 后端调用失败时的重试次数
+IMAGE_BACKEND_RETRIES = 1
+
+# 相同后端、提示词和尺寸的生成结果缓存条数
+IMAGE_CACHE_SIZE = 32
+
+IMAGE_BACKENDS: Dict[str, Type['ImageBackend']] = {}
+
+
+def register_image_backend(name: str):
+    """注册图像后端的装饰器"""
+    def decorator(cls):
+        cls.name = name
+        IMAGE_BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+class ImageBackend:
+    """图像生成后端接口
+
+    子类实现 _generate，返回包含 url 和 content（图像字节）的字典；
+    缓存、计时和重试由基类统一处理。
+    """
+
+    name = 'base'
+
+    # 不依赖网络的后端不经过录制/回放传输层
+    offline = False
+
+    def __init__(self, retries: int = IMAGE_BACKEND_RETRIES, cache_size: int = IMAGE_CACHE_SIZE):
+        self.retries = retries
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[tuple, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'cache_hits': 0, 'retries': 0, 'failures': 0, 'total_seconds': 0.0}
+
+    def generate(self, prompt: str, width: int = 1024, height: int = 768,
+                 colors: List[str] = None) -> Dict[str, Any]:
+        """生成图像，返回包含url、content、backend、latency的字典"""
+        key = (prompt, width, height, tuple(colors or ()))
+        with self._lock:
+            self.stats['requests'] += 1
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                CACHE_REQUESTS.inc(cache='image_backend', result='hit')
+                return {**self._cache[key], 'latency': 0.0, 'cached': True}
+        CACHE_REQUESTS.inc(cache='image_backend', result='miss')
+
+        start = time.monotonic()
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._record('retries')
+                print(f"🔁 {self.name} 图像生成重试（第{attempt}次）")
+            try:
+                if self.offline:
+                    result = self._generate(prompt, width, height, colors or [])
+                else:
+                    result = get_transport().image(
+                        self.name, prompt, width, height, colors or [],
+                        lambda: self._generate(prompt, width, height, colors or [])
+                    )
+                break
+            except Exception as e:
+                last_error = e
+        else:
+            self._record('failures')
+            IMAGE_LATENCY.observe(time.monotonic() - start, backend=self.name, status='error')
+            raise last_error
+
+        latency = time.monotonic() - start
+        IMAGE_LATENCY.observe(latency, backend=self.name, status='ok')
+        result = {'backend': self.name, **result}
+        with self._lock:
+            self.stats['total_seconds'] += latency
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return {**result, 'latency': latency, 'cached': False}
+
+    def _generate(self, prompt: str, width: int, height: int, colors: List[str]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def _record(self, key: str, value: float = 1):
+        with self._lock:
+            self.stats[key] += value
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        generated = stats['requests'] - stats['cache_hits'] - stats['failures']
+        stats['avg_seconds'] = round(stats['total_seconds'] / generated, 3) if generated > 0 else None
+        stats['total_seconds'] = round(stats['total_seconds'], 3)
+        return stats
+
+
+def fallback_backend_name() -> Optional[str]:
+    """Pollinations的降级后端名称，关闭或配置无效时返回None"""
+    name = os.getenv('BANNER_IMAGE_FALLBACK_BACKEND', DEFAULT_FALLBACK_BACKEND).strip()
+    if name.lower() in ('', 'off', 'none', '0', 'false'):
+        return None
+    if name == 'pollinations' or name not in IMAGE_BACKENDS:
+        print(f"⚠️ 无效的降级图像后端: {name}，不启用降级")
+        return None
+    return name
+
+
+def _registry_fallback(name: str):
+    """按名称调用注册表中的其他后端，首次降级时才创建实例"""
+    def fallback(prompt: str, width: int, height: int) -> Dict[str, Any]:
+        result = get_image_backend(name).generate(prompt, width, height)
+        return {'url': result['url'], 'content': result['content']}
+    return fallback
+
+
+@register_image_backend('pollinations')
+class PollinationsBackend(ImageBackend):
+    """Pollinations.ai后端，经过对冲请求和熔断降级客户端"""
+
+    def __init__(self, **kwargs):
+        # 客户端内部已有对冲和降级，这里不再重复重试
+        kwargs.setdefault('retries', 0)
+        super().__init__(**kwargs)
+        fallback_name = fallback_backend_name()
+        self.client = get_pollinations_client(
+            fallback=_registry_fallback(fallback_name) if fallback_name else None,
+            fallback_name=fallback_name
+        )
+
+    def _generate(self, prompt, width, height, colors):
+        result = self.client.generate(prompt, width, height)
+        return {'url': result['url'], 'content': result['content'], 'backend': result['backend']}
+
+    def metrics(self):
+        return {**super().metrics(), 'client': self.client.metrics()}
+
+
+@register_image_backend('qwen_image_gen')
+class QwenImageGenBackend(ImageBackend):
+    """qwen_agent 内置 ImageGen 工具后端"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        from qwen_agent.tools import ImageGen
+        self.image_gen = ImageGen()
+
+    def _generate(self, prompt, width, height, colors):
+        result = self.image_gen.call({'prompt': prompt, 'size': f"{width}x{height}"})
+        url = extract_image_url(result)
+        if not url:
+            raise RuntimeError(f"未能从ImageGen结果中提取图片URL: {str(result)[:200]}")
+        with span('http.get', url=url[:200]) as s:
+            response = requests.get(url, timeout=30)
+            s.set_attributes(status_code=response.status_code, bytes=len(response.content))
+        response.raise_for_status()
+        return {'url': url, 'content': response.content}
+
+
+# 提示词中常见颜色词到RGB的映射，用于本地后端取色
+_COLOR_WORDS = {
+    'red': (214, 48, 49), '红': (214, 48, 49),
+    'orange': (240, 147, 43), '橙': (240, 147, 43),
+    'yellow': (253, 203, 110), '黄': (253, 203, 110),
+    'gold': (212, 175, 55), '金': (212, 175, 55),
+    'green': (0, 184, 148), '绿': (0, 184, 148),
+    'blue': (9, 132, 227), '蓝': (9, 132, 227),
+    'purple': (108, 92, 231), '紫': (108, 92, 231),
+    'pink': (253, 121, 168), '粉': (253, 121, 168),
+    'white': (245, 246, 250), '白': (245, 246, 250),
+    'black': (30, 39, 46), '黑': (30, 39, 46),
+    'gray': (99, 110, 114), 'grey': (99, 110, 114), '灰': (99, 110, 114),
+}
+
+
+def _hex_to_rgb(value: str) -> Optional[tuple]:
+    value = value.lstrip('#')
+    if len(value) == 3:
+        value = ''.join(ch * 2 for ch in value)
+    if len(value) != 6:
+        return None
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def extract_colors(text: str) -> List[str]:
+    """从文本中提取十六进制颜色值（按出现顺序去重）"""
+    colors = []
+    for match in re.findall(r'#(?:[0-9a-fA-F]{6}|[0-9a-fA-F]{3})\b', text or ''):
+        color = match.lower()
+        if color not in colors:
+            colors.append(color)
+    return colors
+
+
+@register_image_backend('local')
+class LocalImageBackend(ImageBackend):
+    """本地确定性后端：根据提示词和颜色渲染渐变与图案，不依赖网络
+
+    相同的提示词、尺寸和颜色总是得到相同的图像，适合离线压测和基准测试。
+    """
+
+    offline = True
+
+    def _generate(self, prompt, width, height, colors):
+        from PIL import Image, ImageDraw
+
+        digest = hashlib.sha256(f"{prompt}|{width}x{height}|{','.join(colors)}".encode('utf-8')).digest()
+        palette = self._palette(prompt, colors, digest)
+
+        # 双色线性渐变，方向由提示词哈希决定
+        image = Image.new('RGB', (width, height))
+        draw = ImageDraw.Draw(image)
+        start, end = palette[0], palette[1]
+        vertical = digest[0] % 2 == 0
+        steps = height if vertical else width
+        for i in range(steps):
+            t = i / max(steps - 1, 1)
+            color = tuple(int(start[c] + (end[c] - start[c]) * t) for c in range(3))
+            if vertical:
+                draw.line([(0, i), (width, i)], fill=color)
+            else:
+                draw.line([(i, 0), (i, height)], fill=color)
+
+        # 半透明圆形图案
+        overlay = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        overlay_draw = ImageDraw.Draw(overlay)
+        accent = palette[2 % len(palette)]
+        for i in range(4 + digest[1] % 6):
+            cx = digest[(2 + i * 3) % 32] / 255 * width
+            cy = digest[(3 + i * 3) % 32] / 255 * height
+            r = (0.05 + digest[(4 + i * 3) % 32] / 255 * 0.2) * min(width, height)
+            overlay_draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=(*accent, 40 + digest[i % 32] % 60))
+        image = Image.alpha_composite(image.convert('RGBA'), overlay).convert('RGB')
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        return {'url': f"local://{digest.hex()[:16]}.png", 'content': buffer.getvalue()}
+
+    @staticmethod
+    def _palette(prompt: str, colors: List[str], digest: bytes) -> List[tuple]:
+        palette = [rgb for rgb in (_hex_to_rgb(c) for c in colors) if rgb]
+        lowered = (prompt or '').lower()
+        for word, rgb in _COLOR_WORDS.items():
+            if word in lowered and rgb not in palette:
+                palette.append(rgb)
+        # 颜色不足三种时用提示词哈希补齐
+        i = 0
+        while len(palette) < 3:
+            palette.append((digest[10 + i], digest[11 + i], digest[12 + i]))
+            i += 3
+        return palette
+
+
+def extract_image_url(result: Any) -> Optional[str]:
+    """从工具返回结果中提取图片URL"""
+    if not isinstance(result, str):
+        result = str(result or '')
+    urls = re.findall(r'https?://[^\s<>"]+(?:\.png|\.jpg|\.jpeg|\.gif|\.webp)', result)
+    if not urls:
+        urls = re.findall(r'https?://[^\s<>"\')\]]+', result)
+    return urls[0] if urls else None
+
+
+_backends: Dict[str, ImageBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_image_backend(name: str = None, default: str = DEFAULT_IMAGE_BACKEND) -> ImageBackend:
+    """获取进程共享的图像后端实例
+
+    优先使用显式指定的名称，其次是环境变量 BANNER_IMAGE_BACKEND，最后是default。
+    """
+    name = name or os.getenv('BANNER_IMAGE_BACKEND') or default
+    if name not in IMAGE_BACKENDS:
+        raise ValueError(f"未知的图像后端: {name}，可选: {', '.join(IMAGE_BACKENDS)}")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = IMAGE_BACKENDS[name]()
+        return _backends[name]
+
+
+def image_backend_metrics() -> Dict[str, Dict[str, Any]]:
+    """返回已使用的各图像后端统计"""
+    with _backends_lock:
+        backends = dict(_backends)
+    return {name: backend.metrics() for name, backend in backends.items()}
@@ -0,0 +1,129 @@
+import threading
+import time
+from typing import Dict, Any, Callable, Optional
+
+import requests
+
+from .resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, hedged_call
+from .tracing import span
+
+POLLINATIONS_BASE_URL = "https://image.pollinations.ai/prompt/"
+
+
+def build_pollinations_url(prompt: str, width: int, height: int, model: str = 'flux') -> str:
+    """构建Pollinations.ai图像生成URL"""
+    params = {
+        'width': width,
+        'height': height,
+        'seed': -1,  # 随机种子
+        'model': model
+    }
+    param_string = '&'.join([f"{k}={v}" for k, v in params.items()])
+    return f"{POLLINATIONS_BASE_URL}{requests.utils.quote(prompt)}?{param_string}"
+
+
+def make_pollinations_fetcher(model: str = 'flux', timeout: float = 30) -> Callable[[str, int, int], Dict[str, Any]]:
+    """创建指定模型的Pollinations请求函数，返回图像URL和内容"""
+    def fetch(prompt: str, width: int, height: int) -> Dict[str, Any]:
+        url = build_pollinations_url(prompt, width, height, model)
+        with span('http.get', url=url[:200], model=model) as s:
+            response = requests.get(url, timeout=timeout)
+            s.set_attributes(status_code=response.status_code, bytes=len(response.content))
+        if response.status_code != 200:
+            raise RuntimeError(f"API请求失败，状态码: {response.status_code}")
+        return {'url': url, 'content': response.content}
+    return fetch
+
+
+class ResilientImageClient:
+    """带对冲请求和熔断降级的图像后端客户端
+
+    - 主后端请求超过历史延迟的指定百分位仍未返回时，发送一个对冲请求，采用先返回的结果
+    - 主后端连续失败后熔断，熔断期间直接使用配置的降级后端
+    """
+
+    def __init__(self, name: str, primary: Callable, fallback: Callable = None,
+                 fallback_name: str = None, hedge_percentile: float = 90,
+                 initial_hedge_delay: float = 12.0, min_hedge_delay: float = 2.0,
+                 failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.name = name
+        self.primary = primary
+        self.fallback = fallback
+        self.fallback_name = fallback_name or f"{name}_fallback"
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.stats = {'requests': 0, 'fallbacks': 0, 'failures': 0}
+        self._lock = threading.Lock()
+
+    def hedge_delay(self) -> Optional[float]:
+        """根据历史延迟百分位计算对冲阈值，initial_hedge_delay为None时不对冲"""
+        if self.initial_hedge_delay is None:
+            return None
+        observed = self.latency.percentile(self.hedge_percentile)
+        if observed is None:
+            return self.initial_hedge_delay
+        return max(self.min_hedge_delay, observed)
+
+    def generate(self, prompt: str, width: int, height: int) -> Dict[str, Any]:
+        """生成图像，返回包含url、content、backend、latency的字典"""
+        with self._lock:
+            self.stats['requests'] += 1
+
+        start = time.monotonic()
+        try:
+            result = self.breaker.call(
+                hedged_call, lambda: self.primary(prompt, width, height), self.hedge_delay()
+            )
+            self.latency.record(time.monotonic() - start)
+            return {**result, 'backend': self.name, 'latency': time.monotonic() - start}
+        except Exception as e:
+            if not isinstance(e, CircuitOpenError):
+                print(f"❌ {self.name} 图像生成失败: {e}")
+            if self.fallback is None:
+                with self._lock:
+                    self.stats['failures'] += 1
+                raise
+
+        print(f"↪️ 使用降级后端 {self.fallback_name} 生成图像")
+        with self._lock:
+            self.stats['fallbacks'] += 1
+        try:
+            result = self.fallback(prompt, width, height)
+        except Exception:
+            with self._lock:
+                self.stats['failures'] += 1
+            raise
+        return {**result, 'backend': self.fallback_name, 'latency': time.monotonic() - start}
+
+    def metrics(self) -> Dict[str, Any]:
+        hedge_delay = self.hedge_delay()
+        return {
+            **self.stats,
+            'breaker_state': self.breaker.state,
+            'breaker_trips': self.breaker.trips,
+            'hedge_delay': round(hedge_delay, 2) if hedge_delay is not None else None
+        }
+
+
+_clients: Dict[str, ResilientImageClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_pollinations_client(fallback: Callable = None, fallback_name: str = None) -> ResilientImageClient:
+    """获取进程共享的Pollinations客户端，熔断状态和延迟统计在所有生成器间共享
+
+    降级函数由调用方提供，应指向不同故障域的后端（同一主机的其他模型在主机不可用时同样失败）；
+    只在首次创建客户端时生效。
+    """
+    with _clients_lock:
+        if 'pollinations' not in _clients:
+            _clients['pollinations'] = ResilientImageClient(
+                'pollinations',
+                primary=make_pollinations_fetcher('flux'),
+                fallback=fallback,
+                fallback_name=fallback_name
+            )
+        return _clients['pollinations']
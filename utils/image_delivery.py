@@ -0,0 +1,228 @@
+"""位图资源的响应式交付
+
+把HTML中引用的本地位图转码为多种宽度的WebP（以及可用时的AVIF），编码质量按目标SSIM查找，
+并把 <img> 改写为带 srcset 的 <picture>，原图保留为兜底。
+"""
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from PIL import Image, features
+
+from .html_bundler import IMG_RE, PICTURE_RE, parse_attributes
+from .image_quality import search_quality
+
+# 目标宽度和格式可通过环境变量 BANNER_IMAGE_WIDTHS / BANNER_IMAGE_FORMATS 覆盖（逗号分隔）
+DEFAULT_WIDTHS = (480, 768, 1024)
+DEFAULT_FORMATS = ('avif', 'webp')
+
+ENCODER_OPTIONS = {
+    'webp': {'method': 6},
+    'avif': {'speed': 6}
+}
+
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+
+RASTER_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# 小图转码收益有限，保持<img>以便打包时直接内联
+MIN_SOURCE_BYTES = 8 * 1024
+
+# 转码并行度，Pillow编码时会释放GIL
+MAX_WORKERS = 4
+
+
+def available_formats() -> List[str]:
+    """当前Pillow支持编码的目标格式"""
+    raw = os.getenv('BANNER_IMAGE_FORMATS')
+    wanted = [f.strip().lower() for f in raw.split(',')] if raw else list(DEFAULT_FORMATS)
+    return [f for f in wanted if f in ENCODER_OPTIONS and features.check(f)]
+
+
+def target_widths() -> List[int]:
+    raw = os.getenv('BANNER_IMAGE_WIDTHS')
+    if raw:
+        try:
+            return sorted({int(w) for w in raw.split(',') if w.strip()})
+        except ValueError:
+            print("⚠️ BANNER_IMAGE_WIDTHS 格式错误，使用默认宽度")
+    return list(DEFAULT_WIDTHS)
+
+
+VARIANT_RE = re.compile(r'^(.*)-\d+w\.(?:avif|webp)$')
+
+
+def variant_path(source: str, width: int, fmt: str) -> str:
+    stem, _ = os.path.splitext(source)
+    return f'{stem}-{width}w.{fmt}'
+
+
+def is_variant_of(relative: str, sources) -> bool:
+    """relative是否为sources中某个位图的转码变体，用于同步资源时保留变体"""
+    match = VARIANT_RE.match(relative)
+    if not match:
+        return False
+    return any(os.path.splitext(source)[0] == match.group(1) for source in sources)
+
+
+def _normalize_mode(image: Image.Image) -> Image.Image:
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return image
+
+
+def encode_variant(image: Image.Image, path: str, fmt: str, quality: int):
+    """按格式和质量编码并保存，保留透明通道"""
+    _normalize_mode(image).save(path, format=fmt.upper(), quality=quality, **ENCODER_OPTIONS[fmt])
+
+
+class ImageDelivery:
+    """为一组HTML生成响应式图像，同一源文件只转码一次"""
+
+    def __init__(self, widths: List[int] = None, formats: List[str] = None):
+        self.widths = widths or target_widths()
+        self.formats = formats if formats is not None else available_formats()
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def transcode(self, source: str) -> Optional[Dict[str, Any]]:
+        """转码单个位图，返回各格式的宽度变体；源文件无法读取时返回None"""
+        with self._lock:
+            cached = self.sources.get(source)
+        if cached and cached['mtime'] == os.path.getmtime(source) \
+                and all(os.path.exists(v['path']) for v in cached['variants']):
+            return cached
+
+        try:
+            with Image.open(source) as original:
+                original.load()
+                image = original.copy()
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 无法读取图像 {source}: {e}")
+            return None
+
+        # 不放大，原图宽度也作为一个候选
+        widths = sorted({w for w in self.widths if w < image.width} | {image.width})
+        image = _normalize_mode(image)
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='transcode') as pool:
+            # 每种格式在原始宽度上按目标SSIM查找一次质量，较窄的变体沿用
+            qualities = dict(zip(self.formats, pool.map(
+                lambda fmt: search_quality(image, fmt.upper())['quality'], self.formats)))
+
+            def run(job: Tuple[str, int]) -> Dict[str, Any]:
+                fmt, width = job
+                height = max(1, round(image.height * width / image.width))
+                resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                path = variant_path(source, width, fmt)
+                encode_variant(resized, path, fmt, qualities[fmt])
+                return {'format': fmt, 'width': width, 'quality': qualities[fmt],
+                        'path': path, 'bytes': os.path.getsize(path)}
+
+            variants = list(pool.map(run, [(fmt, width) for fmt in self.formats for width in widths]))
+
+        original_bytes = os.path.getsize(source)
+        full_width = [v for v in variants if v['width'] == image.width]
+        best = min(full_width, key=lambda v: v['bytes']) if full_width else None
+        entry = {
+            'source': source,
+            'mtime': os.path.getmtime(source),
+            'width': image.width,
+            'height': image.height,
+            'original_bytes': original_bytes,
+            'variants': variants,
+            'best_format': best['format'] if best else None,
+            'best_bytes': best['bytes'] if best else original_bytes,
+            'saved_bytes': max(0, original_bytes - best['bytes']) if best else 0
+        }
+        with self._lock:
+            self.sources[source] = entry
+        return entry
+
+    def _picture_markup(self, tag: str, attrs: Dict[str, str], entry: Dict[str, Any], src: str) -> str:
+        base = os.path.dirname(src)
+        width_attr = attrs.get('width', '')
+        if width_attr.isdigit():
+            sizes = f'(max-width: {width_attr}px) 100vw, {width_attr}px'
+        else:
+            sizes = '100vw'
+
+        sources = []
+        for fmt in self.formats:
+            variants = sorted((v for v in entry['variants'] if v['format'] == fmt), key=lambda v: v['width'])
+            if not variants:
+                continue
+            srcset = ', '.join(f"{base + '/' if base else ''}{os.path.basename(v['path'])} {v['width']}w"
+                               for v in variants)
+            sources.append(f'<source type="{MIME_TYPES[fmt]}" srcset="{srcset}" sizes="{sizes}">')
+
+        # 兜底<img>补充固有尺寸，避免布局偏移
+        if 'width' not in attrs and 'height' not in attrs:
+            tag = re.sub(r'\s*/?>$', f' width="{entry["width"]}" height="{entry["height"]}">', tag)
+        return f'<picture>{"".join(sources)}{tag}</picture>'
+
+    def rewrite_html(self, html_path: str) -> Dict[str, Any]:
+        """把HTML中引用本地位图的<img>改写为<picture>，原地保存"""
+        base_dir = os.path.dirname(os.path.abspath(html_path))
+        with open(html_path, 'r', encoding='utf-8') as f:
+            document = f.read()
+
+        # 已经在<picture>中的<img>不再处理，重复运行结果不变
+        protected = [m.span() for m in PICTURE_RE.finditer(document)]
+        rewritten = []
+
+        def replace(match):
+            if any(start <= match.start() < end for start, end in protected):
+                return match.group(0)
+            tag = match.group(0)
+            attrs = parse_attributes(tag)
+            src = attrs.get('src', '')
+            if re.match(r'^[a-z][a-z0-9+.-]*:|^//', src, re.I) or not src.lower().endswith(RASTER_EXTENSIONS):
+                return tag
+            path = os.path.normpath(os.path.join(base_dir, src))
+            if os.path.commonpath([path, base_dir]) != base_dir or not os.path.isfile(path):
+                return tag
+            if os.path.getsize(path) < MIN_SOURCE_BYTES:
+                return tag
+            entry = self.transcode(path)
+            if not entry or not entry['variants']:
+                return tag
+            rewritten.append(os.path.relpath(path, base_dir))
+            return self._picture_markup(tag, attrs, entry, src)
+
+        document = IMG_RE.sub(replace, document)
+        if rewritten:
+            with open(html_path, 'w', encoding='utf-8') as f:
+                f.write(document)
+        return {'html': os.path.basename(html_path), 'rewritten': rewritten}
+
+    def report(self) -> Dict[str, Any]:
+        entries = list(self.sources.values())
+        original = sum(e['original_bytes'] for e in entries)
+        best = sum(e['best_bytes'] for e in entries)
+        return {
+            'formats': self.formats,
+            'widths': self.widths,
+            'images': [{k: v for k, v in e.items() if k != 'mtime'} for e in entries],
+            'original_bytes': original,
+            'best_bytes': best,
+            'saved_bytes': original - best
+        }
+
+
+def deliver_responsive_images(html_paths: List[str], delivery: ImageDelivery = None) -> Dict[str, Any]:
+    """为多个HTML生成响应式图像并改写引用，返回带 'status' 的报告"""
+    delivery = delivery or ImageDelivery()
+    if not delivery.formats:
+        return {'status': 'skipped', 'error': '当前Pillow不支持WebP/AVIF编码'}
+    try:
+        pages = [delivery.rewrite_html(path) for path in html_paths if os.path.exists(path)]
+    except Exception as e:
+        print(f"❌ 响应式图像生成失败: {e}")
+        return {'status': 'error', 'error': str(e)}
+    report = delivery.report()
+    print(f"🖼️ 响应式图像: {len(report['images'])} 个源图，格式 {'/'.join(delivery.formats)}，"
+          f"最佳变体节省 {report['saved_bytes']} 字节")
+    return {'status': 'success', 'pages': pages, **report}
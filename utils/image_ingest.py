@@ -0,0 +1,314 @@
+"""位图图层入库：按展示尺寸裁剪缩放
+
+生成尺寸由模型推断，和HTML中实际展示的尺寸往往不一致。入库时从图层规格的display_size字段或布局SVG
+读取目标框（size是生成尺寸，position/位置是坐标，都不作为展示尺寸），按梯度能量（显著性）选择裁剪窗口，
+再用高质量重采样缩放到目标尺寸，原图另存以便之后重新裁剪。所有写入都先写临时文件再替换。
+"""
+import json
+import os
+import re
+import shutil
+import xml.etree.ElementTree as ET
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .layer_specs import LAYER_KEY_TO_NAME, normalize_layer_name
+
+# 展示尺寸的设备像素比，可通过环境变量 BANNER_IMAGE_DPR 覆盖（例如2表示为高分屏保留两倍像素）
+DEFAULT_DPR = 1.0
+
+# 图层规格中表示展示尺寸的字段（LAYER_DESIGN_ITEM_SCHEMA中的display_size）
+DISPLAY_SIZE_KEY = 'display_size'
+
+# 计算显著性时先缩小到该边长，控制计算量
+SALIENCY_MAX_SIDE = 512
+
+# 能量不低于最大值该比例的窗口视为同样显著，取最靠近中心的一个，平坦图像时居中裁剪
+SALIENCY_TOLERANCE = 0.98
+
+SIZE_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:px)?\s*[x×*,]\s*(\d+(?:\.\d+)?)', re.I)
+
+
+def display_dpr() -> float:
+    try:
+        return max(0.5, float(os.getenv('BANNER_IMAGE_DPR', DEFAULT_DPR)))
+    except ValueError:
+        return DEFAULT_DPR
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*(?:px)?\s*', value)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def _box_from_value(value: Any) -> Optional[Tuple[int, int]]:
+    """解析 {'width','height'}、'1200x600' 或 [x, y, w, h] 形式的尺寸
+
+    两个数的列表分不清是宽高还是坐标，不接受。
+    """
+    width = height = None
+    if isinstance(value, dict):
+        width = _number(value.get('width', value.get('w', value.get('宽'))))
+        height = _number(value.get('height', value.get('h', value.get('高'))))
+    elif isinstance(value, str):
+        match = SIZE_RE.search(value)
+        if match:
+            width, height = float(match.group(1)), float(match.group(2))
+    elif isinstance(value, (list, tuple)) and len(value) == 4:
+        numbers = [_number(v) for v in value[2:]]
+        if None not in numbers:
+            width, height = numbers
+    if width and height:
+        return round(width), round(height)
+    return None
+
+
+def target_box_from_spec(spec: Any) -> Optional[Tuple[int, int]]:
+    """从图层规格（dict或包含JSON的文本）的display_size字段读取展示尺寸"""
+    if isinstance(spec, str):
+        candidates = re.findall(r'```json\s*(\{.*?\})\s*```', spec, re.S) or [spec.strip()]
+        for candidate in candidates:
+            try:
+                box = target_box_from_spec(json.loads(candidate))
+            except (json.JSONDecodeError, ValueError):
+                continue
+            if box:
+                return box
+        return None
+    if not isinstance(spec, dict):
+        return None
+
+    if DISPLAY_SIZE_KEY in spec:
+        box = _box_from_value(spec[DISPLAY_SIZE_KEY])
+        if box:
+            return box
+    # 路由方案中规格嵌套在 input_parameters 等子对象中
+    for value in spec.values():
+        if isinstance(value, dict):
+            box = target_box_from_spec(value)
+            if box:
+                return box
+    return None
+
+
+def _layer_identifiers(layer_name: str) -> List[str]:
+    """图层在布局SVG中可能使用的id/class：英文键（含连字符写法）和中文名"""
+    name = normalize_layer_name(layer_name) or layer_name
+    keys = [key for key, value in LAYER_KEY_TO_NAME.items() if value == name]
+    identifiers = [name, name.replace('层', '')]
+    for key in keys:
+        identifiers.extend([key, key.replace('_', '-'), key.replace('_', '')])
+    return [i.lower() for i in identifiers]
+
+
+def _svg_length(value: Optional[str], reference: float) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.endswith('%'):
+        try:
+            return float(value[:-1]) * reference / 100
+        except ValueError:
+            return None
+    return _number(value)
+
+
+def find_layout_svg(svg_dir: str) -> Optional[str]:
+    """布局层的SVG文件，文件名由模型决定，取最新的包含layout的文件"""
+    if not os.path.isdir(svg_dir):
+        return None
+    candidates = [os.path.join(svg_dir, name) for name in os.listdir(svg_dir)
+                  if name.lower().endswith('.svg') and ('layout' in name.lower() or '布局' in name)]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def target_box_from_layout(svg_path: str, layer_name: str) -> Optional[Tuple[int, int]]:
+    """在布局SVG中查找id/class/data-layer与图层对应的元素，返回其宽高"""
+    if not svg_path or not os.path.exists(svg_path):
+        return None
+    try:
+        root = ET.parse(svg_path).getroot()
+    except (ET.ParseError, OSError):
+        return None
+
+    view_box = [_number(v) for v in re.split(r'[\s,]+', root.get('viewBox', '').strip()) if v]
+    if len(view_box) == 4 and None not in view_box:
+        ref_width, ref_height = view_box[2], view_box[3]
+    else:
+        ref_width = _svg_length(root.get('width'), 0) or 0
+        ref_height = _svg_length(root.get('height'), 0) or 0
+
+    identifiers = _layer_identifiers(layer_name)
+
+    def matches(element) -> bool:
+        labels = [element.get('id', ''), element.get('data-layer', ''), element.get('data-name', '')]
+        labels.extend(element.get('class', '').split())
+        labels.extend(v for k, v in element.attrib.items() if k.endswith('}label'))
+        for label in labels:
+            label = label.lower()
+            if label and any(label == i or label.startswith(i + '-') or label.startswith(i + '_')
+                             or label.endswith('-' + i) or label.endswith('_' + i) for i in identifiers):
+                return True
+        return False
+
+    for element in root.iter():
+        if not matches(element):
+            continue
+        # 分组本身没有尺寸时取第一个带宽高的子元素
+        for candidate in element.iter():
+            width = _svg_length(candidate.get('width'), ref_width)
+            height = _svg_length(candidate.get('height'), ref_height)
+            if width and height:
+                return round(width), round(height)
+    return None
+
+
+def resolve_target_box(layer_name: str, layer_spec: Any = None,
+                       layout_svg: str = None) -> Optional[Tuple[int, int]]:
+    """图层规格中的display_size优先，其次是布局SVG中的对应元素"""
+    return target_box_from_spec(layer_spec) or target_box_from_layout(layout_svg, layer_name)
+
+
+def saliency_energy(image: Image.Image) -> np.ndarray:
+    """梯度能量图：亮度梯度幅值，带透明通道时加上alpha梯度，主体轮廓也计入"""
+    gray = np.asarray(image.convert('L'), dtype=np.float64)
+    energy = np.zeros_like(gray)
+    channels = [gray]
+    if 'A' in image.getbands():
+        channels.append(np.asarray(image.getchannel('A'), dtype=np.float64))
+    for channel in channels:
+        energy[:, 1:] += np.abs(np.diff(channel, axis=1))
+        energy[1:, :] += np.abs(np.diff(channel, axis=0))
+    return energy
+
+
+def _best_offset(profile: np.ndarray, window: int) -> int:
+    """一维能量分布上求和最大的窗口起点，近似最大时取最靠近中心的"""
+    cumulative = np.concatenate(([0.0], np.cumsum(profile)))
+    sums = cumulative[window:] - cumulative[:-window]
+    center = (len(profile) - window) / 2
+    candidates = np.flatnonzero(sums >= sums.max() * SALIENCY_TOLERANCE)
+    return int(candidates[np.argmin(np.abs(candidates - center))])
+
+
+def saliency_crop_box(image: Image.Image, aspect: float) -> Tuple[int, int, int, int]:
+    """按目标宽高比选择能量最大的最大裁剪窗口，返回 (left, top, right, bottom)"""
+    width, height = image.size
+    if abs(width / height - aspect) < 1e-3:
+        return 0, 0, width, height
+
+    scale = min(1.0, SALIENCY_MAX_SIDE / max(width, height))
+    small = image if scale == 1.0 else image.resize(
+        (max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+    energy = saliency_energy(small)
+
+    if width / height > aspect:
+        # 图像更宽：保留全高，水平方向滑动
+        crop_width = max(1, round(height * aspect))
+        window = max(1, min(energy.shape[1], round(crop_width * scale)))
+        left = min(width - crop_width, round(_best_offset(energy.sum(axis=0), window) / scale))
+        return left, 0, left + crop_width, height
+
+    crop_height = max(1, round(width / aspect))
+    window = max(1, min(energy.shape[0], round(crop_height * scale)))
+    top = min(height - crop_height, round(_best_offset(energy.sum(axis=1), window) / scale))
+    return 0, top, width, top + crop_height
+
+
+def fit_to_box(image: Image.Image, width: int, height: int) -> Tuple[Image.Image, Tuple[int, int, int, int]]:
+    """显著性裁剪到目标宽高比后用Lanczos缩小；原图不足时只裁剪不放大"""
+    crop = saliency_crop_box(image, width / height)
+    cropped = image.crop(crop)
+    if cropped.width > width:
+        cropped = cropped.resize((width, height), Image.LANCZOS)
+    return cropped, crop
+
+
+def _open_image(path: str) -> Tuple[Image.Image, Optional[str]]:
+    with Image.open(path) as opened:
+        fmt = opened.format
+        opened.load()
+        return opened.copy(), fmt
+
+
+def _replace_file(source: str, path: str):
+    """把source复制为path：先复制到临时文件再替换，不在原文件上写入"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_fitted(image: Image.Image, fmt: Optional[str], path: str, width: int, height: int,
+                  target_box: Tuple[int, int], dpr: float) -> Dict[str, Any]:
+    """裁剪缩放后写入path（临时文件 + os.replace），返回入库信息"""
+    fitted, crop = fit_to_box(image, width, height)
+    if fmt == 'JPEG' and fitted.mode not in ('RGB', 'L'):
+        fitted = fitted.convert('RGB')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    fitted.save(tmp_path, format=fmt or 'PNG')
+    os.replace(tmp_path, path)
+
+    print(f"📐 {os.path.basename(path)}: {image.width}x{image.height} → {fitted.width}x{fitted.height}"
+          f"（裁剪 {crop}）")
+    return {
+        'target_box': list(target_box),
+        'dpr': dpr,
+        'original_size': list(image.size),
+        'status': 'success',
+        'final_size': list(fitted.size),
+        'crop': list(crop)
+    }
+
+
+def _pixel_box(target_box: Tuple[int, int], dpr: float) -> Tuple[int, int]:
+    return tuple(max(1, round(v * dpr)) for v in target_box)
+
+
+def ingest_image(path: str, target_box: Optional[Tuple[int, int]], originals_dir: str,
+                 dpr: float = None) -> Dict[str, Any]:
+    """把生成的图像裁剪缩放到展示尺寸并替换，原图保存到originals_dir"""
+    if not target_box:
+        return {'status': 'skipped', 'reason': '未找到目标尺寸'}
+    dpr = display_dpr() if dpr is None else dpr
+    width, height = _pixel_box(target_box, dpr)
+
+    try:
+        image, fmt = _open_image(path)
+    except (OSError, ValueError) as e:
+        return {'status': 'error', 'error': str(e)}
+
+    if image.size == (width, height):
+        return {'target_box': list(target_box), 'dpr': dpr, 'original_size': list(image.size),
+                'status': 'skipped', 'reason': '尺寸已匹配'}
+
+    os.makedirs(originals_dir, exist_ok=True)
+    original_path = os.path.join(originals_dir, os.path.basename(path))
+    _replace_file(path, original_path)
+
+    result = _write_fitted(image, fmt, path, width, height, target_box, dpr)
+    return {**result, 'original_path': original_path}
+
+
+def recrop_image(original_path: str, path: str, target_box: Tuple[int, int], dpr: float = None) -> Dict[str, Any]:
+    """从保留的原图重新裁剪，用于布局调整后更新图层；原图只读，path整体替换"""
+    dpr = display_dpr() if dpr is None else dpr
+    width, height = _pixel_box(target_box, dpr)
+    try:
+        image, fmt = _open_image(original_path)
+    except (OSError, ValueError) as e:
+        return {'status': 'error', 'error': str(e)}
+
+    if image.size == (width, height):
+        _replace_file(original_path, path)
+        return {'target_box': list(target_box), 'dpr': dpr, 'original_size': list(image.size),
+                'status': 'skipped', 'reason': '尺寸已匹配', 'original_path': original_path}
+
+    result = _write_fitted(image, fmt, path, width, height, target_box, dpr)
+    return {**result, 'original_path': original_path}
@@ -0,0 +1,218 @@
+"""按感知质量压缩位图
+
+- 用NumPy计算SSIM，在编码质量区间内二分查找满足目标SSIM的最低质量
+- 带透明通道的PNG做保留alpha的调色板量化，同样以SSIM为约束选择最少颜色数
+- 只在结果更小且达到质量阈值时替换原文件
+"""
+import io
+import os
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, features
+
+# 目标SSIM，可通过环境变量 BANNER_IMAGE_SSIM_TARGET 覆盖
+DEFAULT_SSIM_TARGET = 0.985
+
+QUALITY_RANGE = (40, 95)
+
+# 调色板量化尝试的颜色数，从多到少
+PALETTE_COLORS = (256, 128, 64, 32)
+
+ENCODER_OPTIONS = {
+    'JPEG': {'optimize': True, 'progressive': True},
+    'WEBP': {'method': 6},
+    'AVIF': {'speed': 6},
+    'PNG': {'optimize': True}
+}
+
+# SSIM计算窗口和常数（按8位动态范围）
+SSIM_WINDOW = 8
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# 超过该边长时先缩小再计算SSIM，控制计算量
+SSIM_MAX_SIDE = 1024
+
+COMPRESSIBLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def ssim_target() -> float:
+    try:
+        return float(os.getenv('BANNER_IMAGE_SSIM_TARGET', DEFAULT_SSIM_TARGET))
+    except ValueError:
+        return DEFAULT_SSIM_TARGET
+
+
+def _box_mean(channel: np.ndarray, size: int) -> np.ndarray:
+    """用积分图计算size×size窗口均值（valid区域）"""
+    integral = np.pad(channel, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    total = integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+    return total / (size * size)
+
+
+def _channel_ssim(x: np.ndarray, y: np.ndarray) -> float:
+    size = min(SSIM_WINDOW, x.shape[0], x.shape[1])
+    mu_x, mu_y = _box_mean(x, size), _box_mean(y, size)
+    var_x = _box_mean(x * x, size) - mu_x ** 2
+    var_y = _box_mean(y * y, size) - mu_y ** 2
+    cov = _box_mean(x * y, size) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + SSIM_C1) * (2 * cov + SSIM_C2)) / \
+               ((mu_x ** 2 + mu_y ** 2 + SSIM_C1) * (var_x + var_y + SSIM_C2))
+    return float(ssim_map.mean())
+
+
+def to_array(image: Image.Image) -> np.ndarray:
+    """转为float64数组；带透明通道时RGB按alpha预乘，透明区域的颜色差异不计入"""
+    if max(image.size) > SSIM_MAX_SIDE:
+        scale = SSIM_MAX_SIDE / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             Image.BILINEAR)
+    if has_alpha(image):
+        rgba = np.asarray(image.convert('RGBA'), dtype=np.float64)
+        rgba[..., :3] *= rgba[..., 3:4] / 255
+        return rgba
+    return np.asarray(image.convert('RGB'), dtype=np.float64)
+
+
+def ssim(reference: Image.Image, candidate: Image.Image) -> float:
+    """各通道SSIM的最小值，避免单一通道（例如渐变中的某个颜色）出现色带而被平均掉"""
+    a, b = to_array(reference), to_array(candidate)
+    if a.shape != b.shape:
+        return 0.0
+    return min(_channel_ssim(a[..., c], b[..., c]) for c in range(a.shape[2]))
+
+
+def has_alpha(image: Image.Image) -> bool:
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        alpha = image.convert('RGBA').getchannel('A')
+        return alpha.getextrema()[0] < 255
+    return False
+
+
+def encode(image: Image.Image, fmt: str, quality: int = None) -> bytes:
+    buffer = io.BytesIO()
+    options = dict(ENCODER_OPTIONS.get(fmt, {}))
+    if quality is not None:
+        options['quality'] = quality
+    if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def _decode(data: bytes) -> Image.Image:
+    with Image.open(io.BytesIO(data)) as decoded:
+        decoded.load()
+        if decoded.mode == 'P' and 'transparency' in decoded.info:
+            return decoded.convert('RGBA')
+        return decoded.copy()
+
+
+def search_quality(image: Image.Image, fmt: str, target: float = None,
+                   quality_range: Tuple[int, int] = QUALITY_RANGE) -> Dict[str, Any]:
+    """二分查找满足目标SSIM的最低编码质量，上限仍不满足时使用上限"""
+    target = ssim_target() if target is None else target
+    low, high = quality_range
+    best = None
+    attempts = 0
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode(image, fmt, quality)
+        score = ssim(image, _decode(data))
+        attempts += 1
+        if score >= target:
+            best = {'quality': quality, 'data': data, 'ssim': score}
+            high = quality - 1
+        else:
+            low = quality + 1
+    if best is None:
+        data = encode(image, fmt, quality_range[1])
+        best = {'quality': quality_range[1], 'data': data, 'ssim': ssim(image, _decode(data))}
+    best['attempts'] = attempts
+    return best
+
+
+def quantize_palette(image: Image.Image, target: float = None,
+                     colors: Tuple[int, ...] = PALETTE_COLORS) -> Optional[Dict[str, Any]]:
+    """保留alpha的调色板量化，返回满足目标SSIM的最少颜色结果；256色也不满足时返回None"""
+    target = ssim_target() if target is None else target
+    rgba = image.convert('RGBA')
+    method = Image.Quantize.LIBIMAGEQUANT if features.check_feature('libimagequant') else Image.Quantize.FASTOCTREE
+    best = None
+    for count in colors:
+        quantized = rgba.quantize(colors=count, method=method, dither=Image.Dither.FLOYDSTEINBERG)
+        data = encode(quantized, 'PNG')
+        score = ssim(rgba, _decode(data))
+        if score < target:
+            break
+        best = {'colors': count, 'data': data, 'ssim': score}
+    return best
+
+
+def compress_image(path: str, target: float = None) -> Dict[str, Any]:
+    """压缩单个图像文件，保持原有编码格式；结果更小且满足质量阈值时原子替换"""
+    target = ssim_target() if target is None else target
+    original_bytes = os.path.getsize(path)
+    result = {'file': os.path.basename(path), 'original_bytes': original_bytes,
+              'final_bytes': original_bytes, 'method': None, 'status': 'skipped'}
+    try:
+        with Image.open(path) as opened:
+            fmt = opened.format
+            opened.load()
+            image = opened.copy()
+    except (OSError, ValueError) as e:
+        result.update(status='error', error=str(e))
+        return result
+
+    candidates: List[Dict[str, Any]] = []
+    if fmt in ('JPEG', 'WEBP'):
+        found = search_quality(image, fmt, target)
+        candidates.append({**found, 'method': f'{fmt.lower()}_q{found["quality"]}'})
+    elif fmt == 'PNG':
+        palette = quantize_palette(image, target)
+        if palette:
+            candidates.append({**palette, 'method': f'palette_{palette["colors"]}'})
+        candidates.append({'data': encode(image, 'PNG'), 'ssim': 1.0, 'method': 'png_optimize'})
+    else:
+        return result
+
+    candidates = [c for c in candidates if c['ssim'] >= target and len(c['data']) < original_bytes]
+    if not candidates:
+        return result
+    best = min(candidates, key=lambda c: len(c['data']))
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(best['data'])
+    os.replace(tmp_path, path)
+
+    result.update(status='success', final_bytes=len(best['data']), method=best['method'],
+                  ssim=round(best['ssim'], 4), saved_bytes=original_bytes - len(best['data']))
+    return result
+
+
+def compress_images(directory: str, target: float = None) -> Dict[str, Any]:
+    """压缩目录下的所有位图，返回带 'status' 的汇总"""
+    if not os.path.isdir(directory):
+        return {'status': 'skipped', 'error': f'目录不存在: {directory}'}
+    target = ssim_target() if target is None else target
+    files = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+            files.append(compress_image(path, target))
+            if files[-1]['status'] == 'success':
+                print(f"🗜️ {name}: {files[-1]['original_bytes']} → {files[-1]['final_bytes']} 字节"
+                      f"（{files[-1]['method']}，SSIM {files[-1]['ssim']}）")
+
+    original = sum(f['original_bytes'] for f in files)
+    final = sum(f['final_bytes'] for f in files)
+    return {
+        'status': 'success',
+        'ssim_target': target,
+        'files': files,
+        'original_bytes': original,
+        'final_bytes': final,
+        'saved_bytes': original - final
+    }
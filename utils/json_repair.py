@@ -0,0 +1,295 @@
+"""本地容错JSON解析
+
+模型输出的JSON常见问题：包在代码块或说明文字里、带注释、尾逗号、单引号或中文引号、
+键名不加引号、Python字面量（True/None），以及输出被截断导致字符串或数组未闭合。
+这里按代价从低到高依次尝试各修复策略，在所有候选中取能解析的最大对象，全部在本地完成。
+系统中解析模型JSON输出的地方（schema校验、图层设计方案、流式图层块、提示词提取）都走这里，
+不调用模型。尝试次数和成功次数按策略计入进程级的 repair_stats，任务通过 track_repairs
+另记一份自己的统计，同一进程中的多个任务互不影响。同一段模型输出只在第一次解析时计入统计，
+之后对同一文本的解析（例如按图层再次提取）传入 record=False。
+"""
+import contextvars
+import json
+import re
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .metrics import JSON_REPAIRS
+
+FENCED_RE = re.compile(r'```[A-Za-z]*\s*\n?(.*?)```', re.S)
+
+# 按顺序尝试；'agent' 只在调用方显式使用模型修复（RobustJSONExtractor.extract_json）时记录
+STRATEGIES = ('direct', 'fenced', 'normalized', 'truncated', 'agent')
+
+_OPENING_QUOTES = {'"': '"', "'": "'", '“': '”', '‘': '’'}
+_CLOSING = {'{': '}', '[': ']'}
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null',
+             'True': 'true', 'False': 'false', 'None': 'null'}
+_BARE_WORD_RE = re.compile(r'[^\s,:{}\[\]"\'“”‘’/]+')
+
+
+class RepairStats:
+    """各修复策略的尝试次数和成功次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = {name: 0 for name in STRATEGIES}
+        self.successes = {name: 0 for name in STRATEGIES}
+
+    def record(self, strategy: str, success: bool):
+        with self._lock:
+            self.attempts[strategy] += 1
+            if success:
+                self.successes[strategy] += 1
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                name: {
+                    'attempts': self.attempts[name],
+                    'successes': self.successes[name],
+                    'success_rate': round(self.successes[name] / self.attempts[name], 4)
+                    if self.attempts[name] else None
+                }
+                for name in STRATEGIES
+            }
+
+
+# 进程级统计，对应 banner_json_repairs_total 指标
+repair_stats = RepairStats()
+
+_current_stats: contextvars.ContextVar = contextvars.ContextVar('banner_json_repair_stats', default=None)
+
+
+@contextmanager
+def track_repairs(stats: RepairStats) -> Iterator[RepairStats]:
+    """在此范围内（含复制了上下文的工作线程）的修复尝试另记入stats"""
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def record_repair(strategy: str, success: bool):
+    """记录一次修复尝试：进程级统计、当前任务的统计和指标"""
+    repair_stats.record(strategy, success)
+    job_stats = _current_stats.get()
+    if job_stats is not None:
+        job_stats.record(strategy, success)
+    JSON_REPAIRS.inc(strategy=strategy, result='success' if success else 'failure')
+
+
+def _loads(text: str) -> Optional[Any]:
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, ValueError):
+        return None
+
+
+def _candidate_spans(text: str) -> List[str]:
+    """按括号配对切出顶层的 {...} / [...] 片段，未闭合的片段截到文本末尾"""
+    spans = []
+    i, n = 0, len(text)
+    while i < n:
+        if text[i] not in '{[':
+            i += 1
+            continue
+        depth, quote, j = 0, None, i
+        while j < n:
+            ch = text[j]
+            if quote:
+                if ch == '\\':
+                    j += 1
+                elif ch == quote:
+                    quote = None
+            elif ch == '"':
+                quote = ch
+            elif ch in '{[':
+                depth += 1
+            elif ch in '}]':
+                depth -= 1
+                if depth == 0:
+                    break
+            j += 1
+        spans.append(text[i:j + 1])
+        i = j + 1
+    return spans
+
+
+def normalize(text: str, close_truncated: bool = False) -> str:
+    """把类JSON文本规范化为标准JSON
+
+    去掉注释和尾逗号，单引号、中文引号改为双引号，键名和裸词加引号，Python字面量转为JSON字面量；
+    close_truncated为True时补齐未闭合的字符串和括号，并去掉末尾不完整的键值。
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+
+        if ch in _OPENING_QUOTES:
+            closer = _OPENING_QUOTES[ch]
+            # 模型常混用中文引号和ASCII引号，中文引号开头的字符串也接受ASCII双引号结束
+            closers = {closer, '"'} if ch in '“‘' else {closer}
+            out.append('"')
+            i += 1
+            terminated = False
+            while i < n:
+                c = text[i]
+                if c == '\\' and i + 1 < n:
+                    nxt = text[i + 1]
+                    out.append("'" if nxt == "'" else c + nxt)
+                    i += 2
+                    continue
+                if c in closers:
+                    terminated = True
+                    i += 1
+                    break
+                if c == '"':
+                    out.append('\\"')
+                elif c == '\n':
+                    out.append('\\n')
+                elif c == '\r':
+                    out.append('\\r')
+                elif c == '\t':
+                    out.append('\\t')
+                else:
+                    out.append(c)
+                i += 1
+            if terminated or close_truncated:
+                out.append('"')
+            continue
+
+        if ch == '/' and text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        if ch == '/' and text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            continue
+
+        if ch in '{[':
+            stack.append(_CLOSING[ch])
+            out.append(ch)
+        elif ch in '}]':
+            _strip_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+        elif ch.isspace() or ch in ',:':
+            out.append(ch)
+        else:
+            match = _BARE_WORD_RE.match(text, i)
+            if not match:
+                out.append(ch)
+                i += 1
+                continue
+            word = match.group(0)
+            if word in _LITERALS:
+                out.append(_LITERALS[word])
+            elif re.fullmatch(r'-?\d+(\.\d+)?([eE][+-]?\d+)?', word):
+                out.append(word)
+            else:
+                out.append(json.dumps(word, ensure_ascii=False))
+            i += len(word)
+            continue
+        i += 1
+
+    if close_truncated:
+        _strip_incomplete_tail(out, stack)
+        while stack:
+            _strip_trailing_comma(out)
+            out.append(stack.pop())
+    return ''.join(out)
+
+
+def _strip_trailing_comma(out: List[str]):
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ',':
+        del out[j:]
+
+
+_DANGLING_KEY_RE = re.compile(r'[{,]\s*"(?:[^"\\]|\\.)*"\s*$')
+
+
+def _strip_incomplete_tail(out: List[str], stack: List[str]):
+    """截断处如果是悬空的键或冒号，补null使其成为完整的键值对"""
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ':':
+        out.append('null')
+    elif stack and stack[-1] == '}' and _DANGLING_KEY_RE.search(''.join(out[-4096:])):
+        out.append(': null')
+
+
+def _attempt(strategy: str, candidates: List[str], attempts: List[Tuple[str, bool]],
+             transform=None) -> Optional[Tuple[Any, str]]:
+    """对候选逐个尝试，返回能解析的最大容器对象，尝试结果追加到attempts"""
+    best, best_size = None, -1
+    for candidate in candidates:
+        text = transform(candidate) if transform else candidate
+        data = _loads(text)
+        if isinstance(data, (dict, list)) and len(candidate) > best_size:
+            best, best_size = data, len(candidate)
+    attempts.append((strategy, best is not None))
+    return (best, strategy) if best is not None else None
+
+
+def _repair(text: str, attempts: List[Tuple[str, bool]]) -> Tuple[Optional[Any], Optional[str]]:
+    data = _loads(text)
+    if isinstance(data, (dict, list)):
+        attempts.append(('direct', True))
+        return data, 'direct'
+    attempts.append(('direct', False))
+
+    fenced = [block.strip() for block in FENCED_RE.findall(text)]
+    if fenced:
+        result = _attempt('fenced', fenced, attempts)
+        if result:
+            return result
+
+    spans = _candidate_spans(text)
+    for block in fenced:
+        spans.extend(_candidate_spans(block))
+    spans = list(dict.fromkeys(spans))
+    if not spans:
+        return None, None
+
+    for strategy, transform in (
+        ('normalized', normalize),
+        ('truncated', lambda candidate: normalize(candidate, close_truncated=True))
+    ):
+        result = _attempt(strategy, spans, attempts, transform)
+        if result:
+            return result
+    return None, None
+
+
+def repair_json(text: str, record: bool = True) -> Tuple[Optional[Any], Optional[str]]:
+    """容错解析文本中的JSON，返回 (数据, 生效的策略)；全部失败时返回 (None, None)
+
+    record为True时把各策略的尝试结果计入修复统计。同一段文本只应计入一次：再次解析已经由
+    上游解析（并计入统计）过的文本时传入 record=False。
+    """
+    text = (text or '').strip()
+    if not text:
+        return None, None
+
+    attempts: List[Tuple[str, bool]] = []
+    result = _repair(text, attempts)
+    if record:
+        for strategy, success in attempts:
+            record_repair(strategy, success)
+    return result
+
+
+def loads_lenient(text: str, record: bool = True) -> Optional[Any]:
+    """repair_json 的简写，只返回数据"""
+    return repair_json(text, record)[0]
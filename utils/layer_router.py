@@ -0,0 +1,128 @@
+"""基于规则的图层路由
+
+图层到执行代理的对应关系是固定的（路由提示词中的"图层格式规范"）：布局层、表意标识层、文字层、
+效果层用SVG（code_interpreter），背景层、主要素层用图像生成（image_gen）。这里直接根据结构化的
+图层设计方案生成路由方案。设计方案中出现规则无法识别的图层时，只把这些图层交给路由模型，
+再与规则路由合并；方案完全无法解析时才由路由模型处理整个方案。
+"""
+import json
+import os
+from typing import Dict, Any, List, Optional
+
+from .json_repair import loads_lenient
+from .layer_specs import normalize_layer_name, parse_design_output, parse_routing_output, RoutingEntry
+
+# 标准图层 -> 执行代理，与路由提示词中的图层格式规范一致
+LAYER_ROUTING_RULES = {
+    '布局层': 'code_interpreter',
+    '背景层': 'image_gen',
+    '主要素层': 'image_gen',
+    '表意标识层': 'code_interpreter',
+    '文字层': 'code_interpreter',
+    '效果层': 'code_interpreter'
+}
+
+
+def rule_routing_enabled() -> bool:
+    """BANNER_RULE_ROUTING=off 时始终使用路由模型"""
+    return os.getenv('BANNER_RULE_ROUTING', 'on').strip().lower() not in ('off', '0', 'false', 'no')
+
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def route_layer(layer_name: str, spec: Dict[str, Any]) -> RoutingEntry:
+    """按规则为单个图层生成路由项，设计方案中的规格原样作为输入参数"""
+    output = spec.get('output') or []
+    return {
+        'layer_name': layer_name,
+        'agent': LAYER_ROUTING_RULES[layer_name],
+        'layer_goal': _text(spec.get('input')),
+        'key_elements': _text(spec.get('specifications')),
+        'input_parameters': spec,
+        'output_requirements': '、'.join(map(str, output)) if isinstance(output, list) else _text(output)
+    }
+
+
+def route_design(design_text: str, parsed: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """根据图层设计方案生成路由方案
+
+    返回 {'status', 'routes', 'unknown_layers', 'unknown_specs'}：status为 'success' 时routes覆盖方案中的
+    全部图层；为 'needs_llm' 时unknown_layers列出规则无法识别的图层，unknown_specs是这些图层的原始规格
+    （方案无法解析时两者都为空）。已有 parse_design_output 的结果时通过parsed传入，不再重复解析。
+    """
+    if parsed is None:
+        parsed = parse_design_output(design_text)
+    if parsed['status'] == 'success':
+        layers = parsed['specs']
+        unknown: Dict[str, Any] = {}
+    else:
+        # 不符合schema时宽松解析，识别不了的图层名称交给路由模型；修复尝试已在校验时计入统计
+        data = loads_lenient(design_text, record=False)
+        raw_layers = data.get('layers') if isinstance(data, dict) else None
+        if not isinstance(raw_layers, dict) or not raw_layers:
+            return {'status': 'needs_llm', 'routes': [], 'unknown_layers': [], 'unknown_specs': {}}
+        layers, unknown = {}, {}
+        for key, spec in raw_layers.items():
+            layer_name = normalize_layer_name(key)
+            if layer_name in LAYER_ROUTING_RULES and isinstance(spec, dict):
+                layers.setdefault(layer_name, spec)
+            else:
+                unknown[key] = spec
+
+    routes = [route_layer(name, spec) for name, spec in layers.items()]
+    return {
+        'status': 'needs_llm' if unknown else 'success',
+        'routes': routes,
+        'unknown_layers': list(unknown),
+        'unknown_specs': unknown
+    }
+
+
+def unknown_layers_design(routing: Dict[str, Any]) -> str:
+    """只包含规则无法识别的图层的设计方案，作为路由模型的输入
+
+    这些图层不在标准图层之列，说明中要求路由模型沿用方案中的图层键名，合并时据此核对是否都已路由。
+    """
+    payload = json.dumps({'layers': routing['unknown_specs']}, ensure_ascii=False, indent=2)
+    names = '、'.join(routing['unknown_layers'])
+    return (f"以下图层不属于标准图层，请只为这些图层分配执行代理，layer_name直接使用方案中的图层键名（{names}）：\n\n"
+            f"```json\n{payload}\n```")
+
+
+def merge_llm_routes(routing: Dict[str, Any], llm_result: str) -> Dict[str, Any]:
+    """规则路由在前，路由模型给出的其余图层追加在后；同一图层以规则结果为准
+
+    routing是 route_design 的结果。路由模型的输出按CUSTOM_LAYER_ROUTING_SCHEMA解析，保留自定义图层名称。
+    返回 {'status', 'source', 'errors', 'routes', 'missing'}：路由模型的输出无法解析，或有未识别的图层
+    没有得到路由（列在missing中）时status为 'error'。
+    """
+    merged = list(routing['routes'])
+    routed = {route['layer_name'] for route in merged}
+    parsed = parse_routing_output(llm_result, custom_layers=True)
+    for layer_name, entry in parsed['routes'].items():
+        if layer_name not in routed:
+            merged.append(entry)
+            routed.add(layer_name)
+
+    errors = [f"路由模型: {error}" for error in parsed['errors']]
+    missing = [name for name in routing['unknown_layers'] if name not in routed]
+    if missing:
+        errors.append(f"路由模型没有给出图层 {missing} 的路由")
+    return {
+        'status': 'error' if errors else 'success',
+        'source': 'rules+llm',
+        'errors': errors,
+        'routes': merged,
+        'missing': missing
+    }
+
+
+def format_routing_result(routes: List[RoutingEntry]) -> str:
+    """规则路由的文本结果，格式与路由模型的输出一致（符合LAYER_ROUTING_SCHEMA的代码块，
+    合并了自定义图层时符合CUSTOM_LAYER_ROUTING_SCHEMA）"""
+    payload = json.dumps({'layers': routes}, ensure_ascii=False, indent=2)
+    return f"# 图层路由方案（规则生成）\n\n```json\n{payload}\n```\n"
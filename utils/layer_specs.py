@@ -0,0 +1,139 @@
+import json
+import hashlib
+from typing import Dict, Any, List, Optional, TypedDict, Union
+
+from ..prompts.schemas import LAYER_DESIGN_SCHEMA, LAYER_ROUTING_SCHEMA, CUSTOM_LAYER_ROUTING_SCHEMA
+from .json_repair import loads_lenient
+from .schema_validator import parse_json_output
+
+# 图层设计方案中的英文键 -> 系统标准图层名称
+LAYER_KEY_TO_NAME = {
+    'layout': '布局层',
+    'background': '背景层',
+    'main_element': '主要素层',
+    'logo': '表意标识层',
+    'text': '文字层',
+    'effects': '效果层'
+}
+
+# 使用图像生成的图层
+IMAGE_LAYER_NAMES = ('背景层', '主要素层')
+
+
+class LayerSpec(TypedDict, total=False):
+    """图层设计方案中单个图层的规格（LAYER_DESIGN_SCHEMA中的图层项）"""
+    agent: str
+    tool: str
+    input: Union[str, Dict[str, Any]]
+    output: List[str]
+    size: str
+    display_size: str
+    specifications: Union[str, Dict[str, Any]]
+
+
+class RoutingEntry(TypedDict, total=False):
+    """图层路由方案中的单个图层（LAYER_ROUTING_SCHEMA中的列表项）"""
+    layer_name: str
+    agent: str
+    layer_goal: str
+    key_elements: Union[str, List[str]]
+    input_parameters: Dict[str, Any]
+    output_requirements: str
+
+
+def normalize_layer_name(name: str) -> Optional[str]:
+    """将设计方案或路由结果中的图层名称归一化为标准图层名称"""
+    if not name:
+        return None
+    name = name.strip()
+    if name in LAYER_KEY_TO_NAME:
+        return LAYER_KEY_TO_NAME[name]
+    if name in LAYER_KEY_TO_NAME.values():
+        return name
+
+    aliases = {
+        '布局': '布局层',
+        '背景': '背景层',
+        '主要素': '主要素层',
+        '主元素': '主要素层',
+        '表意标识': '表意标识层',
+        '标识': '表意标识层',
+        '文字': '文字层',
+        '效果': '效果层'
+    }
+    stripped = name.replace('图层', '').replace('层', '')
+    return aliases.get(stripped)
+
+
+def extract_layer_specs(design_text: str, parsed: Optional[Dict[str, Any]] = None,
+                        record_repairs: bool = True) -> Dict[str, Dict[str, Any]]:
+    """从图层设计方案文本中提取各图层规格，按标准图层名称返回
+
+    优先按schema校验；不符合schema时退回宽松解析，只返回能够完整解析的图层，
+    解析失败时返回空字典。已有 parse_design_output 的结果时通过parsed传入，不再重复解析；
+    文本已经解析过时传入 record_repairs=False，修复尝试不重复计入统计。
+    """
+    if not design_text:
+        return {}
+
+    if parsed is None:
+        parsed = parse_design_output(design_text, record_repairs)
+    if parsed['status'] == 'success':
+        return dict(parsed['specs'])
+
+    # 本地容错解析（代码块、尾逗号、引号、截断等），同一文本的修复已在上面的校验中计入统计
+    data = loads_lenient(design_text, record=False)
+    layers = data.get('layers') if isinstance(data, dict) else None
+    if not isinstance(layers, dict):
+        return {}
+
+    specs = {}
+    for key, spec in layers.items():
+        layer_name = normalize_layer_name(key)
+        if layer_name and isinstance(spec, dict):
+            specs[layer_name] = spec
+    return specs
+
+
+def parse_design_output(design_text: str, record_repairs: bool = True) -> Dict[str, Any]:
+    """按LAYER_DESIGN_SCHEMA解析图层设计方案
+
+    返回 {'status', 'source', 'errors', 'project_name', 'overall_size', 'specs'}，
+    specs按标准图层名称给出 LayerSpec；校验失败时 specs 为空字典。
+    """
+    parsed = parse_json_output(design_text, LAYER_DESIGN_SCHEMA, record_repairs)
+    data = parsed.pop('data') or {}
+    specs: Dict[str, LayerSpec] = {
+        LAYER_KEY_TO_NAME[key]: spec for key, spec in data.get('layers', {}).items()
+    }
+    return {
+        **parsed,
+        'project_name': data.get('project_name'),
+        'overall_size': data.get('overall_size'),
+        'specs': specs
+    }
+
+
+def parse_routing_output(routing_text: str, custom_layers: bool = False) -> Dict[str, Any]:
+    """按LAYER_ROUTING_SCHEMA解析图层路由方案
+
+    返回 {'status', 'source', 'errors', 'routes'}，routes按图层名称给出 RoutingEntry；
+    同一图层出现多次时以第一次为准。custom_layers为True时按CUSTOM_LAYER_ROUTING_SCHEMA校验，
+    允许标准图层以外的图层名称（规则路由与路由模型合并后的方案）。
+    """
+    schema = CUSTOM_LAYER_ROUTING_SCHEMA if custom_layers else LAYER_ROUTING_SCHEMA
+    parsed = parse_json_output(routing_text, schema)
+    data = parsed.pop('data') or {}
+    routes: Dict[str, RoutingEntry] = {}
+    for entry in data.get('layers', []):
+        routes.setdefault(entry['layer_name'], entry)
+    return {**parsed, 'routes': routes}
+
+
+def spec_fingerprint(spec: Any) -> str:
+    """计算图层规格的指纹，用于判断规格是否发生变化"""
+    if isinstance(spec, str):
+        payload = spec.strip()
+    else:
+        payload = json.dumps(spec, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
@@ -0,0 +1,317 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+from .tracing import span, measure
+
+# 传输模式，通过环境变量 BANNER_LLM_TRANSPORT 配置：
+# - live：直接调用模型（默认）
+# - record：调用模型并把请求/响应及真实耗时写入夹具目录
+# - replay：从夹具目录按请求回放响应，不访问网络
+TRANSPORT_MODES = ('live', 'record', 'replay')
+
+# 夹具目录，通过环境变量 BANNER_FIXTURE_DIR 配置
+DEFAULT_FIXTURE_DIR = 'fixtures/llm'
+
+# 回放时的延迟模拟，通过环境变量 BANNER_REPLAY_LATENCY 配置：
+# 0（默认，不等待）、real（按录制时的真实耗时）或缩放系数（如0.5）
+DEFAULT_REPLAY_LATENCY = '0'
+
+# 回放时需要重新执行的本地工具：这些工具只在本地写文件，跳过会导致后续步骤缺少文档
+REPLAYABLE_LOCAL_TOOLS = ('enhanced_file_saver', 'progress_tracker')
+
+_RUN_DIR_PATTERN = re.compile(r'[^\s"\'()\[\]<>]*?banner_project_\d{8}_\d{6}')
+_RUN_DIR_PLACEHOLDER = 'banner_project_{RUN}'
+_NORMALIZE_PATTERNS = [
+    (re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?'), '{DATETIME}'),
+    (re.compile(r'\d{8}_\d{6}'), '{TIMESTAMP}'),
+]
+
+
+class ReplayMissError(RuntimeError):
+    """回放模式下夹具中没有对应的录制记录"""
+
+
+def normalize_text(text: str) -> str:
+    """去除请求中随运行变化的内容（项目目录、时间戳），使相同请求得到相同的键"""
+    text = _RUN_DIR_PATTERN.sub(_RUN_DIR_PLACEHOLDER, text)
+    for pattern, placeholder in _NORMALIZE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def _to_plain(obj: Any) -> Any:
+    """把qwen_agent的Message等对象转换为可JSON序列化的结构"""
+    if hasattr(obj, 'model_dump'):
+        return _to_plain(obj.model_dump(exclude_none=True))
+    if isinstance(obj, dict):
+        return {k: _to_plain(v) for k, v in obj.items() if v is not None}
+    if isinstance(obj, (list, tuple)):
+        return [_to_plain(v) for v in obj]
+    return obj
+
+
+def _to_messages(items: List[Dict[str, Any]]) -> List[Any]:
+    """回放时还原为qwen_agent的Message对象，保持与实时调用相同的访问方式"""
+    try:
+        from qwen_agent.llm.schema import Message
+    except ImportError:
+        return items
+    messages = []
+    for item in items:
+        try:
+            messages.append(Message(**item))
+        except Exception:
+            messages.append(item)
+    return messages
+
+
+def _run_dir_of(payload: Any) -> Optional[str]:
+    """找出请求中的项目目录名，用于在回放的响应中替换录制时的目录"""
+    match = re.search(r'banner_project_\d{8}_\d{6}', json.dumps(payload, ensure_ascii=False))
+    return match.group(0) if match else None
+
+
+class LLMTransport:
+    """模型调用传输层，所有Assistant.run、chat_model.chat和图像后端调用都经过这里"""
+
+    def __init__(self, mode: str = 'live', fixture_dir: str = DEFAULT_FIXTURE_DIR,
+                 replay_latency: str = DEFAULT_REPLAY_LATENCY):
+        if mode not in TRANSPORT_MODES:
+            raise ValueError(f"未知的传输模式: {mode}，可选: {', '.join(TRANSPORT_MODES)}")
+        self.mode = mode
+        self.fixture_dir = fixture_dir
+        self.latency_scale = 1.0 if replay_latency == 'real' else float(replay_latency or 0)
+        self._recorded_keys = set()
+        self._replay_cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.stats = {'live_calls': 0, 'recorded': 0, 'replayed': 0, 'misses': 0}
+
+    # ---- 调用入口 ----
+
+    def run_agent(self, agent, messages: List[Any], **kwargs) -> Iterator[Any]:
+        """执行 agent.run；录制模式只保存最终响应，回放模式一次性返回最终响应"""
+        from .rate_limiter import model_name_of
+        with span('llm.agent', agent=getattr(agent, 'name', None), model=model_name_of(agent),
+                  transport=self.mode) as s:
+            last = None
+            for last in self._run_agent(agent, messages, **kwargs):
+                yield last
+            s.set_attribute('response_messages', measure(last))
+
+    def _run_agent(self, agent, messages: List[Any], **kwargs) -> Iterator[Any]:
+        if self.mode == 'live':
+            self._record_stat('live_calls')
+            yield from agent.run(messages, **kwargs)
+            return
+
+        from .rate_limiter import model_name_of
+        request = {
+            'model': model_name_of(agent),
+            'system_message': getattr(agent, 'system_message', ''),
+            'tools': sorted(getattr(agent, 'function_map', {}) or {}),
+            'messages': _to_plain(messages)
+        }
+        key = self._key('agent', request)
+
+        if self.mode == 'replay':
+            call = self._replay('agent', key, request)
+            response = self._restore_run_dir(call['response'], request)
+            self._replay_local_tools(agent, response)
+            self._simulate_latency(call)
+            yield _to_messages(response)
+            return
+
+        start = time.monotonic()
+        last = None
+        for response in agent.run(messages, **kwargs):
+            last = response
+            yield response
+        self._record('agent', key, request, {
+            'response': self._strip_run_dir(_to_plain(last or []), request),
+            'latency': time.monotonic() - start
+        })
+
+    def chat(self, chat_model, messages: List[Any], **kwargs) -> Any:
+        """执行 chat_model.chat，流式结果会被消费完毕，返回最终的消息列表"""
+        with span('llm.chat', model=getattr(chat_model, 'model', None), transport=self.mode) as s:
+            response = self._chat(chat_model, messages, **kwargs)
+            s.set_attribute('response_messages', measure(response))
+            return response
+
+    def _chat(self, chat_model, messages: List[Any], **kwargs) -> Any:
+        if self.mode == 'replay':
+            request = {'model': getattr(chat_model, 'model', None) or 'default', 'messages': _to_plain(messages)}
+            call = self._replay('chat', self._key('chat', request), request)
+            self._simulate_latency(call)
+            return _to_messages(self._restore_run_dir(call['response'], request))
+
+        start = time.monotonic()
+        response = chat_model.chat(messages, **kwargs)
+        if not isinstance(response, list):
+            final = None
+            for final in response:
+                pass
+            response = final or []
+
+        if self.mode == 'live':
+            self._record_stat('live_calls')
+        else:
+            request = {'model': getattr(chat_model, 'model', None) or 'default', 'messages': _to_plain(messages)}
+            self._record('chat', self._key('chat', request), request, {
+                'response': self._strip_run_dir(_to_plain(response), request),
+                'latency': time.monotonic() - start
+            })
+        return response
+
+    def image(self, backend: str, prompt: str, width: int, height: int, colors: List[str],
+              fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """执行图像后端调用，图像内容以base64保存在夹具中"""
+        with span('image.generate', backend=backend, transport=self.mode,
+                  prompt_chars=len(prompt or ''), width=width, height=height) as s:
+            result = self._image(backend, prompt, width, height, colors, fn)
+            s.set_attribute('bytes', measure(result.get('content')))
+            return result
+
+    def _image(self, backend: str, prompt: str, width: int, height: int, colors: List[str],
+               fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        if self.mode == 'live':
+            self._record_stat('live_calls')
+            return fn()
+
+        request = {'backend': backend, 'prompt': prompt, 'size': [width, height], 'colors': list(colors or [])}
+        key = self._key('image', request)
+
+        if self.mode == 'replay':
+            call = self._replay('image', key, request)
+            self._simulate_latency(call)
+            return {**call['response'], 'content': base64.b64decode(call['content'])}
+
+        start = time.monotonic()
+        result = fn()
+        self._record('image', key, request, {
+            'response': {k: v for k, v in result.items() if k != 'content'},
+            'content': base64.b64encode(result['content']).decode('ascii'),
+            'latency': time.monotonic() - start
+        })
+        return result
+
+    # ---- 夹具读写 ----
+
+    def _key(self, kind: str, request: Dict[str, Any]) -> str:
+        normalized = normalize_text(json.dumps(request, ensure_ascii=False, sort_keys=True))
+        return hashlib.sha256(f"{kind}:{normalized}".encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.fixture_dir, kind, f"{key}.json")
+
+    def _record(self, kind: str, key: str, request: Dict[str, Any], call: Dict[str, Any]):
+        """写入录制记录：本进程内首次出现的键覆盖旧夹具，重复出现的键按顺序追加"""
+        path = self._path(kind, key)
+        with self._lock:
+            fixture = None
+            if key in self._recorded_keys and os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    fixture = json.load(f)
+            if fixture is None:
+                fixture = {'kind': kind, 'request': json.loads(normalize_text(json.dumps(request, ensure_ascii=False))),
+                           'calls': []}
+            fixture['calls'].append(call)
+            self._recorded_keys.add(key)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(fixture, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+            self.stats['recorded'] += 1
+
+    def _replay(self, kind: str, key: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """按录制顺序返回同一请求的第N次响应，超出录制次数时重复最后一次"""
+        path = self._path(kind, key)
+        if not os.path.exists(path):
+            self._record_stat('misses')
+            summary = request.get('model') or request.get('backend')
+            raise ReplayMissError(f"夹具中没有对应的{kind}请求（{summary}，key={key}），请先以record模式录制")
+
+        with open(path, 'r', encoding='utf-8') as f:
+            calls = json.load(f)['calls']
+        with self._lock:
+            index = self._replay_cursor.get(key, 0)
+            self._replay_cursor[key] = index + 1
+            self.stats['replayed'] += 1
+        return calls[min(index, len(calls) - 1)]
+
+    def _strip_run_dir(self, response: Any, request: Dict[str, Any]) -> Any:
+        run_dir = _run_dir_of(request)
+        if not run_dir:
+            return response
+        return json.loads(json.dumps(response, ensure_ascii=False).replace(run_dir, _RUN_DIR_PLACEHOLDER))
+
+    def _restore_run_dir(self, response: Any, request: Dict[str, Any]) -> Any:
+        run_dir = _run_dir_of(request)
+        if not run_dir:
+            return response
+        return json.loads(json.dumps(response, ensure_ascii=False).replace(_RUN_DIR_PLACEHOLDER, run_dir))
+
+    def _replay_local_tools(self, agent, response: List[Dict[str, Any]]):
+        """重新执行响应中只写本地文件的工具调用，保证回放后的文件与录制时一致"""
+        function_map = getattr(agent, 'function_map', None) or {}
+        for message in response:
+            function_call = message.get('function_call') if isinstance(message, dict) else None
+            if not function_call or function_call.get('name') not in REPLAYABLE_LOCAL_TOOLS:
+                continue
+            tool = function_map.get(function_call['name'])
+            if tool is None:
+                continue
+            try:
+                tool.call(function_call.get('arguments', '{}'))
+            except Exception as e:
+                print(f"⚠️ 回放工具 {function_call['name']} 失败: {e}")
+
+    def _simulate_latency(self, call: Dict[str, Any]):
+        if self.latency_scale > 0:
+            time.sleep(call.get('latency', 0) * self.latency_scale)
+
+    def _record_stat(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'mode': self.mode, 'fixture_dir': self.fixture_dir, **self.stats}
+
+
+_transport: Optional[LLMTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> LLMTransport:
+    """获取进程级的传输层实例，模式和夹具目录来自环境变量"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = LLMTransport(
+                mode=os.getenv('BANNER_LLM_TRANSPORT', 'live'),
+                fixture_dir=os.getenv('BANNER_FIXTURE_DIR', DEFAULT_FIXTURE_DIR),
+                replay_latency=os.getenv('BANNER_REPLAY_LATENCY', DEFAULT_REPLAY_LATENCY)
+            )
+        return _transport
+
+
+def set_transport(mode: str, fixture_dir: str = None, replay_latency: str = None) -> LLMTransport:
+    """在代码中切换传输模式（例如基准测试脚本），替换进程级实例"""
+    global _transport
+    with _transport_lock:
+        _transport = LLMTransport(
+            mode=mode,
+            fixture_dir=fixture_dir or os.getenv('BANNER_FIXTURE_DIR', DEFAULT_FIXTURE_DIR),
+            replay_latency=replay_latency if replay_latency is not None
+            else os.getenv('BANNER_REPLAY_LATENCY', DEFAULT_REPLAY_LATENCY)
+        )
+        return _transport
@@ -0,0 +1,243 @@
+"""Prometheus文本格式的运行指标
+
+- 设置环境变量 BANNER_METRICS_PORT 后在本地启动HTTP端点（/metrics）
+- 设置环境变量 BANNER_METRICS_TEXTFILE 后在每个任务结束时写入文件，供 node-exporter textfile collector 采集
+"""
+import bisect
+import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 默认的延迟直方图分桶（秒），覆盖从本地操作到分钟级的模型调用
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[str, str] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], Dict[str, object]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, {'counts': list(s['counts']), 'sum': s['sum'], 'count': s['count']})
+                           for key, s in self._series.items())
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, ('le', '+Inf'))
+            lines.append(f"{self.name}_bucket{labels} {series['count']}")
+            plain = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{plain} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{plain} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，重复注册同名指标时返回已有实例"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """生成Prometheus文本格式（0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str):
+        """原子写入文本文件，供 node-exporter textfile collector 采集"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+JOBS_IN_FLIGHT = REGISTRY.gauge('banner_jobs_in_flight', 'Banner生成任务进行中的数量', ['mode'])
+JOBS_TOTAL = REGISTRY.counter('banner_jobs_total', 'Banner生成任务数', ['mode', 'status'])
+PHASE_DURATION = REGISTRY.histogram('banner_phase_duration_seconds', '各阶段耗时', ['phase'])
+BYTES_WRITTEN = REGISTRY.counter('banner_bytes_written_total', '各阶段写入项目目录的字节数', ['phase'])
+LLM_LATENCY = REGISTRY.histogram('banner_llm_request_duration_seconds', 'LLM/VL调用耗时', ['model', 'status'])
+LLM_TOKENS = REGISTRY.counter('banner_llm_estimated_tokens_total',
+                              'LLM/VL调用的token数（按字符启发式估算，非服务商计费数据）', ['model', 'direction'])
+IMAGE_LATENCY = REGISTRY.histogram('banner_image_request_duration_seconds', '图像后端调用耗时', ['backend', 'status'])
+CACHE_REQUESTS = REGISTRY.counter('banner_cache_requests_total', '缓存查询次数', ['cache', 'result'])
+JSON_REPAIRS = REGISTRY.counter('banner_json_repairs_total', 'JSON修复策略的尝试次数', ['strategy', 'result'])
+SCREENSHOTS_IN_FLIGHT = REGISTRY.gauge('banner_screenshots_in_flight', '正在进行的HTML截图数')
+SCREENSHOT_DURATION = REGISTRY.histogram('banner_screenshot_duration_seconds', 'HTML截图耗时', ['status'])
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """在后台线程启动 /metrics HTTP端点，重复调用返回已启动的实例"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name='metrics_server', daemon=True).start()
+            print(f"📈 指标端点已启动: http://{host}:{port}/metrics")
+        return _server
+
+
+@contextmanager
+def job_metrics(mode: str):
+    """统计一个Banner任务：进行中数量、按结果计数，结束时写出指标文件
+
+    调用方把任务结果状态写入 yield 出的字典的 'status' 键。
+    """
+    job = {'status': 'error'}
+    JOBS_IN_FLIGHT.inc(mode=mode)
+    try:
+        yield job
+    finally:
+        JOBS_IN_FLIGHT.dec(mode=mode)
+        JOBS_TOTAL.inc(mode=mode, status=job['status'])
+        flush_metrics_textfile()
+
+
+def ensure_metrics_exporter():
+    """根据环境变量 BANNER_METRICS_PORT 启动指标端点"""
+    port = os.getenv('BANNER_METRICS_PORT')
+    if not port:
+        return
+    try:
+        start_metrics_server(int(port))
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 指标端点启动失败: {e}")
+
+
+def flush_metrics_textfile():
+    """根据环境变量 BANNER_METRICS_TEXTFILE 写出指标文件"""
+    path = os.getenv('BANNER_METRICS_TEXTFILE')
+    if not path:
+        return
+    try:
+        REGISTRY.write_textfile(path)
+    except OSError as e:
+        print(f"⚠️ 指标文件写入失败: {e}")
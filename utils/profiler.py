@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+from .rate_limiter import get_governor
+from .image_backends import image_backend_metrics
+from .tracing import span
+from .usage import usage_scope
+from .metrics import PHASE_DURATION, BYTES_WRITTEN
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb() -> Optional[float]:
+    """进程峰值常驻内存（MB），平台不支持时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS单位为字节
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+
+def directory_bytes(path: str) -> int:
+    """统计目录下所有文件的总字节数"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _llm_calls() -> int:
+    return sum(lane['requests'] for lane in get_governor().metrics().values())
+
+
+def _image_calls() -> int:
+    return sum(backend['requests'] for backend in image_backend_metrics().values())
+
+
+class PhaseProfiler:
+    """按阶段统计耗时、CPU时间、峰值内存增量、模型调用次数和写入字节数
+
+    同名阶段多次进入时累加（例如Workflow模式下事件分析到图层路由都记入top_agents）。
+    """
+
+    def __init__(self, work_dir: str):
+        self.work_dir = work_dir
+        self.phases: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        start_llm = _llm_calls()
+        start_images = _image_calls()
+        start_bytes = directory_bytes(self.work_dir)
+        start_peak = peak_rss_mb()
+        with span(f"phase.{name}", phase=name) as phase_span, usage_scope(phase=name):
+            try:
+                yield
+            finally:
+                sample = {
+                    'wall_seconds': time.perf_counter() - start_wall,
+                    'cpu_seconds': time.process_time() - start_cpu,
+                    'llm_calls': _llm_calls() - start_llm,
+                    'image_calls': _image_calls() - start_images,
+                    'bytes_written': max(0, directory_bytes(self.work_dir) - start_bytes)
+                }
+                phase_span.set_attributes(**sample)
+                PHASE_DURATION.observe(sample['wall_seconds'], phase=name)
+                BYTES_WRITTEN.inc(sample['bytes_written'], phase=name)
+                with self._lock:
+                    stats = self.phases.setdefault(name, {
+                        'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'llm_calls': 0,
+                        'image_calls': 0, 'bytes_written': 0, 'runs': 0
+                    })
+                    for key, value in sample.items():
+                        stats[key] += value
+                    stats['runs'] += 1
+                    # ru_maxrss是进程生命周期的峰值，只能得到本阶段把峰值抬高了多少
+                    end_peak = peak_rss_mb()
+                    if start_peak is not None and end_peak is not None:
+                        stats['peak_rss_growth_mb'] = round(
+                            stats.get('peak_rss_growth_mb', 0.0) + end_peak - start_peak, 1)
+                print(f"⏱️ 阶段 {name} 耗时 {sample['wall_seconds']:.1f}s，"
+                      f"模型调用 {sample['llm_calls']} 次，写入 {sample['bytes_written']} 字节")
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """返回各阶段统计（秒数保留三位小数）"""
+        with self._lock:
+            return {
+                name: {key: round(value, 3) if isinstance(value, float) else value
+                       for key, value in stats.items()}
+                for name, stats in self.phases.items()
+            }
@@ -0,0 +1,61 @@
+"""提示词前缀稳定化
+
+DashScope对请求的公共前缀做上下文缓存，只有逐字节相同的前缀才能命中。这里统一按
+"静态内容在前、变量内容在后"拼接提示词，并按Agent统计每次请求中稳定前缀的长度：
+稳定前缀 = Agent的system_message + 指令中的静态部分，同时记录其指纹，跨任务比较是否保持不变。
+"""
+import hashlib
+import threading
+from typing import Dict, Any, List, Tuple
+
+from .rate_limiter import estimate_tokens
+
+
+def assemble_prompt(static_parts: List[str], variable_parts: List[str]) -> Tuple[str, str]:
+    """按静态、变量的顺序拼接，返回 (完整提示词, 静态前缀)；空的变量段会被跳过"""
+    prefix = '\n\n'.join(part.strip('\n') for part in static_parts if part) + '\n\n'
+    variable = '\n\n'.join(part.strip('\n') for part in variable_parts if part and part.strip())
+    return prefix + variable, prefix
+
+
+def section(title: str, content: Any) -> str:
+    """变量段的统一格式"""
+    return f"## {title}\n{content}" if content else ''
+
+
+class PromptPrefixStats:
+    """按Agent记录每次请求的稳定前缀长度、占比和指纹"""
+
+    def __init__(self):
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record(self, agent, prompt: str, static_prefix: str) -> Dict[str, Any]:
+        system_message = getattr(agent, 'system_message', '') or ''
+        stable = system_message + static_prefix
+        total_tokens = estimate_tokens(system_message + prompt)
+        stable_tokens = estimate_tokens(stable)
+        entry = {
+            'agent': getattr(agent, 'name', None),
+            'total_chars': len(system_message) + len(prompt),
+            'stable_prefix_chars': len(stable),
+            'total_tokens': total_tokens,
+            'stable_prefix_tokens': stable_tokens,
+            'stable_ratio': round(stable_tokens / total_tokens, 4) if total_tokens else 0.0,
+            'prefix_fingerprint': hashlib.sha256(stable.encode('utf-8')).hexdigest()[:16]
+        }
+        with self._lock:
+            self.calls.append(entry)
+        return entry
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self.calls)
+        total = sum(c['total_tokens'] for c in calls)
+        stable = sum(c['stable_prefix_tokens'] for c in calls)
+        return {
+            'calls': calls,
+            'total_tokens': total,
+            'stable_prefix_tokens': stable,
+            'stable_ratio': round(stable / total, 4) if total else 0.0
+        }
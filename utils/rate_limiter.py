@@ -0,0 +1,359 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+
+from .llm_transport import get_transport
+from .usage import record_usage, count_images, IMAGE_INPUT_TOKENS
+from .metrics import LLM_LATENCY, LLM_TOKENS
+
+# 各模型的默认配额，可通过环境变量 BANNER_RATE_LIMITS（JSON）覆盖，例如：
+# {"qwen-max": {"rpm": 600, "tpm": 1000000, "max_concurrency": 8}}
+DEFAULT_RATE_LIMITS = {
+    'qwen-max': {'rpm': 600, 'tpm': 1000000, 'initial_concurrency': 4, 'max_concurrency': 16},
+    'qwen-vl-max': {'rpm': 300, 'tpm': 500000, 'initial_concurrency': 2, 'max_concurrency': 8},
+    'default': {'rpm': 300, 'tpm': 300000, 'initial_concurrency': 2, 'max_concurrency': 8}
+}
+
+# 命中限流时的最大重试次数
+MAX_THROTTLE_RETRIES = 3
+
+_THROTTLE_MARKERS = ('429', 'throttling', 'rate limit', 'ratelimit', 'too many requests')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：中文字符按1个token计，其余字符按4个字符1个token计"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def estimate_messages_tokens(messages: List[Any]) -> int:
+    """估算消息列表的输入token数（图片按固定token数计）"""
+    total = 0
+    for msg in messages or []:
+        content = msg.get('content', '') if isinstance(msg, dict) else getattr(msg, 'content', '')
+        if isinstance(content, list):
+            content = ' '.join(
+                str(item.get('text', '')) if isinstance(item, dict) else str(getattr(item, 'text', '') or '')
+                for item in content
+            )
+        total += estimate_tokens(str(content or ''))
+    return total + count_images(messages) * IMAGE_INPUT_TOKENS
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """判断异常是否为服务端限流（HTTP 429 / Throttling）"""
+    code = str(getattr(error, 'code', '') or getattr(error, 'status_code', '')).lower()
+    message = f"{code} {error}".lower()
+    return any(marker in message for marker in _THROTTLE_MARKERS)
+
+
+class TokenBucket:
+    """令牌桶，采用预约方式：调用方按预约顺序等待，保证先到先得"""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """预约amount个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= min(amount, self.capacity)
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def consume(self, amount: float):
+        """补记已经发生的消耗（例如输出token），允许令牌透支"""
+        with self._lock:
+            self._tokens -= amount
+
+
+class AdaptiveConcurrencyLimiter:
+    """自适应并发限制器
+
+    - 等待者按FIFO顺序获得执行槽位，避免饥饿
+    - AIMD：成功时加性增加，遇到限流或延迟超标时乘性减少
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 16,
+                 latency_threshold: float = 120.0, backoff_factor: float = 0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_threshold = latency_threshold
+        self.backoff_factor = backoff_factor
+        self.in_flight = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def acquire(self) -> float:
+        """按排队顺序获取执行槽位，返回排队等待的秒数"""
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            self._queue.append(ticket)
+            while self._queue[0] is not ticket or self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self._queue.popleft()
+            self.in_flight += 1
+            self._cond.notify_all()
+        return time.monotonic() - start
+
+    def release(self, latency: float = None, throttled: bool = False):
+        """释放槽位并根据本次结果调整并发上限；latency为None时只按是否限流调整"""
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit * self.backoff_factor)
+            elif latency is not None and latency > self.latency_threshold:
+                self.limit = max(self.minimum, self.limit * 0.9)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / max(self.limit, 1.0))
+            self._cond.notify_all()
+
+
+class _ModelLane:
+    """单个模型的限流通道：RPM令牌桶 + TPM令牌桶 + 自适应并发"""
+
+    def __init__(self, model: str, config: Dict[str, Any]):
+        self.model = model
+        rpm = config.get('rpm', 300)
+        tpm = config.get('tpm', 300000)
+        self.request_bucket = TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0 * 5))
+        self.token_bucket = TokenBucket(tpm / 60.0, tpm / 60.0 * 5)
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial=config.get('initial_concurrency', 2),
+            maximum=config.get('max_concurrency', 8),
+            latency_threshold=config.get('latency_threshold', 120.0)
+        )
+        self.stats = {
+            'requests': 0,
+            'throttled': 0,
+            'retries': 0,
+            'errors': 0,
+            'queue_wait_seconds': 0.0,
+            'rate_wait_seconds': 0.0
+        }
+        self._stats_lock = threading.Lock()
+
+    def record(self, key: str, value: float = 1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+
+class ModelRateGovernor:
+    """进程级的DashScope调用调度器，所有Assistant.run和vl_model.chat调用都经过这里"""
+
+    def __init__(self, limits: Dict[str, Dict[str, Any]] = None):
+        self.limits = {**DEFAULT_RATE_LIMITS, **(limits or {})}
+        self._lanes: Dict[str, _ModelLane] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, model: str, **config):
+        """更新某个模型的配额配置，已有通道会被重建"""
+        with self._lock:
+            self.limits[model] = {**self.limits.get(model, self.limits['default']), **config}
+            self._lanes.pop(model, None)
+
+    def _lane(self, model: str) -> _ModelLane:
+        with self._lock:
+            if model not in self._lanes:
+                config = self.limits.get(model, self.limits['default'])
+                self._lanes[model] = _ModelLane(model, config)
+            return self._lanes[model]
+
+    @contextmanager
+    def slot(self, model: str, input_tokens: int = 0, usage_labels: Dict[str, Any] = None,
+             latency_signal: bool = True):
+        """获取模型调用槽位；退出时根据是否限流调整并发，并记录token用量
+
+        latency_signal为False时耗时不参与并发调整：槽位覆盖的不只是模型请求（例如Agent的工具执行和
+        调用方处理流式响应的时间），耗时长不代表服务端变慢。调用方可以在state['extra_requests']中
+        补记槽位内额外发生的模型请求数，计入RPM令牌桶。
+        """
+        lane = self._lane(model)
+        queue_wait = lane.concurrency.acquire()
+        lane.record('queue_wait_seconds', queue_wait)
+
+        rate_wait = max(lane.request_bucket.reserve(1), lane.token_bucket.reserve(input_tokens))
+        if rate_wait > 0:
+            lane.record('rate_wait_seconds', rate_wait)
+            time.sleep(rate_wait)
+
+        lane.record('requests')
+        state = {'throttled': False, 'output_tokens': 0, 'extra_requests': 0}
+        status = 'ok'
+        start = time.monotonic()
+        try:
+            yield state
+        except Exception as e:
+            if is_throttle_error(e):
+                state['throttled'] = True
+                status = 'throttled'
+                lane.record('throttled')
+            else:
+                status = 'error'
+                lane.record('errors')
+            raise
+        finally:
+            latency = time.monotonic() - start
+            lane.token_bucket.consume(state['output_tokens'])
+            if state['extra_requests']:
+                lane.request_bucket.consume(state['extra_requests'])
+                lane.record('requests', state['extra_requests'])
+            lane.concurrency.release(latency if latency_signal else None, state['throttled'])
+            record_usage(model, input_tokens, state['output_tokens'], latency, status, **(usage_labels or {}))
+            LLM_LATENCY.observe(latency, model=model, status=status)
+            LLM_TOKENS.inc(input_tokens, model=model, direction='input')
+            LLM_TOKENS.inc(state['output_tokens'], model=model, direction='output')
+
+    def run_agent(self, agent, messages: List[Any], usage_labels: Dict[str, Any] = None,
+                  **kwargs) -> Iterator[Any]:
+        """限流执行 agent.run，流式转发响应；尚未产出响应时遇到限流会退避重试
+
+        一次agent.run可能包含多轮模型请求和工具执行，槽位覆盖整个过程：耗时不参与并发调整，
+        工具调用之后的模型请求在结束时按响应补记到RPM。
+        """
+        model = model_name_of(agent)
+        # Assistant会在消息前加上system_message，一并计入输入token
+        input_tokens = estimate_messages_tokens(messages) + estimate_tokens(getattr(agent, 'system_message', '') or '')
+        usage_labels = {'agent': getattr(agent, 'name', None), **(usage_labels or {})}
+
+        for attempt in range(MAX_THROTTLE_RETRIES + 1):
+            produced = False
+            try:
+                with self.slot(model, input_tokens, usage_labels, latency_signal=False) as state:
+                    last = None
+                    for response in get_transport().run_agent(agent, messages, **kwargs):
+                        produced = True
+                        last = response
+                        yield response
+                    state['output_tokens'] = _response_tokens(last)
+                    state['extra_requests'] = _tool_rounds(last)
+                return
+            except Exception as e:
+                if produced or not is_throttle_error(e) or attempt == MAX_THROTTLE_RETRIES:
+                    raise
+                self._backoff(model, attempt)
+
+    def chat(self, chat_model, messages: List[Any], usage_labels: Dict[str, Any] = None, **kwargs) -> Any:
+        """限流执行 chat_model.chat；流式结果会被消费完毕，返回最终的消息列表"""
+        model = getattr(chat_model, 'model', None) or 'default'
+        input_tokens = estimate_messages_tokens(messages)
+
+        for attempt in range(MAX_THROTTLE_RETRIES + 1):
+            try:
+                with self.slot(model, input_tokens, usage_labels) as state:
+                    response = get_transport().chat(chat_model, messages, **kwargs)
+                    state['output_tokens'] = _response_tokens(response)
+                    return response
+            except Exception as e:
+                if not is_throttle_error(e) or attempt == MAX_THROTTLE_RETRIES:
+                    raise
+                self._backoff(model, attempt)
+
+    def _backoff(self, model: str, attempt: int):
+        """限流后的指数退避（带抖动）"""
+        self._lane(model).record('retries')
+        delay = min(30.0, 2 ** attempt) * (0.5 + random.random())
+        print(f"⚠️ {model} 触发限流，{delay:.1f}s 后重试（第{attempt + 1}次）")
+        time.sleep(delay)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """返回各模型的队列深度、并发和限流统计"""
+        with self._lock:
+            lanes = list(self._lanes.values())
+        return {
+            lane.model: {
+                'queue_depth': lane.concurrency.queue_depth,
+                'in_flight': lane.concurrency.in_flight,
+                'concurrency_limit': round(lane.concurrency.limit, 2),
+                **lane.stats
+            }
+            for lane in lanes
+        }
+
+
+def model_name_of(agent) -> str:
+    """获取Agent使用的模型名称"""
+    llm = getattr(agent, 'llm', None)
+    if isinstance(llm, dict):
+        return llm.get('model', 'default')
+    return getattr(llm, 'model', None) or 'default'
+
+
+def _response_tokens(response: Any) -> int:
+    """估算响应中的输出token数"""
+    if not response:
+        return 0
+    messages = response if isinstance(response, list) else [response]
+    return estimate_messages_tokens(
+        [m for m in messages if (m.get('role') if isinstance(m, dict) else getattr(m, 'role', '')) == 'assistant']
+    )
+
+
+def _tool_rounds(response: Any) -> int:
+    """响应中的工具结果数，每个工具结果之后Agent会再请求一次模型"""
+    if not response:
+        return 0
+    messages = response if isinstance(response, list) else [response]
+    return sum(1 for m in messages if (m.get('role') if isinstance(m, dict) else getattr(m, 'role', '')) == 'function')
+
+
+_governor: Optional[ModelRateGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> ModelRateGovernor:
+    """获取进程级的调度器实例"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            overrides = {}
+            raw = os.getenv('BANNER_RATE_LIMITS')
+            if raw:
+                try:
+                    overrides = json.loads(raw)
+                except json.JSONDecodeError:
+                    print("⚠️ BANNER_RATE_LIMITS 不是有效的JSON，使用默认配额")
+            _governor = ModelRateGovernor(overrides)
+        return _governor
+
+
+def _caller_name(depth: int = 2) -> str:
+    """调用方的函数名，用于区分没有名称的Agent（如各生成器中的文件名、提示词提取器）"""
+    code = sys._getframe(depth).f_code
+    return getattr(code, 'co_qualname', code.co_name)
+
+
+def governed_run(agent, messages: List[Any], **kwargs) -> Iterator[Any]:
+    """经过限流调度的 agent.run"""
+    caller = _caller_name()
+    labels = {'caller': caller}
+    if not getattr(agent, 'name', None):
+        labels['agent'] = caller
+    return get_governor().run_agent(agent, messages, usage_labels=labels, **kwargs)
+
+
+def governed_chat(chat_model, messages: List[Any], **kwargs) -> Any:
+    """经过限流调度的 chat_model.chat"""
+    caller = _caller_name()
+    return get_governor().chat(chat_model, messages, usage_labels={'agent': caller, 'caller': caller}, **kwargs)
@@ -0,0 +1,137 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Optional
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class LatencyTracker:
+    """滑动窗口延迟统计，用于计算对冲请求的触发阈值"""
+
+    def __init__(self, window: int = 50):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """返回第pct百分位的延迟，样本不足时返回None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < 5:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """熔断器
+
+    - closed：正常放行，连续失败达到阈值后打开
+    - open：直接拒绝，冷却时间过后进入half_open
+    - half_open：放行一个试探请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """判断当前是否允许发送请求"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._probe_in_flight = False
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                    print(f"⚡ {self.name} 熔断器已打开（连续失败 {self.failures} 次）")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """在熔断器保护下执行fn"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} 熔断中")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hedged_request')
+
+
+def hedged_call(fn: Callable[[], Any], hedge_delay: Optional[float], max_hedges: int = 1) -> Any:
+    """对冲请求：主请求在hedge_delay秒内未返回时追加请求，采用最先成功的结果
+
+    所有请求都失败时抛出最后一个异常。hedge_delay为None时不发送对冲请求。
+    """
+    # 在调用方的上下文中执行，追踪等上下文变量可以传递到工作线程
+    pending = {_hedge_executor.submit(contextvars.copy_context().run, fn)}
+    hedges_sent = 0
+    last_error = None
+
+    while pending:
+        timeout = hedge_delay if hedge_delay is not None and hedges_sent < max_hedges else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            hedges_sent += 1
+            print(f"⏱️ 请求超过 {hedge_delay:.1f}s 未返回，发送对冲请求（第{hedges_sent}个）")
+            pending.add(_hedge_executor.submit(contextvars.copy_context().run, fn))
+            continue
+
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            for other in pending:
+                other.cancel()
+            return result
+
+        # 全部已完成的请求都失败了，还有余量时立即补发对冲请求
+        if not pending and hedges_sent < max_hedges and hedge_delay is not None:
+            hedges_sent += 1
+            pending.add(_hedge_executor.submit(contextvars.copy_context().run, fn))
+
+    raise last_error
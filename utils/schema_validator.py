@@ -0,0 +1,93 @@
+"""轻量JSON Schema校验
+
+只实现本项目schema用到的子集：type（可为列表）、enum、required、properties、
+additionalProperties（布尔）、items、minItems。返回错误列表，空列表表示通过。
+"""
+import json
+import re
+from typing import Dict, Any, List
+
+from .json_repair import repair_json
+
+_TYPE_CHECKS = {
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'string': lambda v: isinstance(v, str),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'null': lambda v: v is None
+}
+
+FENCED_JSON_RE = re.compile(r'```(?:json)?\s*(\{.*?\})\s*```', re.S)
+
+
+def validate(data: Any, schema: Dict[str, Any], path: str = '$') -> List[str]:
+    """按schema校验data，返回 "路径: 问题" 形式的错误列表"""
+    errors: List[str] = []
+    expected = schema.get('type')
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_TYPE_CHECKS[t](data) for t in types):
+            return [f"{path}: 应为 {'/'.join(types)}，实际为 {type(data).__name__}"]
+
+    if 'enum' in schema and data not in schema['enum']:
+        errors.append(f"{path}: {data!r} 不在 {schema['enum']} 中")
+
+    if isinstance(data, dict):
+        for key in schema.get('required', []):
+            if key not in data:
+                errors.append(f"{path}: 缺少字段 {key}")
+        properties = schema.get('properties', {})
+        for key, value in data.items():
+            if key in properties:
+                errors.extend(validate(value, properties[key], f'{path}.{key}'))
+            elif schema.get('additionalProperties') is False:
+                errors.append(f"{path}: 不允许的字段 {key}")
+
+    if isinstance(data, list):
+        if len(data) < schema.get('minItems', 0):
+            errors.append(f"{path}: 至少需要 {schema['minItems']} 项")
+        if 'items' in schema:
+            for i, item in enumerate(data):
+                errors.extend(validate(item, schema['items'], f'{path}[{i}]'))
+
+    return errors
+
+
+def parse_json_output(text: str, schema: Dict[str, Any], record_repairs: bool = True) -> Dict[str, Any]:
+    """解析模型的结构化输出并校验
+
+    JSON模式下整个回复就是JSON对象；否则取 ```json 代码块中第一个通过校验的对象，
+    都不通过时再用本地容错解析修复。返回 {'status', 'data', 'source', 'errors'}，不做额外的模型调用。
+    record_repairs为False时修复尝试不计入统计（文本已经解析过一次）。
+    """
+    text = (text or '').strip()
+    candidates = []
+    if text.startswith('{'):
+        candidates.append(('json_mode', text))
+    candidates.extend(('fenced', block) for block in FENCED_JSON_RE.findall(text))
+
+    errors: List[str] = []
+    for source, candidate in candidates:
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError as e:
+            errors.append(f"{source}: JSON解析失败: {e}")
+            continue
+        problems = validate(data, schema)
+        if not problems:
+            return {'status': 'success', 'data': data, 'source': source, 'errors': []}
+        errors.extend(f"{source}: {problem}" for problem in problems)
+
+    # 严格解析不通过时在本地容错修复（尾逗号、引号、截断等），仍不调用模型
+    data, strategy = repair_json(text, record_repairs)
+    if data is not None:
+        problems = validate(data, schema)
+        if not problems:
+            return {'status': 'success', 'data': data, 'source': f'repaired:{strategy}', 'errors': []}
+        errors.extend(f"repaired:{strategy}: {problem}" for problem in problems)
+
+    if not candidates and data is None:
+        errors.append('回复中没有JSON对象')
+    return {'status': 'error', 'data': None, 'source': None, 'errors': errors}
@@ -0,0 +1,267 @@
+"""事件分析和营销策划的语义缓存
+
+活动经常只是小幅变化地重复（"春节促销活动"与"春节大促"），每次都重新生成冗长的事件分析和营销方案。
+这里对历史的 (事件名称, 附加要求) 计算字符n-gram哈希向量，用NumPy余弦相似度检索，
+超过阈值时直接复用之前的结果，只把文中的旧事件名称替换为新名称。
+
+条目带版本号和创建时间：版本号（CACHE_VERSION）在提示词或输出格式变化时递增，旧版本条目不再复用；
+超过有效期（BANNER_SEMANTIC_TTL_DAYS，默认30天，0表示不过期）的条目同样忽略。清理缓存：
+    python -m banner_system.utils.semantic_cache prune   # 删除过期和旧版本条目
+    python -m banner_system.utils.semantic_cache purge   # 清空缓存
+或直接删除缓存文件（默认 ~/.cache/banner_system/semantic_cache.jsonl）。
+"""
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from .metrics import CACHE_REQUESTS
+
+# 缓存文件位置，可通过环境变量 BANNER_SEMANTIC_CACHE 覆盖，设为 off 关闭
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'banner_system', 'semantic_cache.jsonl')
+
+# 复用阈值，可通过环境变量 BANNER_SEMANTIC_THRESHOLD 覆盖
+DEFAULT_THRESHOLD = 0.85
+
+# 缓存条目格式和内容的版本，事件分析/营销策划的提示词或输出格式变化时递增
+CACHE_VERSION = 1
+
+# 条目有效期（天），可通过环境变量 BANNER_SEMANTIC_TTL_DAYS 覆盖，0表示不过期
+DEFAULT_TTL_DAYS = 30
+
+VECTOR_DIM = 4096
+NGRAM_SIZES = (1, 2, 3)
+
+# 事件名称和附加要求在相似度中的权重
+EVENT_WEIGHT = 0.6
+REQUIREMENTS_WEIGHT = 0.4
+
+# 活动名称中的通用词，不区分具体事件，计算相似度前去掉
+GENERIC_TERMS = ('促销活动', '营销活动', '主题活动', '购物狂欢节', '狂欢节', '购物节', '大促', '促销',
+                 '活动', '特惠', '优惠', '狂欢', '盛典', '专场', 'banner', '海报')
+
+# 常见写法归一
+EVENT_ALIASES = {'双11': '双十一', '双12': '双十二', '618': '六一八', '520': '五二零'}
+
+
+def normalize_event(event_name: str) -> str:
+    """去掉通用词后的事件核心，例如"春节促销活动"和"春节大促"都得到"春节\""""
+    text = event_name.lower()
+    for alias, canonical in EVENT_ALIASES.items():
+        text = text.replace(alias, canonical)
+    for term in GENERIC_TERMS:
+        text = text.replace(term, '')
+    core = re.sub(r'[\s\W_]+', '', text)
+    # "中秋节"与"中秋"视为相同，"春节"这类两字节日名保留
+    if len(core) > 2 and core.endswith('节'):
+        core = core[:-1]
+    return core or re.sub(r'[\s\W_]+', '', event_name.lower())
+
+
+def embed(text: str) -> np.ndarray:
+    """字符1~3-gram的哈希向量（计数开方后L2归一化），空文本返回零向量"""
+    text = re.sub(r'[\s\W_]+', '', text.lower())
+    vector = np.zeros(VECTOR_DIM)
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            vector[zlib.crc32(text[i:i + n].encode('utf-8')) % VECTOR_DIM] += 1
+    vector = np.sqrt(vector)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def similarity_threshold() -> float:
+    try:
+        return float(os.getenv('BANNER_SEMANTIC_THRESHOLD', DEFAULT_THRESHOLD))
+    except ValueError:
+        return DEFAULT_THRESHOLD
+
+
+def ttl_seconds() -> float:
+    try:
+        days = float(os.getenv('BANNER_SEMANTIC_TTL_DAYS', DEFAULT_TTL_DAYS))
+    except ValueError:
+        days = DEFAULT_TTL_DAYS
+    return max(0.0, days) * 86400
+
+
+def _is_current(entry: Dict[str, Any], ttl: float, now: float) -> bool:
+    """条目版本一致且未过期"""
+    if entry.get('version') != CACHE_VERSION:
+        return False
+    return not ttl or now - entry.get('created_at', 0) <= ttl
+
+
+class SemanticCache:
+    """基于字符n-gram向量的本地相似度索引，按JSON Lines追加持久化"""
+
+    def __init__(self, path: str, threshold: float = None):
+        self.path = path
+        self.threshold = similarity_threshold() if threshold is None else threshold
+        self.ttl = ttl_seconds()
+        self.entries: List[Dict[str, Any]] = []
+        self._event_vectors = np.zeros((0, VECTOR_DIM))
+        self._requirement_vectors = np.zeros((0, VECTOR_DIM))
+        self._lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0, 'stores': 0, 'skipped_stale': 0}
+        self._load()
+
+    def _read_entries(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return entries
+
+    def _load(self):
+        """只索引当前版本且未过期的条目"""
+        now = time.time()
+        entries = self._read_entries()
+        current = [e for e in entries if _is_current(e, self.ttl, now)]
+        self.stats['skipped_stale'] = len(entries) - len(current)
+        self._index(current)
+
+    def _index(self, entries: List[Dict[str, Any]]):
+        if not entries:
+            return
+        self.entries.extend(entries)
+        self._event_vectors = np.vstack(
+            [self._event_vectors] + [embed(normalize_event(e['event_name'])) for e in entries])
+        self._requirement_vectors = np.vstack(
+            [self._requirement_vectors] + [embed(e.get('requirements', '')) for e in entries])
+
+    def _scores(self, event_name: str, requirements: str) -> np.ndarray:
+        event_scores = self._event_vectors @ embed(normalize_event(event_name))
+        requirement_vector = embed(requirements)
+        if requirement_vector.any():
+            requirement_scores = self._requirement_vectors @ requirement_vector
+        else:
+            # 双方都没有附加要求时视为一致
+            requirement_scores = (~self._requirement_vectors.any(axis=1)).astype(float)
+        return EVENT_WEIGHT * event_scores + REQUIREMENTS_WEIGHT * requirement_scores
+
+    def lookup(self, event_name: str, requirements: str = "") -> Optional[Dict[str, Any]]:
+        """查找最相似的历史结果，相似度达到阈值时返回 {'similarity', 'entry'}"""
+        with self._lock:
+            self.stats['lookups'] += 1
+            if not self.entries:
+                CACHE_REQUESTS.inc(cache='semantic', result='miss')
+                return None
+            scores = self._scores(event_name, requirements)
+            if self.ttl:
+                # 进程运行期间过期的条目不再命中
+                created = np.array([e.get('created_at', 0) for e in self.entries])
+                scores = np.where(time.time() - created <= self.ttl, scores, -1.0)
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                CACHE_REQUESTS.inc(cache='semantic', result='miss')
+                return None
+            self.stats['hits'] += 1
+            CACHE_REQUESTS.inc(cache='semantic', result='hit')
+            return {'similarity': round(similarity, 4), 'entry': self.entries[best]}
+
+    def store(self, event_name: str, requirements: str, results: Dict[str, str]):
+        """记录一次成功生成的结果，空结果不记录；调用方负责不传入失败的结果"""
+        if not all(results.values()):
+            return
+        entry = {'version': CACHE_VERSION, 'event_name': event_name, 'requirements': requirements,
+                 'results': results, 'created_at': time.time()}
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._index([entry])
+            self.stats['stores'] += 1
+
+    def _rewrite(self, entries: List[Dict[str, Any]]):
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def prune(self) -> Dict[str, Any]:
+        """从缓存文件中删除过期和旧版本的条目"""
+        with self._lock:
+            now = time.time()
+            entries = self._read_entries()
+            kept = [e for e in entries if _is_current(e, self.ttl, now)]
+            if len(kept) != len(entries):
+                self._rewrite(kept)
+            self.entries = []
+            self._event_vectors = np.zeros((0, VECTOR_DIM))
+            self._requirement_vectors = np.zeros((0, VECTOR_DIM))
+            self._index(kept)
+        return {'status': 'success', 'kept': len(kept), 'removed': len(entries) - len(kept)}
+
+    def purge(self) -> Dict[str, Any]:
+        """清空缓存"""
+        with self._lock:
+            removed = len(self._read_entries())
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.entries = []
+            self._event_vectors = np.zeros((0, VECTOR_DIM))
+            self._requirement_vectors = np.zeros((0, VECTOR_DIM))
+        return {'status': 'success', 'kept': 0, 'removed': removed}
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'path': self.path, 'threshold': self.threshold, 'version': CACHE_VERSION,
+                    'ttl_days': self.ttl / 86400, 'entries': len(self.entries), **self.stats}
+
+
+def adapt_results(entry: Dict[str, Any], event_name: str) -> Dict[str, str]:
+    """轻量改写缓存结果：把文中的旧事件名称替换为当前事件名称
+
+    一个名称包含另一个时（"春节"与"春节大促"）不替换：直接替换会把文中已有的"春节大促"改成
+    "春节大促大促"，中文又没有词边界可以区分单独出现的名称，保留原文更稳妥。
+    """
+    previous = entry['event_name']
+    if previous in event_name or event_name in previous:
+        return dict(entry['results'])
+    return {key: text.replace(previous, event_name) for key, text in entry['results'].items()}
+
+
+_cache: Optional[SemanticCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """获取进程级的语义缓存，BANNER_SEMANTIC_CACHE=off 时返回None"""
+    global _cache
+    path = os.getenv('BANNER_SEMANTIC_CACHE', DEFAULT_CACHE_PATH)
+    if path.strip().lower() in ('', 'off', 'none', '0', 'false'):
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.path != path:
+            try:
+                _cache = SemanticCache(path)
+            except OSError as e:
+                print(f"⚠️ 语义缓存不可用: {e}")
+                return None
+        return _cache
+
+
+if __name__ == '__main__':
+    import sys
+    cache = get_semantic_cache()
+    if cache is None:
+        print("语义缓存已关闭")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'purge':
+        print(json.dumps(cache.purge(), ensure_ascii=False, indent=2))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'prune':
+        print(json.dumps(cache.prune(), ensure_ascii=False, indent=2))
+    else:
+        print(json.dumps(cache.report(), ensure_ascii=False, indent=2))
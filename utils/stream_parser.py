@@ -0,0 +1,114 @@
+import json
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from .json_repair import loads_lenient
+from .layer_specs import normalize_layer_name, spec_fingerprint
+
+# 设计方案中图层规格对象的典型字段，用于区分图层块与其他嵌套对象
+_LAYER_SPEC_FIELDS = ('agent', 'tool', 'input', 'output', 'specifications')
+
+
+class LayerBlockStreamParser:
+    """流式图层块解析器
+
+    在模型逐步输出的过程中增量扫描文本，一旦某个图层对应的JSON对象闭合
+    （例如带有 layer_name 的路由对象，或设计方案 layers 下的 background 等对象），
+    立即通过回调交给对应的生成器，而不必等待完整响应。
+    """
+
+    def __init__(self, on_block: Callable[[str, Dict[str, Any]], None] = None):
+        self.on_block = on_block
+        self.blocks: Dict[str, Dict[str, Any]] = {}
+        self._emitted: Dict[str, str] = {}
+        self._reset_scan()
+
+    def _reset_scan(self):
+        self._text = ''
+        self._pos = 0
+        self._in_string = False
+        self._escape = False
+        self._stack: List[Tuple[int, Optional[str]]] = []
+
+    def feed(self, text: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """输入当前累计的响应文本，返回本次新发现的图层块"""
+        if not text.startswith(self._text):
+            # 响应被改写（非追加），重新扫描，已发出的块按指纹去重
+            self._reset_scan()
+        self._text = text
+
+        found = []
+        while self._pos < len(text):
+            ch = text[self._pos]
+            if self._in_string:
+                if ch == '\n':
+                    # JSON字符串内不允许裸换行，说明引号出现在正文中，恢复扫描状态
+                    self._in_string = False
+                    self._escape = False
+                elif self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                self._stack.append((self._pos, self._preceding_key(self._pos)))
+            elif ch == '}' and self._stack:
+                start, key = self._stack.pop()
+                block = self._parse_block(text[start:self._pos + 1], key)
+                if block:
+                    found.append(block)
+            self._pos += 1
+
+        for layer_name, spec in found:
+            self.blocks[layer_name] = spec
+            if self.on_block:
+                self.on_block(layer_name, spec)
+        return found
+
+    def _preceding_key(self, brace_pos: int) -> Optional[str]:
+        """查找紧邻左花括号之前的 "key": 中的键名"""
+        i = brace_pos - 1
+        text = self._text
+        while i >= 0 and text[i] in ' \t\r\n':
+            i -= 1
+        if i < 0 or text[i] != ':':
+            return None
+        i -= 1
+        while i >= 0 and text[i] in ' \t\r\n':
+            i -= 1
+        if i < 0 or text[i] != '"':
+            return None
+        end = i
+        start = text.rfind('"', 0, end)
+        if start == -1:
+            return None
+        return text[start + 1:end]
+
+    def _parse_block(self, raw: str, key: Optional[str]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """判断闭合的对象是否为图层块，是则返回(标准图层名称, 规格)"""
+        if 'layer_name' not in raw and key is None:
+            return None
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            # 块已闭合，尾逗号、单引号之类的小问题在本地修复；完整方案随后还会整体解析并计入修复统计，
+            # 这里不重复计入
+            data = loads_lenient(raw, record=False)
+        if not isinstance(data, dict):
+            return None
+
+        layer_name = None
+        if isinstance(data.get('layer_name'), str):
+            layer_name = normalize_layer_name(data['layer_name'])
+        elif key and any(field in data for field in _LAYER_SPEC_FIELDS):
+            layer_name = normalize_layer_name(key)
+        if not layer_name:
+            return None
+
+        fingerprint = spec_fingerprint(data)
+        if self._emitted.get(layer_name) == fingerprint:
+            return None
+        self._emitted[layer_name] = fingerprint
+        return layer_name, data
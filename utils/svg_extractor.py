@@ -0,0 +1,178 @@
+"""从模型响应中本地提取SVG代码
+
+按标签扫描每个顶层<svg>片段并修复常见问题（缺少xmlns、未闭合或错配的标签、
+未转义的&和<、HTML实体），再用XMLPullParser流式校验。同一片段出现在代码块和正文中时只保留一份。
+"""
+import html.entities
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, Any, List, Tuple
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+
+SVG_START_RE = re.compile(r'<svg[\s>/]', re.I)
+TAG_RE = re.compile(
+    r'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<[?!].*?>'
+    r'|<(/?)([A-Za-z_][\w:.-]*)((?:[^<>"\']|"[^"]*"|\'[^\']*\')*)>',
+    re.S
+)
+BARE_AMP_RE = re.compile(r'&(?!#\d+;|#x[0-9a-fA-F]+;)([A-Za-z]\w*;)?')
+XML_ENTITIES = {'amp;', 'lt;', 'gt;', 'quot;', 'apos;'}
+
+# 流式校验时每次送入解析器的字符数
+PARSE_CHUNK_SIZE = 8192
+
+
+def _fix_entities(text: str) -> str:
+    """转义裸露的&，把HTML命名实体换成数字引用"""
+    def replace(match):
+        entity = match.group(1)
+        if entity is None:
+            return '&amp;'
+        if entity in XML_ENTITIES:
+            return match.group(0)
+        codepoint = html.entities.name2codepoint.get(entity[:-1])
+        return f'&#{codepoint};' if codepoint else '&amp;' + entity
+    return BARE_AMP_RE.sub(replace, text)
+
+
+def _scan_fragment(text: str, start: int) -> Tuple[str, int, List[str]]:
+    """从<svg开始按标签扫描到根元素闭合，返回(修复后的片段, 结束位置, 修复说明)"""
+    out = []
+    stack: List[str] = []
+    repairs: List[str] = []
+    pos = start
+    # 根元素到第一个子元素之间的文本，正文里提到"<svg>标签"时这里是说明文字
+    root_text: List[str] = []
+    has_child = False
+    # 没有闭合的SVG最多延伸到代码块结束
+    fence = text.find('```', start)
+    limit = fence if fence != -1 else len(text)
+
+    for match in TAG_RE.finditer(text, start, limit):
+        if match.start() > pos:
+            segment = text[pos:match.start()]
+            if len(stack) == 1 and not has_child:
+                root_text.append(segment)
+            out.append(_fix_entities(segment.replace('<', '&lt;')))
+        closing, name = match.group(1), match.group(2)
+        if name is not None and not closing and len(stack) == 1 and not has_child:
+            has_child = True
+            if ''.join(root_text).strip():
+                # 根元素后先出现说明文字，不是代码；从这个标签处重新查找<svg>
+                return '', match.start(), []
+        pos = match.end()
+
+        if name is None:
+            # 注释、CDATA、处理指令原样保留
+            out.append(match.group(0))
+            continue
+        if not closing:
+            if not stack and name != 'svg':
+                # 根元素按不区分大小写匹配到，统一写成<svg>，闭合标签随栈中的名称一起修正
+                repairs.append(f'<{name}>改为<svg>')
+                name = 'svg'
+            out.append(_fix_entities(f'<{name}{match.group(3)}>'))
+            if not match.group(3).rstrip().endswith('/'):
+                stack.append(name)
+            continue
+
+        index = next((i for i in range(len(stack) - 1, -1, -1) if stack[i].lower() == name.lower()), None)
+        if index is None:
+            repairs.append(f'删除多余的</{name}>')
+            continue
+        for missing in reversed(stack[index + 1:]):
+            out.append(f'</{missing}>')
+            repairs.append(f'补全</{missing}>')
+        out.append(f'</{stack[index]}>')
+        del stack[index:]
+        if not stack:
+            return ''.join(out), pos, repairs
+
+    tail = text[pos:limit]
+    if '<' in tail:
+        tail = tail[:tail.index('<')]
+        repairs.append('删除被截断的标签')
+    out.append(_fix_entities(tail.rstrip()))
+    for missing in reversed(stack):
+        out.append(f'</{missing}>')
+        repairs.append(f'补全</{missing}>')
+    return ''.join(out), limit, repairs
+
+
+def _ensure_namespaces(fragment: str, repairs: List[str]) -> str:
+    root = TAG_RE.match(fragment)
+    root_tag = root.group(0)
+    additions = ''
+    if not re.search(r'\sxmlns\s*=', root_tag):
+        additions += f' xmlns="{SVG_NS}"'
+        repairs.append('补充xmlns')
+    if 'xlink:' in fragment and not re.search(r'\sxmlns:xlink\s*=', root_tag):
+        additions += f' xmlns:xlink="{XLINK_NS}"'
+        repairs.append('补充xmlns:xlink')
+    if not additions:
+        return fragment
+    # 插在原标签名之后，不假设标签名的写法和长度
+    name_end = root.end(2)
+    return fragment[:name_end] + additions + fragment[name_end:]
+
+
+def validate_svg(svg_code: str):
+    """用XMLPullParser分块流式解析，格式错误时抛出ET.ParseError，返回根元素"""
+    parser = ET.XMLPullParser(events=('start',))
+    root = None
+    for offset in range(0, len(svg_code), PARSE_CHUNK_SIZE):
+        parser.feed(svg_code[offset:offset + PARSE_CHUNK_SIZE])
+        for _, element in parser.read_events():
+            if root is None:
+                root = element
+    parser.close()
+    if root is None or root.tag.rsplit('}', 1)[-1] != 'svg':
+        raise ET.ParseError('根元素不是<svg>')
+    return root
+
+
+def extract_svg_fragments(text: str) -> Dict[str, Any]:
+    """提取文本中所有顶层SVG，返回去重后的有效代码、修复记录和解析错误"""
+    svg_codes: List[str] = []
+    seen = set()
+    repairs: List[str] = []
+    errors: List[str] = []
+    duplicates = 0
+
+    pos = 0
+    while True:
+        match = SVG_START_RE.search(text, pos)
+        if not match:
+            break
+        fragment, pos, fragment_repairs = _scan_fragment(text, match.start())
+        if not fragment:
+            continue
+        fragment = _ensure_namespaces(fragment.strip(), fragment_repairs)
+
+        key = re.sub(r'\s+', ' ', fragment)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+
+        try:
+            root = validate_svg(fragment)
+        except ET.ParseError as e:
+            errors.append(str(e))
+            continue
+        if len(root) == 0:
+            # 正文里提到的"<svg>标签"之类，不是代码
+            errors.append('SVG没有任何子元素')
+            continue
+        svg_codes.append(fragment)
+        repairs.extend(fragment_repairs)
+
+    return {
+        'status': 'success' if svg_codes else 'error',
+        'svg_codes': svg_codes,
+        'repairs': repairs,
+        'duplicates': duplicates,
+        'errors': errors
+    }
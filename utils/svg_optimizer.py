@@ -0,0 +1,574 @@
+"""生成SVG的优化（类似svgo）
+
+在保存前对模型输出的SVG做无损或近似无损的精简：
+- 删除注释、metadata和编辑器命名空间的元素与属性
+- 删除默认值属性，缩短颜色写法
+- 按精度舍入坐标和数值
+- 合并多个<defs>以及其中完全相同的渐变、滤镜等定义，并改写引用
+- 合并transform列表，展开只有transform的单子元素分组
+- 路径数据在绝对/相对命令中取较短者，使用H/V和省略重复命令
+"""
+import copy
+import math
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, Any, List, Optional, Tuple
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+
+ET.register_namespace('xlink', XLINK_NS)
+
+# 编辑器写入的命名空间，对渲染没有作用
+EDITOR_NAMESPACES = (
+    'http://www.inkscape.org/namespaces/inkscape',
+    'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd',
+    'http://www.bohemiancoding.com/sketch/ns',
+    'http://ns.adobe.com/',
+    'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'http://creativecommons.org/ns#',
+    'http://purl.org/dc/elements/1.1/'
+)
+
+METADATA_TAGS = {'metadata'}
+
+# 保留空白的文本类元素
+TEXT_TAGS = {'text', 'tspan', 'textPath', 'style', 'script', 'title', 'desc'}
+
+# 数值类属性，按精度舍入
+NUMERIC_ATTRS = {
+    'x', 'y', 'x1', 'y1', 'x2', 'y2', 'cx', 'cy', 'r', 'rx', 'ry', 'fx', 'fy', 'fr',
+    'width', 'height', 'dx', 'dy', 'points', 'viewBox', 'offset', 'font-size', 'letter-spacing',
+    'stroke-width', 'stroke-dasharray', 'stroke-dashoffset', 'stdDeviation',
+    'opacity', 'fill-opacity', 'stroke-opacity', 'stop-opacity', 'flood-opacity'
+}
+
+COLOR_ATTRS = {'fill', 'stroke', 'stop-color', 'flood-color', 'lighting-color', 'color'}
+
+# 非继承属性的默认值，出现即可删除
+DEFAULT_ATTRS = {'opacity': '1', 'stop-opacity': '1', 'flood-opacity': '1'}
+
+# 可继承属性的默认值，祖先未设置其它值时可删除
+INHERITED_DEFAULTS = {'fill-opacity': '1', 'stroke-opacity': '1'}
+
+# 默认坐标为0的元素
+ZERO_XY_TAGS = {'rect', 'use', 'image', 'pattern', 'foreignObject'}
+
+# 会改变子元素坐标系或渲染结果的属性，带有这些属性的子元素不接收分组transform
+NO_HOIST_ATTRS = {'filter', 'clip-path', 'mask'}
+
+PATH_PARAMS = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'A': 7, 'Z': 0}
+
+NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+TRANSFORM_RE = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)')
+COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+HEX_COLOR_RE = re.compile(r'^#([0-9a-fA-F]{6}|[0-9a-fA-F]{3})$')
+RGB_COLOR_RE = re.compile(r'^rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)$')
+
+
+def _local(name: str) -> str:
+    return name.rsplit('}', 1)[-1]
+
+
+def _namespace(name: str) -> Optional[str]:
+    return name[1:].split('}', 1)[0] if name.startswith('{') else None
+
+
+def _is_editor_namespace(namespace: Optional[str]) -> bool:
+    return bool(namespace) and namespace.startswith(EDITOR_NAMESPACES)
+
+
+def format_number(value: float, precision: int) -> str:
+    """舍入并输出最短写法：去掉末尾0和整数部分的前导0"""
+    text = f"{round(value, precision):.{precision}f}" if precision > 0 else str(int(round(value)))
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text in ('-0', ''):
+        text = '0'
+    if text.startswith('0.'):
+        text = text[1:]
+    elif text.startswith('-0.'):
+        text = '-' + text[2:]
+    return text
+
+
+def join_numbers(numbers: List[str], previous: str = '') -> str:
+    """拼接数值，负号和小数点能分隔时省略空格"""
+    out = []
+    for number in numbers:
+        if previous and not (number.startswith('-') or (number.startswith('.') and '.' in previous)):
+            out.append(' ')
+        out.append(number)
+        previous = number
+    return ''.join(out)
+
+
+# ---------------------------------------------------------------- transform
+
+def _multiply(m1: Tuple[float, ...], m2: Tuple[float, ...]) -> Tuple[float, ...]:
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (a1 * a2 + c1 * b2, b1 * a2 + d1 * b2,
+            a1 * c2 + c1 * d2, b1 * c2 + d1 * d2,
+            a1 * e2 + c1 * f2 + e1, b1 * e2 + d1 * f2 + f1)
+
+
+def parse_transform(value: str) -> Optional[Tuple[float, ...]]:
+    """把transform列表合并为一个矩阵，无法解析时返回None"""
+    matrix = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+    if TRANSFORM_RE.sub('', value).strip(' ,\t\n'):
+        return None
+    for name, raw_args in TRANSFORM_RE.findall(value):
+        args = [float(n) for n in NUMBER_RE.findall(raw_args)]
+        if name == 'matrix' and len(args) == 6:
+            step = tuple(args)
+        elif name == 'translate' and len(args) in (1, 2):
+            step = (1, 0, 0, 1, args[0], args[1] if len(args) == 2 else 0)
+        elif name == 'scale' and len(args) in (1, 2):
+            step = (args[0], 0, 0, args[1] if len(args) == 2 else args[0], 0, 0)
+        elif name == 'rotate' and len(args) in (1, 3):
+            rad = math.radians(args[0])
+            cos, sin = math.cos(rad), math.sin(rad)
+            step = (cos, sin, -sin, cos, 0, 0)
+            if len(args) == 3:
+                cx, cy = args[1], args[2]
+                step = _multiply(_multiply((1, 0, 0, 1, cx, cy), step), (1, 0, 0, 1, -cx, -cy))
+        elif name == 'skewX' and len(args) == 1:
+            step = (1, 0, math.tan(math.radians(args[0])), 1, 0, 0)
+        elif name == 'skewY' and len(args) == 1:
+            step = (1, math.tan(math.radians(args[0])), 0, 1, 0, 0)
+        else:
+            return None
+        matrix = _multiply(matrix, step)
+    return matrix
+
+
+def format_transform(matrix: Tuple[float, ...], precision: int) -> str:
+    """输出矩阵的最短transform写法，单位矩阵返回空字符串"""
+    linear_precision = precision + 3
+    a, b, c, d = (round(v, linear_precision) for v in matrix[:4])
+    e, f = (round(v, precision) for v in matrix[4:])
+
+    def nums(*values, p=precision):
+        return join_numbers([format_number(v, p) for v in values])
+
+    if (a, b, c, d) == (1, 0, 0, 1):
+        if e == 0 and f == 0:
+            return ''
+        return f"translate({nums(e) if f == 0 else nums(e, f)})"
+    candidates = [f"matrix({nums(a, b, c, d, p=linear_precision)} {nums(e, f)})"]
+    if b == 0 and c == 0:
+        scale = f"scale({format_number(a, linear_precision) if a == d else nums(a, d, p=linear_precision)})"
+        candidates.append(scale if e == 0 and f == 0 else f"translate({nums(e, f)})" + scale)
+    if abs(a - d) < 1e-6 and abs(b + c) < 1e-6 and abs(a * a + b * b - 1) < 1e-4:
+        rotate = f"rotate({format_number(math.degrees(math.atan2(b, a)), precision + 1)})"
+        candidates.append(rotate if e == 0 and f == 0 else f"translate({nums(e, f)})" + rotate)
+    return min(candidates, key=len)
+
+
+# ---------------------------------------------------------------- path
+
+def parse_path(d: str) -> List[Tuple[str, List[float]]]:
+    """解析路径数据为(命令, 参数)列表，格式错误时抛出ValueError"""
+    segments = []
+    i, n = 0, len(d)
+    command = None
+    while True:
+        while i < n and d[i] in ' \t\r\n,':
+            i += 1
+        if i >= n:
+            break
+        if d[i].isalpha():
+            command = d[i]
+            i += 1
+            if command.upper() not in PATH_PARAMS:
+                raise ValueError(f"未知路径命令: {command}")
+            if command in 'Zz':
+                segments.append((command, []))
+                continue
+        elif command is None or command in 'Zz':
+            raise ValueError(f"路径数据格式错误: {d[i:i + 20]}")
+
+        args = []
+        for index in range(PATH_PARAMS[command.upper()]):
+            while i < n and d[i] in ' \t\r\n,':
+                i += 1
+            if command in 'Aa' and index in (3, 4):
+                if i < n and d[i] in '01':
+                    args.append(float(d[i]))
+                    i += 1
+                    continue
+                raise ValueError("圆弧标志位格式错误")
+            match = NUMBER_RE.match(d, i)
+            if not match:
+                raise ValueError(f"路径数据格式错误: {d[i:i + 20]}")
+            args.append(float(match.group()))
+            i = match.end()
+        segments.append((command, args))
+        # moveto之后的隐式坐标对是lineto
+        if command in 'Mm':
+            command = 'L' if command == 'M' else 'l'
+    return segments
+
+
+def simplify_path(d: str, precision: int) -> str:
+    """舍入坐标，每段在绝对和相对写法中取较短者，并省略重复的命令字母"""
+    segments = parse_path(d)
+
+    def rnd(value):
+        return round(value, precision)
+
+    # 精确坐标用于解析相对命令，舍入坐标用于输出，避免舍入误差沿相对命令累积
+    exact_x = exact_y = start_x = start_y = 0.0
+    cx = cy = 0.0
+    out = []
+    implicit = None
+    last_number = ''
+
+    for index, (command, args) in enumerate(segments):
+        upper = command.upper()
+        relative = command.islower()
+
+        if upper == 'Z':
+            out.append('z')
+            exact_x, exact_y = start_x, start_y
+            cx, cy = rnd(exact_x), rnd(exact_y)
+            implicit = None
+            last_number = ''
+            continue
+
+        # 转为绝对坐标
+        if upper == 'H':
+            exact = [args[0] + (exact_x if relative else 0), exact_y]
+            upper = 'L'
+        elif upper == 'V':
+            exact = [exact_x, args[0] + (exact_y if relative else 0)]
+            upper = 'L'
+        elif upper == 'A':
+            exact = args[:5] + [args[5] + (exact_x if relative else 0), args[6] + (exact_y if relative else 0)]
+        else:
+            exact = [v + ((exact_x if k % 2 == 0 else exact_y) if relative else 0) for k, v in enumerate(args)]
+        absolute = [v if upper == 'A' and k in (3, 4) else rnd(v) for k, v in enumerate(exact)]
+
+        end_x, end_y = absolute[-2], absolute[-1]
+        if upper == 'A':
+            point_slots = {5: cx, 6: cy}
+        else:
+            point_slots = {k: (cx if k % 2 == 0 else cy) for k in range(len(absolute))}
+        relative_args = [rnd(v - point_slots[k]) if k in point_slots else v for k, v in enumerate(absolute)]
+
+        if upper == 'L' and end_y == cy and index > 0:
+            options = [('H', [end_x]), ('h', [rnd(end_x - cx)])]
+        elif upper == 'L' and end_x == cx and index > 0:
+            options = [('V', [end_y]), ('v', [rnd(end_y - cy)])]
+        elif index == 0:
+            options = [(upper, absolute)]
+        else:
+            options = [(upper, absolute), (upper.lower(), relative_args)]
+
+        best = None
+        for letter, values in options:
+            numbers = [format_number(v, precision) for v in values]
+            omit = letter == implicit
+            text = join_numbers(numbers, last_number if omit else '')
+            candidate = (len(text) + (0 if omit else 1), letter, omit, text, numbers[-1])
+            if best is None or candidate[0] < best[0]:
+                best = candidate
+        _, letter, omit, text, last = best
+        out.append(text if omit else letter + text)
+        last_number = last
+        implicit = {'M': 'L', 'm': 'l'}.get(letter, letter)
+
+        cx, cy = end_x, end_y
+        exact_x, exact_y = exact[-2], exact[-1]
+        if upper == 'M':
+            start_x, start_y = exact_x, exact_y
+
+    return ''.join(out)
+
+
+# ---------------------------------------------------------------- attributes
+
+def _shorten_color(value: str) -> str:
+    text = value.strip()
+    match = RGB_COLOR_RE.match(text)
+    if match and all(int(v) <= 255 for v in match.groups()):
+        text = '#' + ''.join(f"{int(v):02x}" for v in match.groups())
+    match = HEX_COLOR_RE.match(text)
+    if not match:
+        return value
+    hex_value = match.group(1).lower()
+    if len(hex_value) == 6 and hex_value[0::2] == hex_value[1::2]:
+        hex_value = hex_value[0::2]
+    return '#' + hex_value
+
+
+def _round_numbers(value: str, precision: int) -> str:
+    return NUMBER_RE.sub(lambda m: format_number(float(m.group()), precision), value)
+
+
+class SVGOptimizer:
+    """SVG优化器，optimize() 返回带 'status' 的结果字典"""
+
+    def __init__(self, precision: int = 2):
+        self.precision = precision
+
+    def optimize(self, svg_code: str) -> Dict[str, Any]:
+        original_bytes = len(svg_code.encode('utf-8'))
+        result = {
+            'status': 'skipped',
+            'svg_code': svg_code,
+            'original_bytes': original_bytes,
+            'optimized_bytes': original_bytes,
+            'saved_bytes': 0,
+            'saved_ratio': 0.0,
+            'passes': {}
+        }
+
+        try:
+            root = ET.fromstring(svg_code.strip())
+        except ET.ParseError as e:
+            result['error'] = f'SVG解析失败: {e}'
+            return result
+        if _local(root.tag) != 'svg':
+            result['error'] = '根元素不是<svg>'
+            return result
+
+        self.stats = {
+            'comments': len(COMMENT_RE.findall(svg_code)),
+            'metadata': 0,
+            'attributes': 0,
+            'defs_merged': 0,
+            'groups_collapsed': 0,
+            'transforms': 0,
+            'paths': 0
+        }
+
+        try:
+            self._remove_metadata(root)
+            if not self._only_svg_namespaces(root):
+                result['error'] = '包含不支持的命名空间'
+                return result
+            for name in ('version', 'baseProfile'):
+                if root.attrib.pop(name, None) is not None:
+                    self.stats['attributes'] += 1
+            self._strip_whitespace(root)
+            self._clean_attributes(root, {})
+            self._merge_defs(root)
+            # 展开分组会拼接transform，再整理一遍
+            self._collapse_groups(root)
+            self._clean_attributes(root, {})
+            optimized = self._serialize(root)
+        except (ValueError, TypeError) as e:
+            result['error'] = f'SVG优化失败: {e}'
+            return result
+
+        optimized_bytes = len(optimized.encode('utf-8'))
+        if optimized_bytes >= original_bytes:
+            result['error'] = '优化后没有变小'
+            return result
+
+        result.update({
+            'status': 'success',
+            'svg_code': optimized,
+            'optimized_bytes': optimized_bytes,
+            'saved_bytes': original_bytes - optimized_bytes,
+            'saved_ratio': round((original_bytes - optimized_bytes) / original_bytes, 4),
+            'passes': self.stats
+        })
+        return result
+
+    def _remove_metadata(self, parent: ET.Element):
+        for child in list(parent):
+            if _local(child.tag) in METADATA_TAGS or _is_editor_namespace(_namespace(child.tag)):
+                parent.remove(child)
+                self.stats['metadata'] += 1
+                continue
+            self._remove_metadata(child)
+        for name in list(parent.attrib):
+            if _is_editor_namespace(_namespace(name)):
+                del parent.attrib[name]
+                self.stats['attributes'] += 1
+
+    def _only_svg_namespaces(self, root: ET.Element) -> bool:
+        for element in root.iter():
+            if _namespace(element.tag) not in (None, SVG_NS):
+                return False
+            if any(_namespace(name) not in (None, XLINK_NS, XML_NS) for name in element.attrib):
+                return False
+        return True
+
+    # ------------------------------------------------------------ defs
+
+    def _merge_defs(self, root: ET.Element):
+        """把所有<defs>合并到第一个，并去掉其中完全相同的定义"""
+        defs_list = [(parent, child) for parent in root.iter() for child in parent if _local(child.tag) == 'defs']
+        if not defs_list:
+            return
+        target = defs_list[0][1]
+        for parent, defs in defs_list[1:]:
+            target.extend(list(defs))
+            parent.remove(defs)
+            self.stats['defs_merged'] += 1
+
+        # 引用其它定义的渐变在改写引用后可能变得相同，重复几轮
+        for _ in range(3):
+            seen: Dict[str, str] = {}
+            replacements: Dict[str, str] = {}
+            for child in list(target):
+                element_id = child.get('id')
+                if not element_id:
+                    continue
+                signature_element = copy.deepcopy(child)
+                del signature_element.attrib['id']
+                signature_element.tail = None
+                signature = ET.tostring(signature_element, encoding='unicode')
+                if signature in seen:
+                    replacements[element_id] = seen[signature]
+                    target.remove(child)
+                    self.stats['defs_merged'] += 1
+                else:
+                    seen[signature] = element_id
+            if not replacements:
+                break
+            self._rewrite_references(root, replacements)
+
+        if len(target) == 0 and not target.attrib:
+            for parent, defs in defs_list[:1]:
+                parent.remove(defs)
+
+    def _rewrite_references(self, root: ET.Element, replacements: Dict[str, str]):
+        pattern = re.compile(r"url\((['\"]?)#(" + '|'.join(re.escape(k) for k in replacements) + r")\1\)")
+
+        def rewrite(text: str) -> str:
+            return pattern.sub(lambda m: f"url(#{replacements[m.group(2)]})", text)
+
+        for element in root.iter():
+            for name, value in element.attrib.items():
+                if _local(name) == 'href' and value.startswith('#') and value[1:] in replacements:
+                    element.set(name, '#' + replacements[value[1:]])
+                elif 'url(' in value:
+                    element.set(name, rewrite(value))
+            if _local(element.tag) == 'style' and element.text:
+                element.text = rewrite(element.text)
+
+    # ------------------------------------------------------------ groups
+
+    def _collapse_groups(self, parent: ET.Element):
+        """展开无属性的分组；只有transform且只有一个子元素的分组把transform下移到子元素"""
+        for child in list(parent):
+            self._collapse_groups(child)
+
+        for child in list(parent):
+            if _local(child.tag) != 'g' or (child.text or '').strip():
+                continue
+            position = list(parent).index(child)
+            attrs = set(child.attrib)
+            grandchildren = list(child)
+
+            if not grandchildren and not attrs:
+                self._move_tail(parent, child, position)
+                parent.remove(child)
+                self.stats['groups_collapsed'] += 1
+            elif not attrs and _local(parent.tag) != 'switch':
+                self._unwrap(parent, child, position)
+            elif attrs == {'transform'} and len(grandchildren) == 1:
+                only = grandchildren[0]
+                # 被<use>引用的元素带上transform会改变引用处的渲染
+                if NO_HOIST_ATTRS & set(only.attrib) or only.get('id'):
+                    continue
+                only.set('transform', (child.get('transform') + ' ' + only.get('transform', '')).strip())
+                self._unwrap(parent, child, position)
+
+    def _unwrap(self, parent: ET.Element, group: ET.Element, position: int):
+        children = list(group)
+        if children:
+            children[-1].tail = (children[-1].tail or '') + (group.tail or '')
+        parent.remove(group)
+        for offset, child in enumerate(children):
+            parent.insert(position + offset, child)
+        self.stats['groups_collapsed'] += 1
+
+    @staticmethod
+    def _move_tail(parent: ET.Element, element: ET.Element, position: int):
+        if not element.tail:
+            return
+        if position > 0:
+            previous = parent[position - 1]
+            previous.tail = (previous.tail or '') + element.tail
+        else:
+            parent.text = (parent.text or '') + element.tail
+
+    # ------------------------------------------------------------ attributes
+
+    def _clean_attributes(self, element: ET.Element, inherited: Dict[str, str]):
+        tag = _local(element.tag)
+        for name in list(element.attrib):
+            value = element.attrib[name].strip()
+            local = _local(name)
+            if local in NUMERIC_ATTRS:
+                value = _round_numbers(value, self.precision)
+
+            if DEFAULT_ATTRS.get(local) == value or (
+                    INHERITED_DEFAULTS.get(local) == value and inherited.get(local, value) == value):
+                del element.attrib[name]
+                self.stats['attributes'] += 1
+                continue
+            if local in ('x', 'y') and tag in ZERO_XY_TAGS and NUMBER_RE.fullmatch(value) and float(value) == 0:
+                del element.attrib[name]
+                self.stats['attributes'] += 1
+                continue
+            if local == 'd' and tag == 'path':
+                try:
+                    simplified = simplify_path(value, self.precision)
+                    if len(simplified) < len(value):
+                        value = simplified
+                        self.stats['paths'] += 1
+                except ValueError:
+                    pass
+            elif local in ('transform', 'gradientTransform', 'patternTransform'):
+                matrix = parse_transform(value)
+                collapsed = format_transform(matrix, self.precision) if matrix else None
+                if collapsed == '':
+                    del element.attrib[name]
+                    self.stats['transforms'] += 1
+                    continue
+                rounded = _round_numbers(value, self.precision + 3)
+                if collapsed is not None and len(collapsed) < len(rounded):
+                    self.stats['transforms'] += 1
+                    value = collapsed
+                else:
+                    value = rounded
+            elif local in COLOR_ATTRS:
+                value = _shorten_color(value)
+            element.set(name, value)
+
+        child_inherited = {**inherited, **{k: element.get(k) for k in INHERITED_DEFAULTS if element.get(k)}}
+        for child in element:
+            self._clean_attributes(child, child_inherited)
+
+    def _strip_whitespace(self, element: ET.Element):
+        if _local(element.tag) in TEXT_TAGS:
+            return
+        if element.text and not element.text.strip():
+            element.text = None
+        for child in element:
+            if child.tail and not child.tail.strip():
+                child.tail = None
+            self._strip_whitespace(child)
+
+    @staticmethod
+    def _serialize(root: ET.Element) -> str:
+        # 去掉SVG命名空间前缀，在根元素上声明默认命名空间，避免输出ns0:前缀
+        if _namespace(root.tag) == SVG_NS:
+            for element in root.iter():
+                element.tag = _local(element.tag)
+            root.set('xmlns', SVG_NS)
+        # 属性值和文本中的'>'都已转义，' />'只会出现在空元素结尾
+        return ET.tostring(root, encoding='unicode').replace(' />', '/>')
+
+
+def optimize_svg(svg_code: str, precision: int = 2) -> Dict[str, Any]:
+    """优化单个SVG，无法解析或优化后没有变小时原样返回（status为skipped）"""
+    return SVGOptimizer(precision).optimize(svg_code)
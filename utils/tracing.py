@@ -0,0 +1,205 @@
+import contextvars
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, List, Optional
+
+# 通过环境变量 BANNER_TRACING=1 开启追踪，每次运行在项目目录下输出 trace.json
+TRACE_FILENAME = 'trace.json'
+
+SERVICE_NAME = 'banner_system'
+
+
+def tracing_enabled() -> bool:
+    return os.getenv('BANNER_TRACING', '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def measure(value: Any) -> Optional[int]:
+    """返回字符串的字符数、字节串的字节数或列表的长度，用作span属性"""
+    if isinstance(value, (str, bytes, list, tuple, dict)):
+        return len(value)
+    return None
+
+
+class Span:
+    """一次操作的时间区间和属性"""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'status', 'message')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.status = 'OK'
+        self.message = ''
+
+    def set_attribute(self, key: str, value: Any):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, error: Exception):
+        self.status = 'ERROR'
+        self.message = f"{type(error).__name__}: {error}"[:500]
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            'status': {'code': 2, 'message': self.message} if self.status == 'ERROR' else {'code': 1}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空span，所有操作都不做任何事"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """单次运行的span集合"""
+
+    def __init__(self, name: str, output_dir: str):
+        self.name = name
+        self.output_dir = output_dir
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """导出为OTLP/JSON（ExportTraceServiceRequest）格式"""
+        with self._lock:
+            spans = [span.to_otlp() for span in self.spans]
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [_otlp_attribute('service.name', SERVICE_NAME)]},
+                'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': spans}]
+            }]
+        }
+
+    def export(self) -> Optional[str]:
+        path = os.path.join(self.output_dir, TRACE_FILENAME)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.to_otlp(), f, ensure_ascii=False, indent=2)
+            print(f"🧭 追踪数据已保存: {path}（{len(self.spans)} 个span）")
+            return path
+        except Exception as e:
+            print(f"⚠️ 追踪数据保存失败: {e}")
+            return None
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('banner_trace', default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar('banner_span', default=None)
+
+
+def current_span():
+    """返回当前span，追踪关闭时返回空span"""
+    return _current_span.get() or NOOP_SPAN
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """在当前追踪中创建子span；没有进行中的追踪时几乎没有开销"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield NOOP_SPAN
+        return
+
+    parent = _current_span.get()
+    current = Span(trace, name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except GeneratorExit:
+        # 流式消费方提前结束，不视为错误
+        raise
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        trace.add(current)
+
+
+@contextmanager
+def trace_run(output_dir: str, name: str, **attributes):
+    """开始一次运行的追踪，结束时导出到 output_dir/trace.json；未开启追踪时不做任何事"""
+    if not tracing_enabled() or _current_trace.get() is not None:
+        yield
+        return
+
+    trace = Trace(name, output_dir)
+    token = _current_trace.set(trace)
+    try:
+        with span(name, **attributes):
+            yield
+    finally:
+        _current_trace.reset(token)
+        trace.export()
+
+
+def traced(name: str, **static_attributes):
+    """为函数创建span的装饰器，记录首个字符串参数的长度和返回值大小"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return fn(*args, **kwargs)
+            input_size = next((len(a) for a in args if isinstance(a, str)), None)
+            with span(name, function=fn.__qualname__, input_chars=input_size, **static_attributes) as s:
+                result = fn(*args, **kwargs)
+                s.set_attribute('output_size', measure(result))
+                if isinstance(result, dict) and result.get('status') not in (None, 'success'):
+                    s.status = 'ERROR'
+                    s.message = str(result.get('error', ''))[:500]
+                return result
+        return wrapper
+    return decorator
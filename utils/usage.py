@@ -0,0 +1,250 @@
+"""模型调用的token与费用统计
+
+每次LLM/VL调用记录输入输出token数、模型、耗时和费用估算，按阶段、图层和Agent汇总。
+统计范围由上下文变量传递（包括推测式调度等工作线程），每个Banner任务一本账。
+qwen_agent的响应不带服务商的用量数据，token数按字符数启发式估算，费用同样只是估算，不等于账单。
+每个任务结束时（传统模式和Workflow模式都一样）把汇总写入项目目录的 usage.json。
+
+汇总多个项目目录的费用：
+    python -m banner_system.utils.usage banner_project_*
+"""
+import argparse
+import contextvars
+import glob
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List
+
+# 参考价格（元/千token），实际以阿里云百炼官网为准；可通过环境变量 BANNER_MODEL_PRICES（JSON）覆盖
+DEFAULT_MODEL_PRICES = {
+    'qwen-max': {'input': 0.0024, 'output': 0.0096},
+    'qwen-vl-max': {'input': 0.003, 'output': 0.009},
+    'default': {'input': 0.0024, 'output': 0.0096}
+}
+
+CURRENCY = 'CNY'
+
+# VL调用中每张图片按固定token数估算
+IMAGE_INPUT_TOKENS = 1000
+
+# 汇总时保留的最贵调用条数
+TOP_CALLS = 10
+
+# token数的来源，写入汇总中提醒读者这不是服务商计费数据
+TOKEN_SOURCE = 'heuristic_estimate'
+TOKEN_NOTE = 'token数按字符启发式估算（中文1字1token，其余4字符1token，每张图片1000token），非服务商计费数据'
+
+# 每个项目目录中的用量汇总文件
+USAGE_FILE = 'usage.json'
+
+
+def model_prices() -> Dict[str, Dict[str, float]]:
+    prices = dict(DEFAULT_MODEL_PRICES)
+    raw = os.getenv('BANNER_MODEL_PRICES')
+    if raw:
+        try:
+            prices.update(json.loads(raw))
+        except json.JSONDecodeError:
+            print("⚠️ BANNER_MODEL_PRICES 不是有效的JSON，使用默认价格")
+    return prices
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    prices = model_prices()
+    price = prices.get(model, prices['default'])
+    return (input_tokens * price['input'] + output_tokens * price['output']) / 1000
+
+
+def count_images(messages: List[Any]) -> int:
+    """统计消息中的图片数量"""
+    total = 0
+    for msg in messages or []:
+        content = msg.get('content') if isinstance(msg, dict) else getattr(msg, 'content', None)
+        if isinstance(content, list):
+            for item in content:
+                image = item.get('image') if isinstance(item, dict) else getattr(item, 'image', None)
+                if image:
+                    total += 1
+    return total
+
+
+class UsageLedger:
+    """单个任务的调用明细账"""
+
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record(self, **entry):
+        with self._lock:
+            self.records.append(entry)
+
+    def summary(self) -> Dict[str, Any]:
+        """按阶段、图层、Agent和模型汇总"""
+        with self._lock:
+            records = list(self.records)
+
+        def group(key: str) -> Dict[str, Dict[str, Any]]:
+            groups: Dict[str, List[Dict[str, Any]]] = {}
+            for r in records:
+                groups.setdefault(r.get(key) or 'unknown', []).append(r)
+            totals = {name: _aggregate(items) for name, items in groups.items()}
+            return dict(sorted(totals.items(), key=lambda item: -item[1]['cost']))
+
+        return {
+            'currency': CURRENCY,
+            'estimated': True,
+            'token_source': TOKEN_SOURCE,
+            'note': TOKEN_NOTE,
+            'total': _aggregate(records),
+            'by_phase': group('phase'),
+            'by_layer': group('layer'),
+            'by_agent': group('agent'),
+            'by_model': group('model'),
+            'top_calls': sorted(records, key=lambda r: -r['cost'])[:TOP_CALLS]
+        }
+
+
+def _aggregate(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        'calls': len(records),
+        'input_tokens': sum(r['input_tokens'] for r in records),
+        'output_tokens': sum(r['output_tokens'] for r in records),
+        'cost': round(sum(r['cost'] for r in records), 6),
+        'latency_seconds': round(sum(r['latency_seconds'] for r in records), 3)
+    }
+
+
+_current_ledger: contextvars.ContextVar = contextvars.ContextVar('banner_usage_ledger', default=None)
+_current_labels: contextvars.ContextVar = contextvars.ContextVar('banner_usage_labels', default={})
+
+
+@contextmanager
+def track_usage(ledger: UsageLedger):
+    """在此范围内（含派生的工作线程）发生的调用记入ledger"""
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+
+
+@contextmanager
+def usage_scope(**labels):
+    """为范围内的调用附加标签，例如 phase='layers'、layer='背景层'"""
+    token = _current_labels.set({**_current_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _current_labels.reset(token)
+
+
+def record_usage(model: str, input_tokens: int, output_tokens: int, latency: float,
+                 status: str = 'ok', **labels):
+    """记录一次模型调用；不在任何任务范围内时忽略"""
+    ledger = _current_ledger.get()
+    if ledger is None:
+        return
+    entry = {
+        **_current_labels.get(),
+        **{k: v for k, v in labels.items() if v},
+        'model': model,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'latency_seconds': round(latency, 3),
+        'cost': round(estimate_cost(model, input_tokens, output_tokens), 6),
+        'status': status
+    }
+    ledger.record(**entry)
+
+
+def write_usage_summary(work_dir: str, summary: Dict[str, Any]) -> str:
+    """把任务的用量汇总写入项目目录的 usage.json（先写临时文件再替换）"""
+    path = os.path.join(work_dir, USAGE_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_project_usage(path: str) -> Dict[str, Any]:
+    """读取项目目录的用量汇总；早期的项目只有 final_report.json 中的 usage 字段"""
+    for filename, key in ((USAGE_FILE, None), ('final_report.json', 'usage')):
+        file_path = os.path.join(path, filename)
+        if not os.path.exists(file_path):
+            continue
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        usage = data.get(key) if key else data
+        if usage:
+            return usage
+    return {}
+
+
+def summarize_projects(paths: List[str]) -> Dict[str, Any]:
+    """汇总多个项目目录的费用统计（token数和费用均为估算）"""
+    totals = {'projects': 0, 'calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0}
+    by_key = {'by_phase': {}, 'by_agent': {}, 'by_model': {}, 'by_layer': {}}
+    projects = []
+
+    for path in paths:
+        usage = load_project_usage(path)
+        if not usage:
+            continue
+
+        total = usage['total']
+        totals['projects'] += 1
+        for key in ('calls', 'input_tokens', 'output_tokens', 'cost'):
+            totals[key] += total.get(key, 0)
+        projects.append({'work_dir': path, **total})
+
+        for group_name, groups in by_key.items():
+            for name, stats in usage.get(group_name, {}).items():
+                g = groups.setdefault(name, {'calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0})
+                for key in g:
+                    g[key] += stats.get(key, 0)
+
+    totals['cost'] = round(totals['cost'], 6)
+    result = {'currency': CURRENCY, 'token_source': TOKEN_SOURCE, 'note': TOKEN_NOTE,
+              'total': totals, 'projects': projects}
+    for group_name, groups in by_key.items():
+        result[group_name] = dict(sorted(groups.items(), key=lambda item: -item[1]['cost']))
+    return result
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='汇总 banner_project_* 目录的模型调用费用')
+    parser.add_argument('paths', nargs='*', default=['banner_project_*'], help='项目目录或通配符')
+    parser.add_argument('--json', action='store_true', help='输出JSON')
+    args = parser.parse_args(argv)
+
+    paths = sorted({p for pattern in args.paths for p in (glob.glob(pattern) or [pattern]) if os.path.isdir(p)})
+    summary = summarize_projects(paths)
+
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return 0
+
+    total = summary['total']
+    print(f"项目数: {total['projects']}，调用次数: {total['calls']}，"
+          f"估算输入token: {total['input_tokens']}，估算输出token: {total['output_tokens']}，"
+          f"估算费用: {total['cost']:.4f} {CURRENCY}")
+    for group_name, title in (('by_phase', '按阶段'), ('by_agent', '按Agent'), ('by_model', '按模型')):
+        print(f"\n{title}:")
+        for name, stats in summary[group_name].items():
+            share = stats['cost'] / total['cost'] * 100 if total['cost'] else 0
+            print(f"  {name}: {stats['calls']} 次，{stats['input_tokens']}/{stats['output_tokens']} token（估算），"
+                  f"{stats['cost']:.4f} {CURRENCY}（{share:.1f}%）")
+    print(f"\n⚠️ {TOKEN_NOTE}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())